@@ -1,19 +1,28 @@
 import logging
 from aiogram import Bot, Dispatcher, types
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.filters import Command, StateFilter
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+from aiogram.filters import Command, CommandObject, StateFilter
+from aiogram.types import (
+    ReplyKeyboardMarkup,
+    KeyboardButton,
+    ReplyKeyboardRemove,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    CallbackQuery,
+)
+from aiogram.exceptions import TelegramBadRequest
 import asyncio
+import math
+from datetime import datetime
 import os
 from dotenv import load_dotenv
 import re
 from aiogram.enums import ParseMode
 
 from main import (
-    schedule_get,
     convert_schedule_to_markdown,
     get_current_week_range,
-    get_leader_group,
+    parse_date_range,
     get_leader_stream,
     create_leader_group_markdown,
     convert_leader_stream_to_markdown,
@@ -21,32 +30,88 @@ from main import (
     get_future_exams,
     convert_exams_to_markdown,
     get_auth_token,
+    is_token_expiring,
+    init_http_client,
+    close_http_client,
+    get_api_endpoint_stats,
+)
+from database.db import (
     init_db,
+    shutdown_executor,
     add_account_with_password,
-    get_active_account,
     get_active_account_full,
     has_accounts,
     get_all_accounts,
     set_active_account,
     delete_account,
-    delete_all_accounts
+    delete_all_accounts,
+    set_user_setting,
+    touch_user,
 )
-
-logging.basicConfig(level=logging.INFO)
+from auth import call_with_auth, refresh_token, token_refresher, TOKEN_REQUEST_MARGIN
+from schedule_cache import get_group_schedule, get_group_leaders, get_schedule_range
+from render import schedule_pages, convert_schedule_page_to_markdown, split_message
+from last_good import fetch_or_last_good
+from file_expiry import FileExpiryScheduler
+from snapshots import SnapshotWriter
+from outbox import Outbox, PRIORITY_INTERACTIVE
+from weekly_push import weekly_scheduler, WEEKLY_PUSH_SETTING
+from schedule_watch import schedule_watcher, SCHEDULE_CHANGES_SETTING
+from password_rotation import password_reencryption_job
+from exam_reminders import ReminderScheduler, EXAM_REMINDERS_SETTING
+from middlewares import ActivityMiddleware, ConcurrencyLimitMiddleware, MetricsMiddleware, TapGuardMiddleware
+from metrics import METRICS_PORT, register_gauge, run_metrics_server
+from logs import get_logging_stats, setup_logging
+from webhook import run_webhook
+from database.fsm_storage import MongoStorage
+from sharding import SHARD_WORKERS, ShardSupervisor, WorkerApp, receive_polling, receive_webhook
+
+setup_logging()
 load_dotenv()
 
 TOKEN = os.getenv("TOKEN")
 if not TOKEN:
     raise ValueError("Токен бота не найден")
 
+# polling или webhook (настройки webhook см. в webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Сколько апдейтов обрабатывается одновременно
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "100"))
+# Где хранить состояния диалогов: mongo (переживает перезапуск, общее для процессов) или memory
+FSM_STORAGE = os.getenv("FSM_STORAGE", "mongo")
+# Тяжелые кнопки (БД, API, файлы): сколько запросов в секунду на пользователя (с запасом),
+# и сколько секунд после ответа игнорировать повторное нажатие той же кнопки
+USER_RATE_LIMIT = float(os.getenv("USER_RATE_LIMIT", "0.5"))
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", "4"))
+TAP_DEBOUNCE = float(os.getenv("TAP_DEBOUNCE", "2"))
+# Как часто отмечать активность пользователя в БД (last_used_at, фоновое обновление токенов), с
+USER_ACTIVITY_INTERVAL = float(os.getenv("USER_ACTIVITY_INTERVAL", "3600"))
+HEAVY_ACTIONS = ("Получить расписание 📆", "Студенты группы 👥", "Топ 3 в потоке 🏆", "Будущие экзамены 📚")
+
 bot = Bot(token=TOKEN)
-storage = MemoryStorage()
+outbox = Outbox(bot)
+exam_reminders = ReminderScheduler(outbox)
+storage = MongoStorage() if FSM_STORAGE == "mongo" else MemoryStorage()
 dp = Dispatcher(storage=storage)
+concurrency_limit = ConcurrencyLimitMiddleware(UPDATE_CONCURRENCY)
+dp.update.outer_middleware(concurrency_limit)
+dp.update.outer_middleware(ActivityMiddleware(touch_user, USER_ACTIVITY_INTERVAL))
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+
+async def notify_throttled(message: types.Message, wait: float):
+    await reply(message, f"Слишком много запросов. Попробуйте через {math.ceil(wait)} с.")
+
+dp.message.outer_middleware(
+    TapGuardMiddleware(HEAVY_ACTIONS, USER_RATE_LIMIT, USER_RATE_BURST, TAP_DEBOUNCE, on_throttled=notify_throttled)
+)
 
 JSON_FOLDER = "project/JsonOut"
 MD_FOLDER = "project/MdOut"
 os.makedirs(JSON_FOLDER, exist_ok=True)
 os.makedirs(MD_FOLDER, exist_ok=True)
+file_expiry = FileExpiryScheduler([JSON_FOLDER, MD_FOLDER])
+snapshot_writer = SnapshotWriter(on_written=file_expiry.schedule)
 
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -88,43 +153,26 @@ main_submenu_markup = ReplyKeyboardMarkup(
     one_time_keyboard=False
 )
 
-# Функции для автоудаления файлов
-async def delete_file_later(file_path: str, delay_seconds: int = 1_209_600):
-    await asyncio.sleep(delay_seconds)
-    try:
-        if os.path.exists(file_path):
-            os.remove(file_path)
-            print(f"Файл {file_path} удален автоматически")
-    except Exception as e:
-        print(f"Ошибка при удалении файла {file_path}: {e}")
-
+# Сохранение файлов: запись в фоне (snapshots.py), автоудаление через FILE_TTL_SECONDS (file_expiry.py)
 def save_json_to_file(json_data: dict, file_path: str):
-    import json
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, ensure_ascii=False, indent=4)
-        print(f"JSON-файл {file_path} создан.")
-        asyncio.create_task(delete_file_later(file_path))
-    except Exception as e:
-        print(f"Ошибка при сохранении JSON: {e}")
+    snapshot_writer.enqueue_json(file_path, json_data)
 
 def save_md_file(markdown_text: str, file_path: str):
-    try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(markdown_text)
-        print(f"MD-файл {file_path} создан.")
-        asyncio.create_task(delete_file_later(file_path))
-    except Exception as e:
-        print(f"Ошибка при сохранении MD: {e}")
+    snapshot_writer.enqueue_text(file_path, markdown_text)
+
+async def reply(message: types.Message, text: str, **kwargs):
+    # Ответ пользователю через очередь исходящих сообщений (лимиты Telegram, приоритет)
+    return await outbox.send_message(message.chat.id, text, priority=PRIORITY_INTERACTIVE, **kwargs)
 
 # Хендлеры
 @dp.message(Command("start"))
 async def send_welcome(message: types.Message):
     user_id = message.from_user.id
-    if has_accounts(user_id):
-        await message.answer("Привет! Что ещё могу для вас сделать?", reply_markup=main_markup)
+    if await has_accounts(user_id):
+        await reply(message, "Привет! Что ещё могу для вас сделать?", reply_markup=main_markup)
     else:
-        await message.answer(
+        await reply(
+            message,
             "Привет! Я твой бот-помощник для расписания. Чтобы получить расписание, "
             "тебе нужно войти в журнал. Нажми кнопку ниже, чтобы начать.",
             reply_markup=login_markup
@@ -132,13 +180,13 @@ async def send_welcome(message: types.Message):
 
 @dp.message(lambda message: message.text == "Войти 🚀")
 async def process_login_button(message: types.Message, state: FSMContext):
-    await message.answer("Пожалуйста, введите ваш <b>логин</b> от журнала:", parse_mode=ParseMode.HTML)
+    await reply(message, "Пожалуйста, введите ваш <b>логин</b> от журнала:", parse_mode=ParseMode.HTML)
     await state.set_state(Form.username)
 
 @dp.message(Form.username)
 async def process_username(message: types.Message, state: FSMContext):
     await state.update_data(username=message.text)
-    await message.answer("Отлично! Теперь введите ваш <b>пароль</b>:", parse_mode=ParseMode.HTML)
+    await reply(message, "Отлично! Теперь введите ваш <b>пароль</b>:", parse_mode=ParseMode.HTML)
     await state.set_state(Form.password)
 
 @dp.message(Form.password)
@@ -148,202 +196,293 @@ async def process_password(message: types.Message, state: FSMContext):
     password = message.text
     user_id = message.from_user.id
 
-    await message.answer("Проверяю логин и пароль...", reply_markup=ReplyKeyboardRemove())
+    await reply(message, "Проверяю логин и пароль...", reply_markup=ReplyKeyboardRemove())
 
     try:
         token = await get_auth_token(username, password)
-        add_account_with_password(user_id, username, password, token)
-        await message.answer("🎉 Ваши учетные данные успешно сохранены!", parse_mode=ParseMode.HTML)
-        await message.answer("Что ещё могу для вас сделать?", reply_markup=main_markup)
+        if not await add_account_with_password(user_id, username, password, token):
+            await reply(message, "😔 Не удалось сохранить аккаунт, попробуйте войти еще раз.", reply_markup=login_markup)
+            await state.clear()
+            return
+        await reply(message, "🎉 Ваши учетные данные успешно сохранены!", parse_mode=ParseMode.HTML)
+        await reply(message, "Что ещё могу для вас сделать?", reply_markup=main_markup)
         await state.clear()
     except Exception as e:
         error_message = str(e)
         logging.error(f"Ошибка при авторизации: {error_message}")
         if "Неверный логин или пароль" in error_message:
-            await message.answer("😔 Неверный логин или пароль. Введите логин:", parse_mode=ParseMode.HTML)
+            await reply(message, "😔 Неверный логин или пароль. Введите логин:", parse_mode=ParseMode.HTML)
             await state.set_state(Form.username)
         else:
-            await message.answer(f"Произошла ошибка: {error_message}", reply_markup=main_markup)
+            await reply(message, f"Произошла ошибка: {error_message}", reply_markup=main_markup)
             await state.clear()
 
 # Главные меню и подменю
 @dp.message(lambda message: message.text == "Главная", StateFilter(None))
 async def show_main_submenu(message: types.Message):
     user_id = message.from_user.id
-    if has_accounts(user_id):
-        await message.answer("Выберите действие:", reply_markup=main_submenu_markup)
+    if await has_accounts(user_id):
+        await reply(message, "Выберите действие:", reply_markup=main_submenu_markup)
     else:
-        await message.answer("Сначала войдите в аккаунт.", reply_markup=login_markup)
+        await reply(message, "Сначала войдите в аккаунт.", reply_markup=login_markup)
 
 @dp.message(lambda message: message.text == "Назад", StateFilter(None))
 async def show_main_menu_from_submenu(message: types.Message):
-    await message.answer("Вы вернулись в главное меню.", reply_markup=main_markup)
+    await reply(message, "Вы вернулись в главное меню.", reply_markup=main_markup)
 
 # Получение расписания и файлов
 async def get_or_refresh_token(user_id: int) -> str | None:
     """
     Возвращает токен для активного аккаунта.
-    Если токен протух (401), попробует перелогиниться по сохраненному паролю и обновить токен в БД.
+    Если токена нет или он истекает, перелогинивается по сохраненному паролю и обновляет токен в БД.
     """
-    creds = get_active_account_full(user_id)
+    creds = await get_active_account_full(user_id)
     if not creds:
         return None
 
     username, token, password = creds
-    if token:
+    if token and not is_token_expiring(token, TOKEN_REQUEST_MARGIN):
         return token
 
     if not password:
         return None
 
-    new_token = await get_auth_token(username, password)
-    add_account_with_password(user_id, username, password, new_token)
-    return new_token
+    return await refresh_token(user_id, username, password)
 
-async def get_user_schedule(message: types.Message, token: str):
+async def get_user_schedule(message: types.Message, credentials: tuple):
     start_of_week, end_of_week, _ = get_current_week_range()
     user_id = message.from_user.id
     try:
-        schedule_json_data = await schedule_get(start_of_week, end_of_week, token)
+        schedule_json_data, markdown_text = await fetch_or_last_good(
+            user_id,
+            f"schedule:{start_of_week}",
+            lambda: get_group_schedule(user_id, credentials, start_of_week, end_of_week),
+            lambda data: convert_schedule_to_markdown(data, week_start=start_of_week),
+        )
 
         json_file_path = os.path.join(JSON_FOLDER, f"schedule_{user_id}.json")
         save_json_to_file(schedule_json_data, json_file_path)
 
-        markdown_text = convert_schedule_to_markdown(schedule_json_data)
         md_file_path = os.path.join(MD_FOLDER, f"schedule_{user_id}.md")
         save_md_file(markdown_text, md_file_path)
 
-        await message.answer(markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_markup)
+        await reply(message, markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_markup)
     except Exception as e:
-        # Авто-перелогин при протухшем токене
-        if "Ошибка авторизации" in str(e):
-            creds = get_active_account_full(user_id)
-            if creds:
-                username, _, password = creds
-                if password:
-                    try:
-                        new_token = await get_auth_token(username, password)
-                        add_account_with_password(user_id, username, password, new_token)
-                        schedule_json_data = await schedule_get(start_of_week, end_of_week, new_token)
-
-                        json_file_path = os.path.join(JSON_FOLDER, f"schedule_{user_id}.json")
-                        save_json_to_file(schedule_json_data, json_file_path)
-
-                        markdown_text = convert_schedule_to_markdown(schedule_json_data)
-                        md_file_path = os.path.join(MD_FOLDER, f"schedule_{user_id}.md")
-                        save_md_file(markdown_text, md_file_path)
-
-                        await message.answer(markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_markup)
-                        return
-                    except Exception as e2:
-                        await message.answer(f"Ошибка при обновлении токена: {e2}", reply_markup=main_markup)
-                        return
-
-        await message.answer(f"Ошибка при получении расписания: {e}", reply_markup=main_markup)
+        await reply(message, f"Ошибка при получении расписания: {e}", reply_markup=main_markup)
 
 @dp.message(lambda message: message.text == "Получить расписание 📆", StateFilter(None))
 async def get_schedule_button(message: types.Message):
     user_id = message.from_user.id
-    credentials = get_active_account_full(user_id)
+    credentials = await get_active_account_full(user_id)
     if credentials:
-        _, token, _ = credentials
-        await message.answer("Получаю ваше расписание...")
-        await get_user_schedule(message, token)
+        await reply(message, "Получаю ваше расписание...")
+        await get_user_schedule(message, credentials)
     else:
-        await message.answer("Сначала войдите в аккаунт.", reply_markup=login_markup)
+        await reply(message, "Сначала войдите в аккаунт.", reply_markup=login_markup)
+
+# Расписание за произвольный диапазон: /schedule [next | N | дата [дата]].
+# Диапазон листается по неделям кнопками под сообщением, рендерится только открытая страница.
+# callback_data: sch:<начало>:<конец>:<неделя>:<часть> (часть - если неделя длиннее лимита сообщения)
+SCHEDULE_PAGE_PREFIX = "sch"
+
+def schedule_page_markup(start, end, page: int, part: int, pages: int, parts: int) -> InlineKeyboardMarkup | None:
+    def data(to_page: int, to_part: int) -> str:
+        return f"{SCHEDULE_PAGE_PREFIX}:{start:%Y%m%d}:{end:%Y%m%d}:{to_page}:{to_part}"
+
+    buttons = []
+    if part > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=data(page, part - 1)))
+    elif page > 0:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=data(page - 1, 0)))
+    if pages > 1:
+        buttons.append(InlineKeyboardButton(text=f"{page + 1}/{pages}", callback_data=data(page, part)))
+    if part + 1 < parts:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=data(page, part + 1)))
+    elif page + 1 < pages:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=data(page + 1, 0)))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+async def render_schedule_page(user_id: int, credentials: tuple, start, end, page: int = 0, part: int = 0) -> tuple:
+    # Возвращает (текст, клавиатура) одной страницы диапазона
+    pages = schedule_pages(start, end)
+    page = min(max(page, 0), len(pages) - 1)
+    page_start, page_end = pages[page]
+    data = await get_schedule_range(user_id, credentials, page_start, page_end)
+    parts = split_message(convert_schedule_page_to_markdown(data, page_start, page_end)) or [""]
+    part = min(max(part, 0), len(parts) - 1)
+    return parts[part], schedule_page_markup(start, end, page, part, len(pages), len(parts))
+
+@dp.message(Command("schedule"), StateFilter(None))
+async def schedule_range_command(message: types.Message, command: CommandObject):
+    user_id = message.from_user.id
+    try:
+        start, end = parse_date_range(command.args)
+    except ValueError as e:
+        await reply(message, str(e))
+        return
+    credentials = await get_active_account_full(user_id)
+    if not credentials:
+        await reply(message, "Сначала войдите в аккаунт.", reply_markup=login_markup)
+        return
+
+    await reply(message, "Получаю ваше расписание...")
+    try:
+        # Весь диапазон загружается сразу (недостающие недели - одним запросом),
+        # листание дальше идет по кэшу
+        await get_schedule_range(user_id, credentials, start, end)
+        text, markup = await render_schedule_page(user_id, credentials, start, end)
+        await reply(message, text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=markup)
+    except Exception as e:
+        await reply(message, f"Ошибка при получении расписания: {e}", reply_markup=main_markup)
+
+@dp.callback_query(lambda callback: (callback.data or "").startswith(f"{SCHEDULE_PAGE_PREFIX}:"))
+async def schedule_page_callback(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    try:
+        _, start, end, page, part = callback.data.split(":")
+        start, end = datetime.strptime(start, "%Y%m%d").date(), datetime.strptime(end, "%Y%m%d").date()
+        page, part = int(page), int(part)
+    except ValueError:
+        await callback.answer()
+        return
+    credentials = await get_active_account_full(user_id)
+    if not credentials:
+        await callback.answer("Сначала войдите в аккаунт.", show_alert=True)
+        return
+
+    try:
+        text, markup = await render_schedule_page(user_id, credentials, start, end, page, part)
+        # Через outbox: быстрое листание упирается в те же лимиты Telegram, что и ответы
+        await outbox.edit_message_text(
+            callback.message.chat.id, callback.message.message_id, text,
+            parse_mode=ParseMode.MARKDOWN_V2, reply_markup=markup,
+        )
+    except TelegramBadRequest:
+        # Нажата кнопка текущей страницы: текст не изменился
+        pass
+    except Exception as e:
+        await callback.answer(f"Ошибка при получении расписания: {e}", show_alert=True)
+        return
+    await callback.answer()
 
 # Остальные хендлеры (группа, топ-3, экзамены)
 @dp.message(lambda message: message.text == "Студенты группы 👥", StateFilter(None))
 async def get_group_leaders_button(message: types.Message):
     user_id = message.from_user.id
-    credentials = get_active_account_full(user_id)
+    credentials = await get_active_account_full(user_id)
     if credentials:
-        username, token, password = credentials
-        await message.answer("Получаю список студентов группы...")
+        await reply(message, "Получаю список студентов группы...")
         try:
-            try:
-                json_data = await get_leader_group(token)
-            except Exception as e:
-                if "Ошибка авторизации" in str(e) and password:
-                    new_token = await get_auth_token(username, password)
-                    add_account_with_password(user_id, username, password, new_token)
-                    json_data = await get_leader_group(new_token)
-                else:
-                    raise
-            markdown_text = create_leader_group_markdown(json_data)
+            json_data, markdown_text = await fetch_or_last_good(
+                user_id, "leader_group", lambda: get_group_leaders(user_id, credentials), create_leader_group_markdown
+            )
 
             json_file_path = os.path.join(JSON_FOLDER, f"group_leaders_{user_id}.json")
             save_json_to_file(json_data, json_file_path)
             md_file_path = os.path.join(MD_FOLDER, f"group_leaders_{user_id}.md")
             save_md_file(markdown_text, md_file_path)
 
-            await message.answer(markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
+            await reply(message, markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
         except Exception as e:
-            await message.answer(f"Ошибка при получении студентов группы: {e}", reply_markup=main_submenu_markup)
+            await reply(message, f"Ошибка при получении студентов группы: {e}", reply_markup=main_submenu_markup)
 
 @dp.message(lambda message: message.text == "Топ 3 в потоке 🏆", StateFilter(None))
 async def get_stream_leaders_button(message: types.Message):
     user_id = message.from_user.id
-    credentials = get_active_account_full(user_id)
+    credentials = await get_active_account_full(user_id)
     if credentials:
-        username, token, password = credentials
-        await message.answer("Получаю топ-3 студентов потока...")
+        await reply(message, "Получаю топ-3 студентов потока...")
         try:
-            try:
-                json_data = await get_leader_stream(token)
-            except Exception as e:
-                if "Ошибка авторизации" in str(e) and password:
-                    new_token = await get_auth_token(username, password)
-                    add_account_with_password(user_id, username, password, new_token)
-                    json_data = await get_leader_stream(new_token)
-                else:
-                    raise
-            markdown_text = convert_leader_stream_to_markdown(json_data)
+            async def fetch():
+                data = await call_with_auth(user_id, credentials, get_leader_stream)
+                return data, convert_leader_stream_to_markdown(data)
+
+            json_data, markdown_text = await fetch_or_last_good(
+                user_id, "leader_stream", fetch, convert_leader_stream_to_markdown
+            )
 
             json_file_path = os.path.join(JSON_FOLDER, f"stream_leaders_{user_id}.json")
             save_json_to_file(json_data, json_file_path)
             md_file_path = os.path.join(MD_FOLDER, f"stream_leaders_{user_id}.md")
             save_md_file(markdown_text, md_file_path)
 
-            await message.answer(markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
+            await reply(message, markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
         except Exception as e:
-            await message.answer(f"Ошибка при получении топ-3: {e}", reply_markup=main_submenu_markup)
+            await reply(message, f"Ошибка при получении топ-3: {e}", reply_markup=main_submenu_markup)
 
 @dp.message(lambda message: message.text == "Будущие экзамены 📚", StateFilter(None))
 async def get_exams_button(message: types.Message):
     user_id = message.from_user.id
-    credentials = get_active_account_full(user_id)
+    credentials = await get_active_account_full(user_id)
     if credentials:
-        username, token, password = credentials
-        await message.answer("Получаю список будущих экзаменов...")
+        await reply(message, "Получаю список будущих экзаменов...")
         try:
-            try:
-                json_data = await get_future_exams(token)
-            except Exception as e:
-                if "Ошибка авторизации" in str(e) and password:
-                    new_token = await get_auth_token(username, password)
-                    add_account_with_password(user_id, username, password, new_token)
-                    json_data = await get_future_exams(new_token)
-                else:
-                    raise
-            markdown_text = convert_exams_to_markdown(json_data)
+            async def fetch():
+                data = await call_with_auth(user_id, credentials, get_future_exams)
+                return data, convert_exams_to_markdown(data)
+
+            json_data, markdown_text = await fetch_or_last_good(user_id, "future_exams", fetch, convert_exams_to_markdown)
 
             json_file_path = os.path.join(JSON_FOLDER, f"exams_{user_id}.json")
             save_json_to_file(json_data, json_file_path)
             md_file_path = os.path.join(MD_FOLDER, f"exams_{user_id}.md")
             save_md_file(markdown_text, md_file_path)
 
-            await message.answer(markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
+            await reply(message, markdown_text, parse_mode=ParseMode.MARKDOWN_V2, reply_markup=main_submenu_markup)
         except Exception as e:
-            await message.answer(f"Ошибка при получении экзаменов: {e}", reply_markup=main_submenu_markup)
+            await reply(message, f"Ошибка при получении экзаменов: {e}", reply_markup=main_submenu_markup)
+
+# Подписка на еженедельную рассылку расписания
+@dp.message(Command("weekly_on"))
+async def weekly_push_on(message: types.Message):
+    await set_user_setting(message.from_user.id, WEEKLY_PUSH_SETTING, True)
+    await reply(message, "Буду присылать расписание в начале каждой недели 📬", reply_markup=main_markup)
+
+@dp.message(Command("weekly_off"))
+async def weekly_push_off(message: types.Message):
+    await set_user_setting(message.from_user.id, WEEKLY_PUSH_SETTING, False)
+    await reply(message, "Еженедельная рассылка расписания отключена.", reply_markup=main_markup)
+
+# Подписка на уведомления об изменениях расписания
+@dp.message(Command("changes_on"))
+async def schedule_changes_on(message: types.Message):
+    await set_user_setting(message.from_user.id, SCHEDULE_CHANGES_SETTING, True)
+    await reply(message, "Сообщу, если в расписании добавят, отменят или перенесут пары 🔔", reply_markup=main_markup)
+
+@dp.message(Command("changes_off"))
+async def schedule_changes_off(message: types.Message):
+    await set_user_setting(message.from_user.id, SCHEDULE_CHANGES_SETTING, False)
+    await reply(message, "Уведомления об изменениях расписания отключены.", reply_markup=main_markup)
+
+# Подписка на напоминания об экзаменах
+@dp.message(Command("exams_on"))
+async def exam_reminders_on(message: types.Message):
+    user_id = message.from_user.id
+    if not await has_accounts(user_id):
+        await reply(message, "Сначала войдите в аккаунт.", reply_markup=login_markup)
+        return
+    await set_user_setting(user_id, EXAM_REMINDERS_SETTING, True)
+    try:
+        await exam_reminders.refresh_user(user_id)
+    except Exception as e:
+        # Напоминания создаст следующее плановое обновление списков экзаменов
+        logging.warning("Не удалось загрузить экзамены пользователя %d: %s", user_id, e)
+    await reply(message, "Напомню об экзаменах за несколько дней и накануне ⏰", reply_markup=main_markup)
+
+@dp.message(Command("exams_off"))
+async def exam_reminders_off(message: types.Message):
+    user_id = message.from_user.id
+    await set_user_setting(user_id, EXAM_REMINDERS_SETTING, False)
+    await exam_reminders.disable_user(user_id)
+    await reply(message, "Напоминания об экзаменах отключены.", reply_markup=main_markup)
 
 # Управление аккаунтами
 @dp.message(lambda message: message.text == "Управление аккаунтами ⚙️", StateFilter(None))
 async def manage_accounts(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    accounts = get_all_accounts(user_id)
+    accounts = await get_all_accounts(user_id)
     if not accounts:
-        await message.answer("У вас нет сохраненных аккаунтов. Пожалуйста, войдите, чтобы добавить аккаунт.", reply_markup=login_markup)
+        await reply(message, "У вас нет сохраненных аккаунтов. Пожалуйста, войдите, чтобы добавить аккаунт.", reply_markup=login_markup)
         return
     
     keyboard_buttons = []
@@ -357,7 +496,7 @@ async def manage_accounts(message: types.Message, state: FSMContext):
 
     markup = ReplyKeyboardMarkup(keyboard=keyboard_buttons, resize_keyboard=True, one_time_keyboard=True)
 
-    await message.answer("Выберите аккаунт, чтобы сделать его активным, или выполните другое действие:", reply_markup=markup)
+    await reply(message, "Выберите аккаунт, чтобы сделать его активным, или выполните другое действие:", reply_markup=markup)
     await state.set_state(AccountManagement.choosing_account)
 
 @dp.message(AccountManagement.choosing_account)
@@ -366,12 +505,12 @@ async def process_account_choice(message: types.Message, state: FSMContext):
     text = message.text
 
     if text == "Добавить новый аккаунт ➕":
-        await message.answer("Хорошо, давайте добавим новый аккаунт. Пожалуйста, введите ваш <b>логин</b>:", parse_mode=ParseMode.HTML)
+        await reply(message, "Хорошо, давайте добавим новый аккаунт. Пожалуйста, введите ваш <b>логин</b>:", parse_mode=ParseMode.HTML)
         await state.set_state(Form.username)
     elif text == "Удалить аккаунт 🗑️":
-        accounts = get_all_accounts(user_id)
+        accounts = await get_all_accounts(user_id)
         if not accounts:
-            await message.answer("У вас нет аккаунтов для удаления.", reply_markup=main_markup)
+            await reply(message, "У вас нет аккаунтов для удаления.", reply_markup=main_markup)
             await state.clear()
             return
         
@@ -382,16 +521,16 @@ async def process_account_choice(message: types.Message, state: FSMContext):
         
         markup = ReplyKeyboardMarkup(keyboard=keyboard_buttons, resize_keyboard=True, one_time_keyboard=True)
         
-        await message.answer("Выберите аккаунт для удаления:", reply_markup=markup)
+        await reply(message, "Выберите аккаунт для удаления:", reply_markup=markup)
         await state.set_state(AccountManagement.deleting_account)
     elif text == "Назад":
-        await message.answer("Вы вернулись в главное меню.", reply_markup=main_markup)
+        await reply(message, "Вы вернулись в главное меню.", reply_markup=main_markup)
         await state.clear()
     else:
         # Убираем маркер активного аккаунта при обработке выбора
         username = re.sub(r"✅ (.*)", r"\1", text)
-        set_active_account(user_id, username)
-        await message.answer(f"Аккаунт <b>{username}</b> теперь активен!", parse_mode=ParseMode.HTML, reply_markup=main_markup)
+        await set_active_account(user_id, username)
+        await reply(message, f"Аккаунт <b>{username}</b> теперь активен!", parse_mode=ParseMode.HTML, reply_markup=main_markup)
         await state.clear()
 
 @dp.message(AccountManagement.deleting_account)
@@ -400,16 +539,11 @@ async def process_delete_account(message: types.Message, state: FSMContext):
     username_to_delete = message.text
     
     if username_to_delete == "Отмена":
-        await message.answer("Удаление аккаунта отменено.", reply_markup=main_markup)
+        await reply(message, "Удаление аккаунта отменено.", reply_markup=main_markup)
     else:
-        delete_account(user_id, username_to_delete)
-        active_account = get_active_account(user_id)
-        if not active_account and has_accounts(user_id):
-            accounts = get_all_accounts(user_id)
-            if accounts:
-                set_active_account(user_id, accounts[0][0])
-
-        await message.answer(f"Аккаунт <b>{username_to_delete}</b> удален.", parse_mode=ParseMode.HTML, reply_markup=main_markup)
+        # Если удален активный аккаунт, delete_account в том же обновлении делает активным первый оставшийся
+        await delete_account(user_id, username_to_delete)
+        await reply(message, f"Аккаунт <b>{username_to_delete}</b> удален.", parse_mode=ParseMode.HTML, reply_markup=main_markup)
 
     await state.clear()
 
@@ -417,12 +551,90 @@ async def process_delete_account(message: types.Message, state: FSMContext):
 @dp.message(lambda message: message.text == "Выйти 🚪", StateFilter(None))
 async def logout_button(message: types.Message):
     user_id = message.from_user.id
-    delete_all_accounts(user_id)
-    await message.answer("Вы вышли из всех аккаунтов.", reply_markup=login_markup)
+    await delete_all_accounts(user_id)
+    # Без аккаунта напоминания об экзаменах не обновить: подписка снимается вместе с ними
+    await set_user_setting(user_id, EXAM_REMINDERS_SETTING, False)
+    await exam_reminders.disable_user(user_id)
+    await reply(message, "Вы вышли из всех аккаунтов.", reply_markup=login_markup)
+
+def health_status() -> dict:
+    return {
+        "mode": BOT_MODE,
+        "active_updates": concurrency_limit.active,
+        "outbox_depth": outbox.depth,
+        "api": get_api_endpoint_stats(),
+    }
+
+register_gauge("bot_active_updates", "Апдейтов в обработке", lambda: concurrency_limit.active)
+register_gauge("bot_outbox_depth", "Сообщений в очереди отправки", lambda: outbox.depth)
+register_gauge("bot_snapshots_pending", "Снимков в очереди записи на диск", snapshot_writer.pending)
+register_gauge("bot_exam_reminders", "Напоминания об экзаменах", exam_reminders.stats)
+register_gauge("bot_logging", "Очередь логов: в очереди, отброшено (из них WARNING и выше), пропущено сэмплированием", get_logging_stats)
+
+async def startup(run_jobs: bool = True, metrics_port: int = METRICS_PORT) -> list:
+    # Подключения и фоновые задачи процесса. Общие задачи (токены, рассылки)
+    # в многопроцессном режиме запускаются только в одном процессе
+    await init_db()
+    init_http_client()
+    background_tasks = [
+        asyncio.create_task(file_expiry.run()),
+        asyncio.create_task(snapshot_writer.run()),
+        asyncio.create_task(outbox.run()),
+        asyncio.create_task(run_metrics_server(metrics_port)),
+    ]
+    if run_jobs:
+        background_tasks += [
+            asyncio.create_task(token_refresher()),
+            asyncio.create_task(weekly_scheduler(outbox)),
+            asyncio.create_task(schedule_watcher(outbox)),
+            asyncio.create_task(password_reencryption_job()),
+            asyncio.create_task(exam_reminders.run()),
+            asyncio.create_task(exam_reminders.refresh_loop()),
+        ]
+    return background_tasks
+
+async def shutdown(background_tasks: list):
+    for task in background_tasks:
+        task.cancel()
+    await snapshot_writer.flush()
+    await close_http_client()
+    await bot.session.close()
+    shutdown_executor()
+
+async def create_shard_worker(index: int, workers: int) -> WorkerApp:
+    # Фабрика рабочего процесса для sharding.ShardSupervisor
+    # У каждого процесса свои метрики и свой порт: METRICS_PORT + index
+    background_tasks = await startup(run_jobs=index == 0, metrics_port=METRICS_PORT + index if METRICS_PORT else 0)
+    return WorkerApp(dp, bot, on_shutdown=lambda: shutdown(background_tasks))
+
+async def run_sharded():
+    # Лимит Telegram на бота (скорость и запас) делится между процессами
+    # (лимит на чат не меняется: чат всегда в одном процессе)
+    worker_env = {"OUTBOX_PROCESSES": str(SHARD_WORKERS)}
+    supervisor = ShardSupervisor(SHARD_WORKERS, create_shard_worker, worker_env=worker_env)
+    await supervisor.start()
+    try:
+        if BOT_MODE == "webhook":
+            await receive_webhook(bot, dp, supervisor)
+        else:
+            await receive_polling(bot, dp, supervisor)
+    finally:
+        await supervisor.stop()
+        await bot.session.close()
 
 async def main():
-    init_db()
-    await dp.start_polling(bot)
+    if SHARD_WORKERS > 1:
+        await run_sharded()
+        return
+
+    background_tasks = await startup()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot, health=health_status)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        await shutdown(background_tasks)
 
 if __name__ == '__main__':
     asyncio.run(main())
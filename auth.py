@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+from cache import SingleFlight
+from metrics import TOKEN_REFRESHES
+from main import AuthError, get_auth_token, is_token_expiring
+from resilience import UpstreamUnavailable
+from database.db import (
+    get_active_account_full,
+    get_accounts_expiring_before,
+    update_account_token,
+    record_token_refresh_failure,
+)
+
+# Авторизованные запросы к API журнала с автоматическим перелогином.
+# Одновременные 401 по одному аккаунту приводят к одному логину: остальные
+# запросы ждут его результат (single-flight). Фоновая задача token_refresher
+# обновляет токены заранее по времени истечения из JWT - только активных аккаунтов
+# недавно писавших боту пользователей (main.TOKEN_REFRESH_ACTIVE_WINDOW)
+
+# Запас до истечения токена, при котором запрос пользователя сначала обновит токен
+TOKEN_REQUEST_MARGIN = float(os.getenv("TOKEN_REQUEST_MARGIN", "30"))
+# Фоновое обновление: как часто проверять и за сколько до истечения обновлять
+TOKEN_REFRESH_INTERVAL = float(os.getenv("TOKEN_REFRESH_INTERVAL", "60"))
+TOKEN_REFRESH_MARGIN = float(os.getenv("TOKEN_REFRESH_MARGIN", "900"))
+TOKEN_REFRESH_CONCURRENCY = int(os.getenv("TOKEN_REFRESH_CONCURRENCY", "5"))
+TOKEN_REFRESH_JITTER = float(os.getenv("TOKEN_REFRESH_JITTER", "20"))
+TOKEN_REFRESH_BATCH = int(os.getenv("TOKEN_REFRESH_BATCH", "500"))
+
+_refresh_flight = SingleFlight()
+
+
+async def refresh_token(user_id: int, username: str, password: str) -> str:
+    # Перелогин по сохраненному паролю. В БД обновляется только токен.
+    # Неудача откладывает фоновое обновление аккаунта (неверный пароль - до следующего входа),
+    # чтобы один и тот же аккаунт не отправлялся на логин каждый цикл token_refresher.
+    # Недоступность API журнала аккаунт не откладывает: ее ограничивает circuit breaker
+    async def login():
+        logging.info("Обновление токена аккаунта %s для пользователя %d", username, user_id)
+        try:
+            token = await get_auth_token(username, password)
+        except UpstreamUnavailable:
+            TOKEN_REFRESHES.inc("error")
+            raise
+        except Exception as e:
+            TOKEN_REFRESHES.inc("error")
+            await record_token_refresh_failure(user_id, username, permanent=isinstance(e, AuthError))
+            raise
+        TOKEN_REFRESHES.inc("ok")
+        await update_account_token(user_id, username, token)
+        return token
+
+    return await _refresh_flight.do((user_id, username), login)
+
+
+async def call_with_auth(user_id: int, credentials: tuple, request):
+    """
+    Выполняет request(token) от имени активного аккаунта.
+    При 401 обновляет токен (один логин на аккаунт) и повторяет запрос один раз.
+    """
+    username, token, password = credentials
+    # Токен уже истек (фоновое обновление не успело) - не тратим запрос на заведомый 401
+    if password and (not token or is_token_expiring(token, TOKEN_REQUEST_MARGIN)):
+        token = await refresh_token(user_id, username, password)
+    try:
+        return await request(token)
+    except AuthError:
+        if not password:
+            raise
+
+    # Токен мог уже обновить параллельный запрос, пока этот ждал ответа
+    current = await get_active_account_full(user_id)
+    if current and current[0] == username and current[1] and current[1] != token:
+        new_token = current[1]
+    else:
+        new_token = await refresh_token(user_id, username, password)
+    return await request(new_token)
+
+
+async def _refresh_one(semaphore: asyncio.Semaphore, user_id: int, username: str, password: str):
+    # Случайная задержка размывает пик логинов, если много токенов выдано одновременно
+    await asyncio.sleep(random.uniform(0, TOKEN_REFRESH_JITTER))
+    async with semaphore:
+        try:
+            await refresh_token(user_id, username, password)
+        except Exception as e:
+            logging.warning("Фоновое обновление токена %s (пользователь %d) не удалось: %s", username, user_id, e)
+
+
+async def token_refresher():
+    # Фоновая задача: обновляет токены незадолго до истечения, чтобы запросы
+    # пользователей почти никогда не ждали логина
+    semaphore = asyncio.Semaphore(TOKEN_REFRESH_CONCURRENCY)
+    while True:
+        try:
+            deadline = datetime.now(timezone.utc) + timedelta(seconds=TOKEN_REFRESH_MARGIN)
+            accounts = await get_accounts_expiring_before(deadline, TOKEN_REFRESH_BATCH)
+            if accounts:
+                logging.info("Фоновое обновление токенов: %d аккаунтов", len(accounts))
+                await asyncio.gather(*(_refresh_one(semaphore, *account) for account in accounts))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Ошибка фонового обновления токенов: %s", e)
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
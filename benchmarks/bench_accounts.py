@@ -0,0 +1,109 @@
+# Горячие чтения и смена активного аккаунта: старая модель (документ на аккаунт, флаг is_active)
+# против документа пользователя (users, поиск по _id, смена одним обновлением).
+# Также измеряется перенос старой коллекции (main.migrate_legacy_accounts).
+# Нужна доступная MongoDB (MONGODB_URI), данные пишутся в базу MONGODB_DB=journalbot_bench_accounts
+# и удаляются после запуска.
+# Запуск: python -m benchmarks.bench_accounts [--users 20000] [--accounts-per-user 2] [--ops 5000]
+import argparse
+import logging
+import os
+import random
+import time
+
+os.environ.setdefault("MONGODB_DB", "journalbot_bench_accounts")
+
+import main
+
+TOKEN = "header.payload.signature"
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def timed(name: str, func, user_ids: list):
+    latencies = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        func(user_id)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    print(
+        f"{name:<38} p50 {percentile(latencies, 0.50) * 1e6:8.0f} us   "
+        f"p99 {percentile(latencies, 0.99) * 1e6:8.0f} us   total {sum(latencies):6.2f} s"
+    )
+
+
+def seed_legacy(users: int, accounts_per_user: int, batch: int = 5000):
+    legacy = main.legacy_accounts_col
+    legacy.create_index([("user_id", 1), ("username", 1)], unique=True)
+    legacy.create_index([("is_active", 1), ("user_id", 1)])
+    docs = []
+    for user_id in range(users):
+        for n in range(accounts_per_user):
+            docs.append({
+                "user_id": user_id, "username": f"student{user_id}_{n}", "token": TOKEN,
+                "password_enc": "gAAAA-bench", "group": f"G-{user_id % 50}", "is_active": n == 0,
+            })
+            if len(docs) >= batch:
+                legacy.insert_many(docs, ordered=False)
+                docs = []
+    if docs:
+        legacy.insert_many(docs, ordered=False)
+
+
+def legacy_read(user_id: int):
+    main.legacy_accounts_col.find_one({"user_id": user_id, "is_active": True}, {"username": 1, "token": 1, "password_enc": 1})
+
+
+def legacy_switch(user_id: int):
+    # Старая смена: два обновления, между ними у пользователя нет активного аккаунта
+    main.legacy_accounts_col.update_many({"user_id": user_id}, {"$set": {"is_active": False}})
+    main.legacy_accounts_col.update_one({"user_id": user_id, "username": f"student{user_id}_1"}, {"$set": {"is_active": True}})
+
+
+def users_read(user_id: int):
+    main._active_from_doc(main.users_col.find_one({"_id": user_id}, {"active": 1, "accounts": 1}))
+
+
+def users_switch(user_id: int):
+    main.set_active_account(user_id, f"student{user_id}_1")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--accounts-per-user", type=int, default=2)
+    parser.add_argument("--ops", type=int, default=5_000, help="операций каждого вида")
+    args = parser.parse_args()
+    # Логи каждой операции исказили бы замеры
+    logging.disable(logging.INFO)
+
+    main.init_db()
+    db = main.mongo_client[main.MONGODB_DB]
+    main.mongo_client.drop_database(main.MONGODB_DB)
+    main.init_db()
+    try:
+        started = time.perf_counter()
+        seed_legacy(args.users, args.accounts_per_user)
+        print(f"seeded {args.users * args.accounts_per_user} legacy accounts in {time.perf_counter() - started:.1f} s")
+
+        started = time.perf_counter()
+        migrated = main.migrate_legacy_accounts()
+        print(f"migrated {migrated} users in {time.perf_counter() - started:.1f} s")
+
+        user_ids = [random.randrange(args.users) for _ in range(args.ops)]
+        # Без кэша аккаунтов: измеряется обращение к MongoDB
+        main.account_cache.clear()
+        timed("legacy: active account (user_id, is_active)", legacy_read, user_ids)
+        timed("users:  active account (_id)", users_read, user_ids)
+        timed("legacy: switch (2 updates)", legacy_switch, user_ids)
+        timed("users:  switch (1 pipeline update)", users_switch, user_ids)
+        print(f"legacy collection: {db.command('collstats', main.MONGODB_COLLECTION)['totalIndexSize'] / 1e6:.1f} MB indexes")
+        print(f"users collection:  {db.command('collstats', main.MONGODB_USERS_COLLECTION)['totalIndexSize'] / 1e6:.1f} MB indexes")
+    finally:
+        main.mongo_client.drop_database(main.MONGODB_DB)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,78 @@
+# Задержка event loop при конкурентных запросах к БД: синхронный pymongo vs database.db
+# Запуск: python -m benchmarks.bench_db_event_loop [--users 200] [--latency-ms 5]
+import argparse
+import asyncio
+import statistics
+import time
+
+import main
+from database import db
+
+
+class SlowCollection:
+    # Имитация коллекции MongoDB с фиксированной задержкой ответа
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def find_one(self, query, projection=None):
+        time.sleep(self.latency)
+        username = f"user{query['_id']}"
+        return {"_id": query["_id"], "active": username, "accounts": [{"username": username, "token": "token"}]}
+
+    def count_documents(self, query):
+        time.sleep(self.latency)
+        return 1
+
+
+async def measure_lag(stop: asyncio.Event, interval: float = 0.001) -> list[float]:
+    # Насколько позже запланированного просыпается корутина
+    lags = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+    return lags
+
+
+async def run(mode: str, users: int) -> tuple[float, list[float]]:
+    async def handler(user_id: int):
+        if mode == "sync":
+            main.get_active_account_full(user_id)
+        else:
+            await db.get_active_account_full(user_id)
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    return elapsed, await lag_task
+
+
+def report(mode: str, elapsed: float, lags: list[float]):
+    lags_ms = sorted(lag * 1000 for lag in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(
+        f"{mode:>5}: total {elapsed * 1000:8.1f} ms | loop lag mean {statistics.mean(lags_ms):7.2f} ms, "
+        f"p99 {p99:7.2f} ms, max {lags_ms[-1]:7.2f} ms"
+    )
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    main.users_col = SlowCollection(args.latency_ms / 1000)
+    for mode in ("sync", "async"):
+        # Иначе второй режим читает активные аккаунты из кэша, заполненного первым
+        main.account_cache.clear()
+        elapsed, lags = asyncio.run(run(mode, args.users))
+        report(mode, elapsed, lags)
+    db.shutdown_executor()
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,87 @@
+# Стоимость логирования для вызывающего кода (event loop): синхронный StreamHandler
+# (как logging.basicConfig) против очереди с фоновым потоком (logs.py), с сэмплированием и без.
+# Записи идут в файл во временном каталоге; --sink-latency-us имитирует медленный поток вывода.
+# Запуск: python -m benchmarks.bench_logging [--records 50000] [--sink-latency-us 0]
+import argparse
+import logging
+import os
+import queue
+import tempfile
+import time
+from logging.handlers import QueueListener
+
+from logs import AsyncQueueHandler, JsonFormatter, SamplingFilter, TEXT_FORMAT, log_fields
+
+
+class SlowStream:
+    # Файл, каждая запись в который занимает не меньше latency секунд (busy wait)
+    def __init__(self, path: str, latency: float):
+        self._file = open(path, "w", encoding="utf-8")
+        self.latency = latency
+
+    def write(self, text: str):
+        if self.latency:
+            deadline = time.perf_counter() + self.latency
+            while time.perf_counter() < deadline:
+                pass
+        self._file.write(text)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def run_case(label: str, handler: logging.Handler, records: int, sample: bool, listener: QueueListener | None = None):
+    logger = logging.getLogger(f"bench.{label}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    if listener:
+        listener.start()
+
+    started = time.perf_counter()
+    for n in range(records):
+        logger.info(
+            "Активный аккаунт для пользователя %d получен из БД", n,
+            extra=log_fields("get_active_account", user_id=n, latency=0.0012, sample=sample),
+        )
+    caller = time.perf_counter() - started
+    if listener:
+        listener.stop()
+    total = time.perf_counter() - started
+    logger.removeHandler(handler)
+    print(f"{label:<28} caller {caller / records * 1e6:7.2f} us/record   until written {total:7.3f} s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=50_000)
+    parser.add_argument("--sink-latency-us", type=float, default=0.0, help="задержка записи одной строки")
+    args = parser.parse_args()
+    latency = args.sink_latency_us / 1e6
+
+    with tempfile.TemporaryDirectory() as tmp:
+        def sink(name: str) -> logging.StreamHandler:
+            return logging.StreamHandler(SlowStream(os.path.join(tmp, f"{name}.log"), latency))
+
+        handler = sink("sync_text")
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        run_case("sync text (basicConfig)", handler, args.records, sample=False)
+
+        handler = sink("sync_json")
+        handler.setFormatter(JsonFormatter())
+        run_case("sync json", handler, args.records, sample=False)
+
+        for label, sample in (("queue json", False), ("queue json, sampled 1%", True)):
+            output = sink(label.replace(" ", "_"))
+            output.setFormatter(JsonFormatter())
+            # Очередь без ограничения: замеряется стоимость, а не отбрасывание записей
+            queue_handler = AsyncQueueHandler(queue.Queue())
+            queue_handler.addFilter(SamplingFilter(0.01))
+            run_case(label, queue_handler, args.records, sample, QueueListener(queue_handler.queue, output))
+
+
+if __name__ == "__main__":
+    main_cli()
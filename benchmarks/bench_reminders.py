@@ -0,0 +1,91 @@
+# Очередь напоминаний об экзаменах: построение из БД, память на запись и отправка наступивших пачками.
+# MongoDB и Telegram заменены функциями в памяти (измеряется сам планировщик).
+# Запуск: python -m benchmarks.bench_reminders [--reminders 50000] [--batch 200]
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import exam_reminders
+from exam_reminders import ReminderScheduler
+
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+
+
+def make_store(reminders: int, due_fraction: float) -> dict:
+    # _id -> документ; доля due_fraction уже наступила
+    now = datetime.now(timezone.utc)
+    store = {}
+    for n in range(reminders):
+        user_id = 10_000_000 + n // 4
+        due_at = now - timedelta(seconds=1) if random.random() < due_fraction else now + timedelta(days=random.uniform(1, 60))
+        reminder_id = f"{user_id}:2026-12-{1 + n % 28:02d}:{1 + n % 3}:{n:08x}"
+        store[reminder_id] = {
+            "_id": reminder_id, "user_id": user_id, "due_at": due_at.replace(tzinfo=None),
+            "exam_date": "2099-12-01", "spec": f"Экзамен {n % 40}", "days_before": 1 + n % 3,
+        }
+    return store
+
+
+def install_fake_db(store: dict):
+    ordered = sorted(store)
+
+    async def get_pending_reminders_page(after_id=None, limit=5000):
+        start = 0 if after_id is None else ordered.index(after_id) + 1
+        return [(reminder_id, store[reminder_id]["due_at"]) for reminder_id in ordered[start:start + limit]]
+
+    async def claim_reminders(reminder_ids):
+        return [store.pop(reminder_id) for reminder_id in reminder_ids if reminder_id in store]
+
+    exam_reminders.get_pending_reminders_page = get_pending_reminders_page
+    exam_reminders.claim_reminders = claim_reminders
+
+
+async def run(args):
+    store = make_store(args.reminders, args.due_fraction)
+    install_fake_db(store)
+    outbox = FakeOutbox()
+    scheduler = ReminderScheduler(outbox, batch_size=args.batch)
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    await scheduler.load()
+    load_seconds = time.perf_counter() - started
+    heap_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"load:    {len(scheduler._heap)} reminders in {load_seconds * 1000:.1f} ms, "
+          f"~{heap_bytes / max(len(scheduler._heap), 1):.0f} bytes per entry")
+
+    started = time.perf_counter()
+    for _ in range(args.pushes):
+        scheduler.push(time.time() + random.uniform(0, 86400 * 30), "push")
+    print(f"push:    {(time.perf_counter() - started) / args.pushes * 1e6:.2f} us/op (heap {len(scheduler._heap)})")
+
+    started = time.perf_counter()
+    batches = 0
+    while await scheduler.deliver_due():
+        batches += 1
+    elapsed = time.perf_counter() - started
+    print(f"deliver: {outbox.sent} reminders in {batches} batches, {elapsed * 1000:.1f} ms")
+    print(f"stats:   {scheduler.stats()}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--reminders", type=int, default=50_000)
+    parser.add_argument("--due-fraction", type=float, default=0.1, help="доля уже наступивших напоминаний")
+    parser.add_argument("--pushes", type=int, default=10_000)
+    parser.add_argument("--batch", type=int, default=200)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,112 @@
+# Микробенчмарк рендеринга MarkdownV2: прежняя реализация (regex на каждый вызов, strptime
+# на каждый урок) против render.py без кэша и с кэшем по хэшу данных
+# Запуск: python -m benchmarks.bench_render [--lessons 12] [--students 500] [--repeat 200]
+import argparse
+import re
+import timeit
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import render
+
+WEEK_START = date(2026, 10, 12)
+
+
+def legacy_escape(text: str) -> str:
+    escape_chars = r'_*[]()~`>#+-=|{}.!'
+    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
+
+
+def legacy_schedule(schedule: list, start_of_week: date) -> str:
+    end_of_week = start_of_week + timedelta(days=6)
+    weekdays_ru = {
+        "Monday": "Понедельник", "Tuesday": "Вторник", "Wednesday": "Среда",
+        "Thursday": "Четверг", "Friday": "Пятница", "Saturday": "Суббота",
+        "Sunday": "Воскресенье"
+    }
+    grouped = defaultdict(list)
+    for item in schedule:
+        if start_of_week <= datetime.strptime(item["date"], "%Y-%m-%d").date() <= end_of_week:
+            grouped[item["date"]].append(item)
+    md_lines = [f"*Расписание на неделю* {legacy_escape(str(start_of_week))} — {legacy_escape(str(end_of_week))}\n"]
+    for i in range(7):
+        current_day = start_of_week + timedelta(days=i)
+        date_str = current_day.strftime("%Y-%m-%d")
+        weekday_ru = weekdays_ru[current_day.strftime("%A")]
+        md_lines.append(f"\n━━━━━━━━━━━━━━\n*{legacy_escape(weekday_ru)}* — _{legacy_escape(date_str)}_\n━━━━━━━━━━━━━━")
+        if date_str in grouped:
+            for lesson in sorted(grouped[date_str], key=lambda x: x["started_at"]):
+                md_lines.append(f"📚 *{legacy_escape(lesson['subject_name'])}*")
+                md_lines.append(f"⏰ {lesson['started_at']} — {lesson['finished_at']}")
+                md_lines.append(f"👨‍🏫 {legacy_escape(lesson['teacher_name'])}")
+                md_lines.append(f"📍 {legacy_escape(lesson['room_name'])}\n")
+        else:
+            md_lines.append("_Выходной_ 💤\n")
+    return "\n".join(md_lines)
+
+
+def legacy_group(json_data: list) -> str:
+    md_lines = ["👥 Студенты вашей группы 👥\n"]
+    for i, student in enumerate(sorted(json_data, key=lambda x: x.get('amount', 0), reverse=True)):
+        name = legacy_escape(student.get('full_name') or "Неизвестный")
+        md_lines.append(f"{i+1}\\. {name}: `{legacy_escape(str(student.get('amount', 'N/A')))}` topcoins")
+    return "\n".join(md_lines)
+
+
+def synthetic_schedule(lessons_per_day: int) -> list:
+    return [
+        {
+            "date": (WEEK_START + timedelta(days=day)).isoformat(),
+            "started_at": f"{8 + n:02d}:00",
+            "finished_at": f"{8 + n:02d}:50",
+            "subject_name": f"Разработка веб-приложений (Python/Django) #{n}.",
+            "teacher_name": f"Иванов-Петров И.И. [{day}]",
+            "room_name": f"Ауд. {100 + n}!",
+        }
+        for day in range(7)
+        for n in range(lessons_per_day)
+    ]
+
+
+def synthetic_group(students: int) -> list:
+    return [{"full_name": f"Студент_{i} Фамилия-{i}.", "amount": (i * 37) % 1000} for i in range(students)]
+
+
+def bench(label: str, func, repeat: int):
+    per_call = min(timeit.repeat(func, number=repeat, repeat=3)) / repeat
+    print(f"{label:<36} {per_call * 1e6:10.1f} us/call")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lessons", type=int, default=12, help="уроков в день")
+    parser.add_argument("--students", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    schedule = synthetic_schedule(args.lessons)
+    group = synthetic_group(args.students)
+    assert legacy_schedule(schedule, WEEK_START) == render.render_schedule(render.parse_lessons(schedule), WEEK_START)
+    assert legacy_group(group) == render.render_leader_group(group)
+
+    print(f"schedule: {len(schedule)} lessons")
+    bench("escape (regex)", lambda: legacy_escape(schedule[0]["subject_name"]), args.repeat * 50)
+    bench("escape (translate)", lambda: render.escape_for_markdown_v2(schedule[0]["subject_name"]), args.repeat * 50)
+    bench("schedule legacy", lambda: legacy_schedule(schedule, WEEK_START), args.repeat)
+    bench("schedule parse + render", lambda: render.render_schedule(render.parse_lessons(schedule), WEEK_START), args.repeat)
+    lessons = render.parse_lessons(schedule)
+    bench("schedule render (pre-parsed)", lambda: render.render_schedule(lessons, WEEK_START), args.repeat)
+    bench("schedule memoized", lambda: render.convert_schedule_to_markdown(schedule, WEEK_START), args.repeat)
+
+    print(f"group: {len(group)} students")
+    bench("group legacy", lambda: legacy_group(group), args.repeat)
+    bench("group render", lambda: render.render_leader_group(group), args.repeat)
+    bench("group memoized", lambda: render.create_leader_group_markdown(group), args.repeat)
+
+    text = render.create_leader_group_markdown(group)
+    bench(f"split {len(text)} chars", lambda: render.split_message(text), args.repeat)
+    print(f"render cache: {render.get_render_cache_stats()}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,76 @@
+# Масштабирование обработки апдейтов по числу рабочих процессов (sharding.ShardSupervisor)
+# Хендлер нагружает CPU так же, как реальный: расшифровка Fernet + рендер расписания в MarkdownV2
+# Запуск: python -m benchmarks.bench_sharding [--updates 4000] [--workers 1 2 4]
+import argparse
+import asyncio
+import time
+from datetime import date, timedelta
+
+from aiogram import Bot, Dispatcher, types
+from cryptography.fernet import Fernet
+
+from render import parse_lessons, render_schedule
+from sharding import ShardSupervisor, WorkerApp
+from benchmarks.fake_telegram import BENCH_BOT_TOKEN, FakeSession, make_update
+
+MONDAY = date.today() - timedelta(days=date.today().weekday())
+
+
+def synthetic_week(lessons_per_day: int = 6) -> list:
+    return [
+        {
+            "date": (MONDAY + timedelta(days=day)).isoformat(),
+            "lesson": n + 1,
+            "started_at": f"{9 + n}:00",
+            "finished_at": f"{9 + n}:50",
+            "subject_name": f"Предмет {n} (практика)",
+            "teacher_name": f"Преподаватель {day}.{n}",
+            "room_name": f"Ауд. {100 + n}",
+        }
+        for day in range(6)
+        for n in range(lessons_per_day)
+    ]
+
+
+async def create_bench_worker(index: int, workers: int) -> WorkerApp:
+    dp = Dispatcher()
+    bot = Bot(BENCH_BOT_TOKEN, session=FakeSession())
+    fernet = Fernet(Fernet.generate_key())
+    secret = fernet.encrypt(b"password")
+    schedule = synthetic_week()
+
+    @dp.message()
+    async def handler(message: types.Message):
+        fernet.decrypt(secret)
+        # Без кэша рендеринга: каждый апдейт честно разбирает и рендерит расписание
+        await message.answer(render_schedule(parse_lessons(schedule), MONDAY))
+
+    return WorkerApp(dp, bot, on_shutdown=bot.session.close)
+
+
+async def run(workers: int, total: int) -> float:
+    supervisor = ShardSupervisor(workers, create_bench_worker)
+    await supervisor.start()
+    started = time.perf_counter()
+    for i in range(1, total + 1):
+        await supervisor.dispatch(make_update(i, 1000 + i % 997, "Получить расписание 📆"))
+    await supervisor.stop()
+    return time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    baseline = None
+    for workers in args.workers:
+        elapsed = asyncio.run(run(workers, args.updates))
+        rate = args.updates / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>2} workers: {rate:8.1f} updates/s (x{rate / baseline:.2f})")
+
+
+if __name__ == "__main__":
+    main_cli()
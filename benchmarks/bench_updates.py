@@ -0,0 +1,99 @@
+# Пропускная способность обработки апдейтов: long polling vs webhook
+# Запуск: python -m benchmarks.bench_updates [--updates 5000] [--handler-ms 20] [--concurrency 100]
+import argparse
+import asyncio
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher, types
+
+from middlewares import ConcurrencyLimitMiddleware
+from webhook import WEBHOOK_PATH, build_webhook_app
+from benchmarks.fake_telegram import BENCH_BOT_TOKEN, FakeSession, make_update
+
+SECRET = "bench-secret"
+
+
+def build_dispatcher(total: int, handler_latency: float, concurrency: int, done: asyncio.Event) -> Dispatcher:
+    dp = Dispatcher()
+    dp.update.outer_middleware(ConcurrencyLimitMiddleware(concurrency))
+    handled = 0
+
+    @dp.message()
+    async def handler(message: types.Message):
+        nonlocal handled
+        # Имитация ожидания БД/API внутри хендлера
+        await asyncio.sleep(handler_latency)
+        await message.answer("ok")
+        handled += 1
+        if handled >= total:
+            done.set()
+
+    return dp
+
+
+async def bench_polling(total: int, handler_latency: float, concurrency: int) -> float:
+    done = asyncio.Event()
+    session = FakeSession()
+    bot = Bot(BENCH_BOT_TOKEN, session=session)
+    dp = build_dispatcher(total, handler_latency, concurrency, done)
+    session.feed([make_update(i, 1000 + i % 500, "ping") for i in range(1, total + 1)])
+
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    return elapsed
+
+
+async def bench_webhook(total: int, handler_latency: float, concurrency: int, clients: int) -> float:
+    done = asyncio.Event()
+    bot = Bot(BENCH_BOT_TOKEN, session=FakeSession())
+    dp = build_dispatcher(total, handler_latency, concurrency, done)
+    runner = web.AppRunner(build_webhook_app(dp, bot, SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+    updates = [make_update(i, 1000 + i % 500, "ping") for i in range(1, total + 1)]
+    limiter = asyncio.Semaphore(clients)
+
+    async def post(http: aiohttp.ClientSession, update: dict):
+        async with limiter:
+            async with http.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as http:
+        await asyncio.gather(*(post(http, update) for update in updates))
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await runner.cleanup()
+    return elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--handler-ms", type=float, default=20.0)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--clients", type=int, default=40, help="параллельных соединений Telegram к webhook")
+    args = parser.parse_args()
+
+    latency = args.handler_ms / 1000
+    for mode, bench in (
+        ("polling", lambda: bench_polling(args.updates, latency, args.concurrency)),
+        ("webhook", lambda: bench_webhook(args.updates, latency, args.concurrency, args.clients)),
+    ):
+        elapsed = asyncio.run(bench())
+        print(f"{mode:>8}: {args.updates} updates in {elapsed:6.2f} s -> {args.updates / elapsed:8.1f} updates/s")
+
+
+if __name__ == "__main__":
+    main_cli()
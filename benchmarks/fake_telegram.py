@@ -0,0 +1,71 @@
+# Поддельный Telegram Bot API для локальных бенчмарков: сессия aiogram без сети
+import asyncio
+import itertools
+from datetime import datetime
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetMe, GetUpdates, SendMessage, TelegramMethod
+from aiogram.types import Chat, Message, Update, User
+
+BENCH_BOT_TOKEN = "123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    # Апдейт в формате, в котором его присылает Telegram
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(datetime.now().timestamp()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+class FakeSession(BaseSession):
+    # Отвечает на методы Bot API из памяти. Апдейты для getUpdates берутся из очереди,
+    # отправленные сообщения считаются и могут задерживаться на send_latency секунд
+
+    def __init__(self, send_latency: float = 0.0):
+        super().__init__()
+        self.send_latency = send_latency
+        self.sent = 0
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self._message_ids = itertools.count(1)
+
+    def feed(self, updates: list[dict]):
+        for update in updates:
+            self.updates.put_nowait(update)
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        if isinstance(method, GetMe):
+            return User(id=1, is_bot=True, first_name="bench", username="bench_bot")
+        if isinstance(method, GetUpdates):
+            batch = []
+            try:
+                batch.append(await asyncio.wait_for(self.updates.get(), timeout=0.5))
+            except asyncio.TimeoutError:
+                return []
+            while not self.updates.empty() and len(batch) < (method.limit or 100):
+                batch.append(self.updates.get_nowait())
+            return [Update.model_validate(update, context={"bot": bot}) for update in batch]
+        if isinstance(method, SendMessage):
+            if self.send_latency:
+                await asyncio.sleep(self.send_latency)
+            self.sent += 1
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(),
+                chat=Chat(id=int(method.chat_id), type="private"),
+                text=method.text,
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
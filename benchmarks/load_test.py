@@ -0,0 +1,121 @@
+# Сквозной нагрузочный тест: Dispatcher из TelegramBot.py + mock API журнала + MongoDB.
+# Тысячи пользователей нажимают кнопки меню, для каждого апдейта измеряется время
+# от получения до отправки ответа. Telegram заменен FakeSession (без сети).
+# Нужна доступная MongoDB (MONGODB_URI), данные пишутся в базу MONGODB_DB=journalbot_loadtest.
+# Запуск: python -m benchmarks.load_test [--users 2000] [--updates-per-user 4] [--concurrency 200]
+import argparse
+import asyncio
+import os
+import time
+
+from cryptography.fernet import Fernet
+
+from benchmarks.fake_telegram import BENCH_BOT_TOKEN, FakeSession, make_update
+from benchmarks.mock_journal import add_mock_arguments, mock_from_args, start_mock
+
+BUTTONS = ("Получить расписание 📆", "Студенты группы 👥", "Топ 3 в потоке 🏆", "Будущие экзамены 📚")
+FIRST_USER_ID = 10_000_000
+PASSWORD = "loadtest"
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def configure_env(base_url: str, real_limits: bool):
+    # До импорта TelegramBot: модули читают настройки при импорте
+    os.environ["JOURNAL_API_BASE"] = base_url
+    os.environ["TOKEN"] = BENCH_BOT_TOKEN
+    os.environ.setdefault("MONGODB_DB", "journalbot_loadtest")
+    os.environ.setdefault("PASSWORD_ENC_KEY", Fernet.generate_key().decode())
+    os.environ.setdefault("METRICS_PORT", "0")
+    if not real_limits:
+        # Лимиты Telegram измеряют очередь, а не бота: по умолчанию снимаем их
+        for name, value in (
+            ("OUTBOX_GLOBAL_RATE", "1000000"), ("OUTBOX_GLOBAL_BURST", "1000000"),
+            ("OUTBOX_CHAT_RATE", "1000"), ("OUTBOX_CHAT_BURST", "1000"),
+        ):
+            os.environ.setdefault(name, value)
+
+
+async def seed_accounts(users: int, concurrency: int):
+    from main import get_auth_token
+    from database.db import add_account_with_password
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def seed(user_id: int):
+        async with semaphore:
+            username = f"student{user_id}"
+            token = await get_auth_token(username, PASSWORD)
+            await add_account_with_password(user_id, username, PASSWORD, token)
+
+    await asyncio.gather(*(seed(FIRST_USER_ID + i) for i in range(users)))
+
+
+async def run(args):
+    mock = mock_from_args(args)
+    mock_runner, base_url = await start_mock(mock)
+    configure_env(base_url, args.real_limits)
+
+    import TelegramBot
+
+    session = FakeSession(send_latency=args.send_latency_ms / 1000)
+    TelegramBot.bot.session = session
+    background_tasks = await TelegramBot.startup(run_jobs=False)
+    try:
+        started = time.perf_counter()
+        await seed_accounts(args.users, args.concurrency)
+        print(f"seeded {args.users} accounts in {time.perf_counter() - started:.1f} s")
+
+        updates = [
+            make_update(n + 1, FIRST_USER_ID + n % args.users, BUTTONS[(n // args.users) % len(BUTTONS)])
+            for n in range(args.users * args.updates_per_user)
+        ]
+        latencies = []
+        failures = 0
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def feed(update: dict):
+            nonlocal failures
+            async with semaphore:
+                begun = time.perf_counter()
+                try:
+                    await TelegramBot.dp.feed_raw_update(TelegramBot.bot, update)
+                except Exception:
+                    failures += 1
+                latencies.append(time.perf_counter() - begun)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(feed(update) for update in updates))
+        elapsed = time.perf_counter() - started
+    finally:
+        await TelegramBot.shutdown(background_tasks)
+        await mock_runner.cleanup()
+
+    latencies.sort()
+    print(f"updates:    {len(updates)} ({failures} failed) in {elapsed:.2f} s -> {len(updates) / elapsed:.1f} updates/s")
+    print(
+        f"latency ms: p50 {percentile(latencies, 0.50) * 1000:.1f}  p90 {percentile(latencies, 0.90) * 1000:.1f}  "
+        f"p99 {percentile(latencies, 0.99) * 1000:.1f}  max {latencies[-1] * 1000:.1f}"
+    )
+    print(f"sent:       {session.sent} messages")
+    print(f"mock API:   {mock.stats()}")
+    print(f"outbox:     {TelegramBot.outbox.stats()}")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates-per-user", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=200, help="апдейтов в обработке одновременно")
+    parser.add_argument("--send-latency-ms", type=float, default=20.0, help="задержка ответа Telegram на sendMessage")
+    parser.add_argument("--real-limits", action="store_true", help="оставить лимиты отправки Telegram (outbox)")
+    add_mock_arguments(parser)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
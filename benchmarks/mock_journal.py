@@ -0,0 +1,201 @@
+# Локальный mock API журнала для нагрузочных тестов: те же пути и форматы ответов,
+# что использует main.py, с настраиваемой задержкой, долей ошибок и временем жизни токена.
+# Запуск отдельно: python -m benchmarks.mock_journal [--port 8089] [--latency-ms 50] [--error-rate 0.01]
+# и затем JOURNAL_API_BASE=http://127.0.0.1:8089/api/v2 для бота
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from aiohttp import web
+
+API_PREFIX = "/api/v2"
+# Пароль, с которым логин не проходит (проверка ветки "неверный логин или пароль")
+WRONG_PASSWORD = "wrong"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class MockJournal:
+    def __init__(
+        self,
+        latency_ms: float = 30.0,
+        jitter_ms: float = 10.0,
+        error_rate: float = 0.0,
+        token_ttl: float = 3600.0,
+        groups: int = 50,
+        students_per_group: int = 25,
+        lessons_per_day: int = 4,
+    ):
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.token_ttl = token_ttl
+        self.groups = groups
+        self.students_per_group = students_per_group
+        self.lessons_per_day = lessons_per_day
+        self.requests = Counter()
+        self.errors = Counter()
+        self.unauthorized = Counter()
+
+    # Токены: JWT без подписи, main.get_token_expiry читает из него exp
+
+    def issue_token(self, username: str) -> str:
+        header = _b64(json.dumps({"alg": "none", "typ": "JWT"}).encode())
+        payload = _b64(json.dumps({"sub": username, "exp": int(time.time() + self.token_ttl)}).encode())
+        return f"{header}.{payload}.mock"
+
+    @staticmethod
+    def _token_user(request: web.Request) -> str | None:
+        auth = request.headers.get("Authorization", "")
+        if not auth.startswith("Bearer "):
+            return None
+        try:
+            payload = auth[7:].split(".")[1]
+            claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        except (IndexError, ValueError):
+            return None
+        if claims.get("exp", 0) < time.time():
+            return None
+        return claims.get("sub")
+
+    def group_of(self, username: str) -> int:
+        return sum(username.encode()) % self.groups
+
+    async def _simulate(self, endpoint: str):
+        self.requests[endpoint] += 1
+        await asyncio.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors[endpoint] += 1
+            raise web.HTTPServiceUnavailable(text="mock failure")
+
+    async def _authorized(self, request: web.Request, endpoint: str) -> str:
+        await self._simulate(endpoint)
+        username = self._token_user(request)
+        if username is None:
+            self.unauthorized[endpoint] += 1
+            raise web.HTTPUnauthorized()
+        return username
+
+    # Эндпоинты
+
+    async def login(self, request: web.Request) -> web.Response:
+        await self._simulate("login")
+        body = await request.json()
+        if not body.get("username") or body.get("password") == WRONG_PASSWORD:
+            raise web.HTTPUnauthorized()
+        return web.json_response({"access_token": self.issue_token(body["username"]), "expires_in_access": self.token_ttl})
+
+    async def schedule(self, request: web.Request) -> web.Response:
+        username = await self._authorized(request, "schedule")
+        group = self.group_of(username)
+        start = date.fromisoformat(request.query["date_start"])
+        end = date.fromisoformat(request.query["date_end"])
+        lessons = []
+        day = start
+        while day <= end:
+            if day.weekday() < 6:
+                for n in range(self.lessons_per_day):
+                    lessons.append({
+                        "date": day.isoformat(),
+                        "lesson": n + 1,
+                        "started_at": f"{9 + 2 * n:02d}:00",
+                        "finished_at": f"{10 + 2 * n:02d}:20",
+                        "teacher_name": f"Преподаватель {(group + n) % 17}",
+                        "subject_name": f"Предмет {(day.toordinal() + n + group) % 11} (группа {group})",
+                        "room_name": f"Ауд. {100 + n}",
+                    })
+            day += timedelta(days=1)
+        return web.json_response(lessons)
+
+    def _students(self, group: int) -> list:
+        return [
+            {"id": group * 1000 + i, "full_name": f"Студент {i} группы {group}", "amount": (i * 37 + group) % 500}
+            for i in range(self.students_per_group)
+        ]
+
+    async def leader_group(self, request: web.Request) -> web.Response:
+        username = await self._authorized(request, "leader_group")
+        return web.json_response(self._students(self.group_of(username)))
+
+    async def leader_stream(self, request: web.Request) -> web.Response:
+        await self._authorized(request, "leader_stream")
+        students = sorted(self._students(0), key=lambda s: s["amount"], reverse=True)
+        return web.json_response(students[:10])
+
+    async def future_exams(self, request: web.Request) -> web.Response:
+        await self._authorized(request, "future_exams")
+        today = date.today()
+        return web.json_response([
+            {"spec": f"Экзамен {i}", "date": (today + timedelta(days=7 * i)).isoformat()} for i in range(1, 4)
+        ])
+
+    async def user_info(self, request: web.Request) -> web.Response:
+        username = await self._authorized(request, "user_info")
+        group = self.group_of(username)
+        return web.json_response({"full_name": username, "current_group_id": group, "group_name": f"G-{group}"})
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(f"{API_PREFIX}/auth/login", self.login)
+        app.router.add_get(f"{API_PREFIX}/schedule/operations/get-by-date-range", self.schedule)
+        app.router.add_get(f"{API_PREFIX}/dashboard/progress/leader-stream", self.leader_stream)
+        app.router.add_get(f"{API_PREFIX}/dashboard/progress/leader-group", self.leader_group)
+        app.router.add_get(f"{API_PREFIX}/dashboard/info/future-exams", self.future_exams)
+        app.router.add_get(f"{API_PREFIX}/settings/user-info", self.user_info)
+        return app
+
+    def stats(self) -> dict:
+        return {"requests": dict(self.requests), "errors": dict(self.errors), "unauthorized": dict(self.unauthorized)}
+
+
+async def start_mock(mock: MockJournal, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    # Возвращает runner и базовый URL для JOURNAL_API_BASE
+    runner = web.AppRunner(mock.build_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}{API_PREFIX}"
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--token-ttl", type=float, default=3600.0, help="время жизни токена, с")
+    parser.add_argument("--groups", type=int, default=50)
+
+
+def mock_from_args(args) -> MockJournal:
+    return MockJournal(args.latency_ms, args.jitter_ms, args.error_rate, args.token_ttl, args.groups)
+
+
+async def serve(args):
+    mock = mock_from_args(args)
+    runner, base_url = await start_mock(mock, args.host, args.port)
+    print(f"JOURNAL_API_BASE={base_url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(mock.stats())
+    finally:
+        await runner.cleanup()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    add_mock_arguments(parser)
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+# Кэши в памяти процесса
+
+
+class TTLCache:
+    # LRU-кэш с ограничением размера и временем жизни записей.
+    # Потокобезопасный: функции БД выполняются в пуле потоков (database.db)
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # Счетчик инвалидаций: чтение из БД, начавшееся до инвалидации, не должно
+        # положить в кэш устаревшее значение
+        self._epoch = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def epoch(self) -> int:
+        return self._epoch
+
+    def set(self, key, value, ttl: float | None = None, epoch: int | None = None):
+        # Без epoch запись считается авторитетной (write-through) и сбрасывает
+        # все незавершенные чтения; с epoch - запись результата чтения из БД
+        with self._lock:
+            if epoch is None:
+                self._epoch += 1
+            elif epoch != self._epoch:
+                return
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._epoch += 1
+            item = self._data.pop(key, None)
+            return item[1] if item else None
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+class SingleFlight:
+    # Объединяет одновременные вызовы с одинаковым ключом в один:
+    # первый вызывающий запускает корутину, остальные ждут ее результат
+
+    def __init__(self):
+        self._inflight: dict = {}
+
+    async def do(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(task)
+
+    def in_flight(self, key) -> bool:
+        return key in self._inflight
+
+
+class SWRCache:
+    # Асинхронный кэш с stale-while-revalidate: свежие значения отдаются сразу,
+    # устаревшие (в пределах stale_ttl) тоже отдаются сразу, а обновление идет в фоне.
+    # Одновременные промахи по одному ключу выполняют один запрос (SingleFlight)
+
+    def __init__(self, maxsize: int = 2_000, ttl: float = 300.0, stale_ttl: float = 1_800.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._flight = SingleFlight()
+        self._background: set = set()
+
+    async def get_or_load(self, key, loader, ttl: float | None = None, max_age: float | None = None):
+        # ttl - время жизни для значения, которое будет загружено (по умолчанию self.ttl).
+        # max_age - вызывающему нужны данные не старше max_age секунд (без stale)
+        found, value = self.get_cached(key, loader, max_age)
+        if found:
+            return value
+        return await self._flight.do(key, lambda: self._load(key, loader, ttl))
+
+    def get_cached(self, key, loader, max_age: float | None = None):
+        # Как get_or_load, но без ожидания загрузки: (True, value) для свежего или устаревшего
+        # значения (устаревшее обновляется в фоне через loader), (False, None) при промахе.
+        # Нужно, когда промахи по нескольким ключам загружаются одним запросом
+        item = self._data.get(key)
+        if item is not None:
+            fetched_at, item_ttl, value = item
+            age = time.monotonic() - fetched_at
+            if age < (item_ttl if max_age is None else min(item_ttl, max_age)):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, value
+            if max_age is None and age < item_ttl + self.stale_ttl:
+                self._data.move_to_end(key)
+                self.stale_hits += 1
+                self._revalidate(key, loader, item_ttl)
+                return True, value
+        self.misses += 1
+        return False, None
+
+    def peek(self, key):
+        # Последнее значение без учета времени жизни (или None)
+        item = self._data.get(key)
+        return item[2] if item else None
+
+    def set(self, key, value, ttl: float | None = None):
+        self._data[key] = (time.monotonic(), self.ttl if ttl is None else ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[2] if item else None
+
+    async def _load(self, key, loader, ttl: float | None = None):
+        value = await loader()
+        self.set(key, value, ttl)
+        return value
+
+    def _revalidate(self, key, loader, ttl: float | None = None):
+        # ttl - время жизни устаревшей записи: обновленная запись сохраняет его
+        if self._flight.in_flight(key):
+            return
+
+        async def run():
+            try:
+                await self._flight.do(key, lambda: self._load(key, loader, ttl))
+            except Exception as e:
+                logging.warning("Фоновое обновление кэша %s не удалось: %s", key, e)
+
+        task = asyncio.ensure_future(run())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
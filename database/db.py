@@ -1 +1,169 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+import main
+from metrics import DB_SECONDS
+
+# Асинхронный слой доступа к аккаунтам.
+# pymongo синхронный, поэтому каждый вызов уходит в ограниченный пул потоков,
+# а event loop в это время продолжает обслуживать других пользователей.
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "16"))
+
+_executor: ThreadPoolExecutor | None = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Размер пула не больше maxPoolSize клиента MongoDB (по умолчанию 100)
+        _executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="mongo")
+    return _executor
+
+
+async def run_db(func, *args, **kwargs):
+    # Выполняет синхронную функцию работы с БД в пуле потоков
+    loop = asyncio.get_running_loop()
+    with DB_SECONDS.time(func.__name__):
+        return await loop.run_in_executor(_get_executor(), partial(func, *args, **kwargs))
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+async def init_db():
+    await run_db(main.init_db)
+
+
+async def add_account(user_id: int, username: str, token: str) -> bool:
+    return await run_db(main.add_account, user_id, username, token)
+
+
+async def add_account_with_password(user_id: int, username: str, password: str, token: str) -> bool:
+    return await run_db(main.add_account_with_password, user_id, username, password, token)
+
+
+async def update_account_token(user_id: int, username: str, token: str):
+    await run_db(main.update_account_token, user_id, username, token)
+
+
+async def get_active_account(user_id: int):
+    return await run_db(main.get_active_account, user_id)
+
+
+async def get_active_account_full(user_id: int):
+    return await run_db(main.get_active_account_full, user_id)
+
+
+async def get_all_accounts(user_id: int):
+    return await run_db(main.get_all_accounts, user_id)
+
+
+async def set_active_account(user_id: int, username: str):
+    await run_db(main.set_active_account, user_id, username)
+
+
+async def delete_account(user_id: int, username: str):
+    await run_db(main.delete_account, user_id, username)
+
+
+async def has_accounts(user_id: int) -> bool:
+    return await run_db(main.has_accounts, user_id)
+
+
+async def delete_all_accounts(user_id: int):
+    await run_db(main.delete_all_accounts, user_id)
+
+
+async def get_accounts_expiring_before(deadline, limit: int = 500) -> list:
+    return await run_db(main.get_accounts_expiring_before, deadline, limit)
+
+
+async def touch_user(user_id: int):
+    await run_db(main.touch_user, user_id)
+
+
+async def record_token_refresh_failure(user_id: int, username: str, permanent: bool = False):
+    await run_db(main.record_token_refresh_failure, user_id, username, permanent)
+
+
+async def get_account_group(user_id: int, username: str):
+    return await run_db(main.get_account_group, user_id, username)
+
+
+async def set_account_group(user_id: int, username: str, group: str):
+    await run_db(main.set_account_group, user_id, username, group)
+
+
+async def get_active_accounts_page(after_user_id: int | None = None, limit: int = 500) -> list:
+    return await run_db(main.get_active_accounts_page, after_user_id, limit)
+
+
+async def set_user_setting(user_id: int, name: str, value):
+    await run_db(main.set_user_setting, user_id, name, value)
+
+
+async def get_user_setting(user_id: int, name: str, default=None):
+    return await run_db(main.get_user_setting, user_id, name, default)
+
+
+async def get_users_with_setting(name: str, value=True) -> list:
+    return await run_db(main.get_users_with_setting, name, value)
+
+
+async def get_job_state(job_id: str):
+    return await run_db(main.get_job_state, job_id)
+
+
+async def save_job_state(job_id: str, **fields):
+    await run_db(main.save_job_state, job_id, **fields)
+
+
+async def get_schedule_fingerprints(user_id: int):
+    return await run_db(main.get_schedule_fingerprints, user_id)
+
+
+async def save_schedule_fingerprints(user_id: int, week_start: str, lessons: list):
+    await run_db(main.save_schedule_fingerprints, user_id, week_start, lessons)
+
+
+async def get_last_good(user_id: int, kind: str):
+    return await run_db(main.get_last_good, user_id, kind)
+
+
+async def save_last_good(user_id: int, kind: str, data):
+    await run_db(main.save_last_good, user_id, kind, data)
+
+
+async def get_passwords_to_reencrypt_page(after_user_id: int | None = None, limit: int = main.PASSWORD_REENCRYPT_BATCH) -> list:
+    return await run_db(main.get_passwords_to_reencrypt_page, after_user_id, limit)
+
+
+async def save_reencrypted_passwords(updates: list) -> int:
+    return await run_db(main.save_reencrypted_passwords, updates)
+
+
+async def get_user_reminder_ids(user_id: int) -> list:
+    return await run_db(main.get_user_reminder_ids, user_id)
+
+
+async def save_user_reminders(user_id: int, added: list, removed: list):
+    await run_db(main.save_user_reminders, user_id, added, removed)
+
+
+async def delete_user_reminders(user_id: int):
+    await run_db(main.delete_user_reminders, user_id)
+
+
+async def get_pending_reminders_page(after_id: str | None = None, limit: int = 5000) -> list:
+    return await run_db(main.get_pending_reminders_page, after_id, limit)
+
+
+async def claim_reminders(reminder_ids: list) -> list:
+    return await run_db(main.claim_reminders, reminder_ids)
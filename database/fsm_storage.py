@@ -0,0 +1,82 @@
+import logging
+import os
+from typing import Any, Mapping
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import main
+from cache import TTLCache
+from database.db import run_db
+from metrics import register_cache
+
+# Хранилище состояний FSM в MongoDB (коллекция MONGODB_FSM_COLLECTION).
+# Состояния переживают перезапуск и доступны всем процессам бота.
+# Записи удаляются TTL-индексом по updated_at. Горячие чаты читаются из памяти:
+# чтение идет через кэш, запись - сразу в БД и в кэш. Ошибки MongoDB пробрасываются
+# в хендлер и не попадают в кэш: несохраненное состояние не должно считаться текущим.
+# При нескольких процессах апдейты одного пользователя должны попадать в один процесс
+# (см. шардирование по user_id), иначе кэш может отдать устаревшее состояние до FSM_CACHE_TTL
+
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "30"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# Эти ключи никогда не сохраняются в данных FSM
+SENSITIVE_KEYS = frozenset({"password"})
+
+
+class MongoStorage(BaseStorage):
+    def __init__(self, cache_ttl: float = FSM_CACHE_TTL, cache_size: int = FSM_CACHE_SIZE):
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        register_cache("fsm", self._cache)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(
+            str(part) if part is not None else ""
+            for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+        )
+
+    async def _read(self, key: StorageKey) -> tuple[str | None, dict]:
+        record_key = self._key(key)
+        cached = self._cache.get(record_key)
+        if cached is not None:
+            return cached
+        epoch = self._cache.epoch()
+        doc = await run_db(main.get_fsm_record, record_key) or {}
+        record = (doc.get("state"), doc.get("data") or {})
+        self._cache.set(record_key, record, epoch=epoch)
+        return record
+
+    async def _write(self, key: StorageKey, state: str | None, data: dict):
+        record_key = self._key(key)
+        try:
+            await run_db(main.save_fsm_record, record_key, state, data)
+        except Exception:
+            # Запись могла и пройти: следующее чтение возьмет состояние из БД
+            self._cache.pop(record_key)
+            raise
+        self._cache.set(record_key, (state, data))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        _, data = await self._read(key)
+        await self._write(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        state, _ = await self._read(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        data = dict(data)
+        for name in SENSITIVE_KEYS & data.keys():
+            logging.warning("Ключ %s не сохраняется в данных FSM", name)
+            del data[name]
+        state, _ = await self._read(key)
+        await self._write(key, state, data)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, data = await self._read(key)
+        return dict(data)
+
+    async def close(self) -> None:
+        self._cache.clear()
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import heapq
+import logging
+import os
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from aiogram.enums import ParseMode
+
+from auth import call_with_auth
+from main import escape_for_markdown_v2, get_future_exams
+from outbox import Outbox, PRIORITY_BULK
+from database.db import (
+    get_active_account_full,
+    get_users_with_setting,
+    get_user_reminder_ids,
+    save_user_reminders,
+    delete_user_reminders,
+    get_pending_reminders_page,
+    claim_reminders,
+)
+
+# Напоминания об экзаменах (по подписке): за несколько дней и за день до экзамена.
+# Все напоминания лежат в MongoDB (переживают перезапуск), а в процессе - одна
+# очередь с приоритетом (heapq) из пар (время отправки, _id): память на напоминание
+# постоянна, текст читается из БД только при отправке. Один цикл спит до ближайшего
+# напоминания и отправляет наступившие пачками через outbox (лимиты Telegram).
+# Списки экзаменов обновляются периодически: для пользователя добавляются только
+# новые напоминания и удаляются ставшие лишними (экзамен перенесен или отменен).
+# Записи очереди не удаляются при изменениях: отсутствующий в БД _id просто пропускается,
+# а очередь перестраивается из БД при каждом цикле обновления. Исключение - отписка
+# и выход из аккаунтов: записи пользователя сразу убираются и из очереди
+
+EXAM_REMINDER_DAYS = tuple(int(days) for days in os.getenv("EXAM_REMINDER_DAYS", "3,1").split(","))
+EXAM_REMINDER_TIME = os.getenv("EXAM_REMINDER_TIME", "18:00")
+EXAM_REMINDER_BATCH = int(os.getenv("EXAM_REMINDER_BATCH", "200"))
+EXAM_REFRESH_INTERVAL = float(os.getenv("EXAM_REFRESH_INTERVAL", "21600"))
+EXAM_REFRESH_CONCURRENCY = int(os.getenv("EXAM_REFRESH_CONCURRENCY", "10"))
+# Как часто очередь перечитывается из БД (напоминания, созданные другими процессами)
+EXAM_REMINDER_RELOAD = float(os.getenv("EXAM_REMINDER_RELOAD", "900"))
+
+EXAM_REMINDERS_SETTING = "exam_reminders"
+
+
+def _timestamp(moment: datetime) -> float:
+    # pymongo возвращает naive datetime в UTC
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def reminder_documents(exams: list, now: datetime) -> tuple[dict, set]:
+    # Возвращает (будущие напоминания {_id: документ без user_id}, _id всех напоминаний списка).
+    # _id не зависит от user_id, полный _id - "<user_id>:<ключ>"
+    hour, minute = map(int, EXAM_REMINDER_TIME.split(":"))
+    upcoming, all_ids = {}, set()
+    for exam in exams or ():
+        try:
+            exam_date = date.fromisoformat(str(exam.get("date"))[:10])
+        except ValueError:
+            continue
+        spec = exam.get("spec") or "Экзамен"
+        spec_hash = hashlib.blake2b(spec.encode("utf-8"), digest_size=4).hexdigest()
+        for days_before in EXAM_REMINDER_DAYS:
+            key = f"{exam_date.isoformat()}:{days_before}:{spec_hash}"
+            all_ids.add(key)
+            # Время отправки - в часовом поясе сервера
+            due_at = datetime.combine(exam_date - timedelta(days=days_before), datetime.min.time()).replace(
+                hour=hour, minute=minute
+            ).astimezone(timezone.utc)
+            if due_at > now:
+                upcoming[key] = {
+                    "due_at": due_at, "exam_date": exam_date.isoformat(), "spec": spec, "days_before": days_before,
+                }
+    return upcoming, all_ids
+
+
+def reminder_markdown(doc: dict) -> str:
+    days = doc["days_before"]
+    when = "завтра" if days == 1 else f"через {days} дн\\."
+    return (
+        f"⏰ *Напоминание:* {when} экзамен\n\n"
+        f"*{escape_for_markdown_v2(doc['spec'])}*\n"
+        f"📅 {escape_for_markdown_v2(doc['exam_date'])}"
+    )
+
+
+class ReminderScheduler:
+    def __init__(self, outbox: Outbox, batch_size: int = EXAM_REMINDER_BATCH):
+        self.outbox = outbox
+        self.batch_size = batch_size
+        self.running = False
+        self.delivered = 0
+        self.skipped = 0
+        self.failed = 0
+        # (время отправки, _id)
+        self._heap: list[tuple[float, str]] = []
+        self._wakeup = asyncio.Event()
+        self._loaded_at = 0.0
+        # Добавленные во время load(): попадут в новую очередь
+        self._pushed_while_loading: list | None = None
+
+    def push(self, due_ts: float, reminder_id: str):
+        if self._pushed_while_loading is not None:
+            self._pushed_while_loading.append((due_ts, reminder_id))
+        heapq.heappush(self._heap, (due_ts, reminder_id))
+        if self._heap[0][1] == reminder_id:
+            # Новое напоминание раньше того, до которого спит цикл
+            self._wakeup.set()
+
+    async def load(self):
+        # Перестраивает очередь из БД постранично (заодно выбрасывает устаревшие записи)
+        heap, after_id = [], None
+        self._pushed_while_loading = []
+        try:
+            while True:
+                page = await get_pending_reminders_page(after_id)
+                if not page:
+                    break
+                heap.extend((_timestamp(due_at), reminder_id) for reminder_id, due_at in page)
+                after_id = page[-1][0]
+            heap.extend(self._pushed_while_loading)
+        finally:
+            self._pushed_while_loading = None
+        heapq.heapify(heap)
+        self._heap = heap
+        self._loaded_at = time.monotonic()
+        self._wakeup.set()
+        logging.info("Очередь напоминаний об экзаменах загружена: %d", len(heap))
+
+    async def refresh_user(self, user_id: int, now: datetime | None = None):
+        # Сверяет напоминания пользователя с текущим списком экзаменов
+        credentials = await get_active_account_full(user_id)
+        if not credentials:
+            return
+        exams = await call_with_auth(user_id, credentials, get_future_exams)
+        upcoming, all_ids = reminder_documents(exams, now or datetime.now(timezone.utc))
+        prefix = f"{user_id}:"
+        existing = set(await get_user_reminder_ids(user_id))
+        added = {f"{prefix}{key}": doc for key, doc in upcoming.items() if f"{prefix}{key}" not in existing}
+        # Наступившие, но еще не отправленные напоминания остаются
+        removed = [reminder_id for reminder_id in existing if reminder_id[len(prefix):] not in all_ids]
+        if not added and not removed:
+            return
+        await save_user_reminders(user_id, [{"_id": reminder_id, **doc} for reminder_id, doc in added.items()], removed)
+        if self.running:
+            for reminder_id, doc in added.items():
+                self.push(doc["due_at"].timestamp(), reminder_id)
+
+    async def disable_user(self, user_id: int):
+        await delete_user_reminders(user_id)
+        prefix = f"{user_id}:"
+        heap = [entry for entry in self._heap if not entry[1].startswith(prefix)]
+        if len(heap) != len(self._heap):
+            heapq.heapify(heap)
+            self._heap = heap
+        if self._pushed_while_loading is not None:
+            # Очередь сейчас перестраивается: убранное не должно вернуться из load()
+            self._pushed_while_loading[:] = [
+                entry for entry in self._pushed_while_loading if not entry[1].startswith(prefix)
+            ]
+
+    async def refresh_all(self):
+        semaphore = asyncio.Semaphore(EXAM_REFRESH_CONCURRENCY)
+
+        async def guarded(user_id: int):
+            async with semaphore:
+                try:
+                    await self.refresh_user(user_id)
+                except Exception as e:
+                    logging.warning("Обновление экзаменов пользователя %d не удалось: %s", user_id, e)
+
+        subscribers = await get_users_with_setting(EXAM_REMINDERS_SETTING)
+        await asyncio.gather(*(guarded(user_id) for user_id in subscribers))
+        logging.info("Списки экзаменов обновлены: подписчиков %d", len(subscribers))
+
+    def _pop_due(self, now_ts: float) -> list[str]:
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts and len(due) < self.batch_size:
+            due.append(heapq.heappop(self._heap)[1])
+        return due
+
+    async def _deliver(self, doc: dict):
+        try:
+            await self.outbox.send_message(
+                doc["user_id"], reminder_markdown(doc), priority=PRIORITY_BULK, parse_mode=ParseMode.MARKDOWN_V2
+            )
+            self.delivered += 1
+        except Exception as e:
+            self.failed += 1
+            logging.warning("Не удалось отправить напоминание %s: %s", doc["_id"], e)
+
+    async def deliver_due(self) -> int:
+        # Одна пачка наступивших напоминаний; возвращает число взятых из очереди
+        due = self._pop_due(time.time())
+        if not due:
+            return 0
+        docs = await claim_reminders(due)
+        today = date.today().isoformat()
+        fresh = [doc for doc in docs if doc["exam_date"] >= today]
+        self.skipped += len(due) - len(fresh)
+        await asyncio.gather(*(self._deliver(doc) for doc in fresh))
+        return len(due)
+
+    async def run(self):
+        self.running = True
+        try:
+            await self.load()
+            while True:
+                if time.monotonic() - self._loaded_at > EXAM_REMINDER_RELOAD:
+                    await self.load()
+                try:
+                    if await self.deliver_due():
+                        continue
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logging.error("Ошибка отправки напоминаний об экзаменах: %s", e)
+                    await asyncio.sleep(60)
+                    continue
+                self._wakeup.clear()
+                timeout = EXAM_REMINDER_RELOAD
+                if self._heap:
+                    timeout = min(timeout, max(self._heap[0][0] - time.time(), 0))
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.running = False
+
+    async def refresh_loop(self):
+        while True:
+            try:
+                await self.refresh_all()
+                await self.load()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Ошибка обновления списков экзаменов: %s", e)
+            await asyncio.sleep(EXAM_REFRESH_INTERVAL)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._heap),
+            "delivered": self.delivered,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,97 @@
+import asyncio
+import heapq
+import logging
+import os
+import time
+
+# Автоудаление файлов-снимков (project/JsonOut, project/MdOut).
+# Одна фоновая задача и куча (expires_at, path) вместо отдельной спящей задачи на каждый файл.
+# Срок жизни файла считается от его mtime, поэтому расписание удаления хранится
+# на диске вместе с самими файлами: после перезапуска каталоги пересканируются
+# и ничего не теряется. Перезаписанный файл получает новый срок при извлечении из кучи
+
+FILE_TTL_SECONDS = int(os.getenv("FILE_TTL_SECONDS", "1209600"))  # 14 дней
+FILE_CLEANUP_BATCH = int(os.getenv("FILE_CLEANUP_BATCH", "500"))
+FILE_CLEANUP_MAX_SLEEP = float(os.getenv("FILE_CLEANUP_MAX_SLEEP", "3600"))
+
+
+class FileExpiryScheduler:
+    def __init__(self, folders: list[str], ttl: int = FILE_TTL_SECONDS, batch_size: int = FILE_CLEANUP_BATCH):
+        self.folders = folders
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.deleted = 0
+        self._heap: list[tuple[float, str]] = []
+        # Один элемент кучи на файл, сколько бы раз он ни перезаписывался
+        self._scheduled: set[str] = set()
+        self._wakeup = asyncio.Event()
+
+    def schedule(self, file_path: str, expires_at: float | None = None):
+        if file_path in self._scheduled:
+            return
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self._scheduled.add(file_path)
+        heapq.heappush(self._heap, (expires_at, file_path))
+        if self._heap[0][1] == file_path:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def _scan(self) -> list[tuple[float, str]]:
+        found = []
+        for folder in self.folders:
+            try:
+                with os.scandir(folder) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            found.append((entry.stat().st_mtime + self.ttl, entry.path))
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _delete_batch(self, due: list[tuple[float, str]]) -> list[tuple[float, str]]:
+        # Выполняется в потоке. Возвращает файлы, которые были перезаписаны и еще не истекли
+        now = time.time()
+        reschedule = []
+        for _, file_path in due:
+            try:
+                expires_at = os.stat(file_path).st_mtime + self.ttl
+                if expires_at > now:
+                    reschedule.append((expires_at, file_path))
+                    continue
+                os.remove(file_path)
+                self.deleted += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.error("Ошибка при удалении файла %s: %s", file_path, e)
+        return reschedule
+
+    async def run(self):
+        for expires_at, file_path in await asyncio.to_thread(self._scan):
+            self.schedule(file_path, expires_at)
+        logging.info("Автоудаление файлов: в очереди %d файлов", len(self._heap))
+
+        while True:
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+                item = heapq.heappop(self._heap)
+                self._scheduled.discard(item[1])
+                due.append(item)
+
+            if due:
+                deleted_before = self.deleted
+                for expires_at, file_path in await asyncio.to_thread(self._delete_batch, due):
+                    self.schedule(file_path, expires_at)
+                logging.info("Автоудаление файлов: удалено %d", self.deleted - deleted_before)
+                continue
+
+            timeout = min(self._heap[0][0] - now, FILE_CLEANUP_MAX_SLEEP) if self._heap else FILE_CLEANUP_MAX_SLEEP
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
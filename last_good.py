@@ -0,0 +1,57 @@
+import asyncio
+import logging
+from datetime import timezone
+
+import httpx
+
+from cache import TTLCache
+from resilience import UpstreamUnavailable
+from render import escape_for_markdown_v2
+from database.db import get_last_good, save_last_good
+
+# Последний успешный ответ API по каждому пользователю и виду данных (MongoDB).
+# Если журнал недоступен, пользователь сразу получает сохраненные данные
+# с пометкой, на какой момент они актуальны, а не ошибку. Остальные ошибки
+# (в том числе AuthError - нужен повторный вход) пробрасываются как есть
+
+# Что уже сохранено: (user_id, kind) -> объект данных. Ответ из кэша группы
+# приходит тем же объектом, поэтому повторная запись в БД не нужна
+_saved = TTLCache(maxsize=50_000, ttl=3600)
+_background: set = set()
+
+
+def stale_notice(fetched_at) -> str:
+    # MarkdownV2-пометка о времени данных (в часовом поясе сервера)
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=timezone.utc)
+    moment = escape_for_markdown_v2(fetched_at.astimezone().strftime("%d.%m.%Y %H:%M"))
+    return f"⚠️ _Журнал сейчас недоступен, данные на {moment}_\n\n"
+
+
+def _remember(user_id: int, kind: str, data):
+    key = (user_id, kind)
+    if _saved.get(key) is data:
+        return
+    _saved.set(key, data)
+    task = asyncio.ensure_future(save_last_good(user_id, kind, data))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def fetch_or_last_good(user_id: int, kind: str, fetch, render) -> tuple:
+    """
+    fetch() -> (json, markdown) из API (или кэша); render(json) -> markdown.
+    При успехе ответ сохраняется в фоне, при недоступности журнала возвращается
+    последний сохраненный ответ с пометкой времени. Если сохраненного нет - ошибка пробрасывается.
+    """
+    try:
+        data, markdown = await fetch()
+    except (UpstreamUnavailable, httpx.TransportError) as e:
+        record = await get_last_good(user_id, kind)
+        if record is None:
+            raise
+        data, fetched_at = record
+        logging.warning("Отдаем сохраненный ответ %s пользователю %d: %s", kind, user_id, e)
+        return data, stale_notice(fetched_at) + render(data)
+    _remember(user_id, kind, data)
+    return data, markdown
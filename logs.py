@@ -0,0 +1,165 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Логирование процесса: хендлер в event loop только кладет запись в очередь,
+# форматирование и запись в поток выполняет фоновый поток (QueueListener).
+# Записи - JSON (LOG_FORMAT=json) с полями user_id / action / latency_ms / outcome,
+# если они переданы в extra (см. log_fields). Частые успешные записи горячих путей
+# помечаются sample=True и пропускаются с вероятностью 1 - LOG_SAMPLE_RATE;
+# предупреждения и ошибки не сэмплируются. Хендлер никогда не ждет место в очереди:
+# при переполнении запись отбрасывается (счетчики в get_logging_stats), а о числе
+# отброшенных записей пишется предупреждение, когда очередь освободится
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Не чаще чем раз в столько секунд пишется предупреждение об отброшенных записях
+LOG_DROP_REPORT_INTERVAL = float(os.getenv("LOG_DROP_REPORT_INTERVAL", "60"))
+
+STRUCTURED_FIELDS = ("user_id", "action", "latency_ms", "outcome", "sample_rate")
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener: QueueListener | None = None
+_queue_handler: "AsyncQueueHandler | None" = None
+
+
+def log_fields(action: str, user_id: int | None = None, latency: float | None = None, sample: bool = False, **extra) -> dict:
+    # extra для logging: logging.info("...", extra=log_fields("get_active_account", user_id=user_id, sample=True))
+    fields = {"action": action, **extra}
+    if user_id is not None:
+        fields["user_id"] = user_id
+    if latency is not None:
+        fields["latency_ms"] = round(latency * 1000, 2)
+    if sample:
+        fields["sample"] = True
+    return fields
+
+
+class SamplingFilter(logging.Filter):
+    # Пропускает долю rate записей с sample=True уровня ниже WARNING, остальные - все.
+    # Вес пропущенной записи (1 / rate) пишется в поле sample_rate для пересчета
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not getattr(record, "sample", False) or record.levelno >= logging.WARNING:
+            return True
+        if self.rate > 0 and random.random() < self.rate:
+            record.sample_rate = self.rate
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                entry[name] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class AsyncQueueHandler(QueueHandler):
+    # Кладет запись в очередь без форматирования (форматирует поток QueueListener).
+    # Вызывается в потоке логирующего кода (обычно event loop), поэтому не блокируется:
+    # при переполнении очереди запись отбрасывается и учитывается в счетчиках
+    def __init__(self, log_queue: queue.Queue, report_interval: float = LOG_DROP_REPORT_INTERVAL):
+        super().__init__(log_queue)
+        self.report_interval = report_interval
+        self.dropped = 0
+        self.dropped_warnings = 0
+        self._unreported = 0
+        self._reported_at = 0.0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Только подстановка аргументов: изменяемые объекты в args могут измениться до записи
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+            if record.levelno >= logging.WARNING:
+                self.dropped_warnings += 1
+            return
+        if self._unreported and time.monotonic() - self._reported_at >= self.report_interval:
+            self._report_dropped()
+
+    def _report_dropped(self):
+        report = logging.makeLogRecord({
+            "name": __name__, "levelno": logging.WARNING, "levelname": "WARNING",
+            "msg": f"Очередь логов была заполнена, отброшено записей: {self._unreported}",
+        })
+        try:
+            self.queue.put_nowait(report)
+        except queue.Full:
+            return
+        self._unreported = 0
+        self._reported_at = time.monotonic()
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, stream=None) -> QueueListener:
+    # Настраивает корневой логгер один раз на процесс (повторные вызовы ничего не меняют)
+    global _listener, _queue_handler
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT))
+
+    _queue_handler = AsyncQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    _queue_handler.addFilter(SamplingFilter())
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(_queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown_logging)
+    return _listener
+
+
+def shutdown_logging():
+    # Дописывает очередь и останавливает фоновый поток
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_logging_stats() -> dict:
+    if _queue_handler is None:
+        return {}
+    sampled_out = sum(f.sampled_out for f in _queue_handler.filters if isinstance(f, SamplingFilter))
+    return {
+        "queued": _queue_handler.queue.qsize(),
+        "dropped": _queue_handler.dropped,
+        "dropped_warnings": _queue_handler.dropped_warnings,
+        "sampled_out": sampled_out,
+    }
@@ -1,22 +1,39 @@
 import httpx
 import asyncio
 import json
-from datetime import datetime, timedelta
-from collections import defaultdict
+import base64
+from datetime import datetime, timedelta, timezone
 import os
-import re
+import time
 import logging
-from pymongo import MongoClient
-from pymongo.errors import PyMongoError, DuplicateKeyError
-from cryptography.fernet import Fernet, InvalidToken
+import hashlib
+from functools import lru_cache
+from pymongo import MongoClient, UpdateOne, InsertOne, DeleteMany
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 import pymongo
 
-# API
-LOGIN_URL = "https://msapi.top-academy.ru/api/v2/auth/login"
-SCHEDULE_API_URL = "https://msapi.top-academy.ru/api/v2/schedule/operations/get-by-date-range"
-LEADER_STREAM_URL = "https://msapi.top-academy.ru/api/v2/dashboard/progress/leader-stream"
-LEADER_GROUP_URL = "https://msapi.top-academy.ru/api/v2/dashboard/progress/leader-group"
-FUTURE_EXAMS_URL = "https://msapi.top-academy.ru/api/v2/dashboard/info/future-exams"
+from cache import TTLCache
+from render import (
+    escape_for_markdown_v2,
+    convert_schedule_to_markdown,
+    get_student_name,
+    convert_leader_stream_to_markdown,
+    create_leader_group_markdown,
+    convert_exams_to_markdown,
+)  # реэкспорт: остальные модули импортируют рендеринг из main
+from resilience import Endpoint, UpstreamUnavailable
+from metrics import CRYPTO_SECONDS, UPSTREAM_SECONDS, register_cache, register_gauge
+from logs import log_fields, setup_logging
+
+# API (JOURNAL_API_BASE можно направить на локальный mock, см. benchmarks/mock_journal.py)
+JOURNAL_API_BASE = os.getenv("JOURNAL_API_BASE", "https://msapi.top-academy.ru/api/v2").rstrip("/")
+LOGIN_URL = f"{JOURNAL_API_BASE}/auth/login"
+SCHEDULE_API_URL = f"{JOURNAL_API_BASE}/schedule/operations/get-by-date-range"
+LEADER_STREAM_URL = f"{JOURNAL_API_BASE}/dashboard/progress/leader-stream"
+LEADER_GROUP_URL = f"{JOURNAL_API_BASE}/dashboard/progress/leader-group"
+FUTURE_EXAMS_URL = f"{JOURNAL_API_BASE}/dashboard/info/future-exams"
+USER_INFO_URL = f"{JOURNAL_API_BASE}/settings/user-info"
 APPLICATION_KEY = "6a56a5df2667e65aab73ce76d1dd737f7d1faef9c52e8b8c55ac75f565d8e8a6"
 
 HEADERS = {
@@ -28,24 +45,124 @@ HEADERS = {
 
 MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://mongo:27017/botdb")
 MONGODB_DB = os.getenv("MONGODB_DB", "journalbot")
+# Старая коллекция (документ на аккаунт), переносится в MONGODB_USERS_COLLECTION при запуске
 MONGODB_COLLECTION = os.getenv("MONGODB_COLLECTION", "accounts")
+MONGODB_USERS_COLLECTION = os.getenv("MONGODB_USERS_COLLECTION", "users")
+MONGODB_SETTINGS_COLLECTION = os.getenv("MONGODB_SETTINGS_COLLECTION", "user_settings")
+MONGODB_JOBS_COLLECTION = os.getenv("MONGODB_JOBS_COLLECTION", "jobs")
+MONGODB_FINGERPRINTS_COLLECTION = os.getenv("MONGODB_FINGERPRINTS_COLLECTION", "schedule_fingerprints")
+MONGODB_FSM_COLLECTION = os.getenv("MONGODB_FSM_COLLECTION", "fsm_states")
+MONGODB_LAST_GOOD_COLLECTION = os.getenv("MONGODB_LAST_GOOD_COLLECTION", "last_good_responses")
+MONGODB_REMINDERS_COLLECTION = os.getenv("MONGODB_REMINDERS_COLLECTION", "exam_reminders")
+# Сколько хранится незавершенное состояние диалога (вход, управление аккаунтами)
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))
+# Сколько хранится последний успешный ответ API (показывается, когда журнал недоступен)
+LAST_GOOD_TTL = int(os.getenv("LAST_GOOD_TTL", str(30 * 86400)))
+# Один или несколько ключей Fernet через запятую. Первым шифруются новые пароли, остальные
+# только расшифровывают. Ротация: новый ключ ставится первым, фоновая задача
+# (password_rotation.py) перешифровывает пароли, после нее старый ключ можно убрать
 PASSWORD_ENC_KEY = os.getenv("PASSWORD_ENC_KEY")
+PASSWORD_ENC_KEYS = [key.strip() for key in (PASSWORD_ENC_KEY or "").split(",") if key.strip()]
+# Отпечаток основного ключа: хранится рядом с password_enc, чтобы находить пароли под старыми ключами
+PASSWORD_KEY_ID = hashlib.blake2b(PASSWORD_ENC_KEYS[0].encode("utf-8"), digest_size=6).hexdigest() if PASSWORD_ENC_KEYS else None
+
+# HTTP клиент для API журнала (пул соединений, keep-alive, таймауты)
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "0").lower() in ("1", "true", "yes")
+
+# Устойчивость к сбоям API (resilience.Endpoint): на каждый эндпоинт свой таймаут,
+# число повторов, лимит параллельных запросов и circuit breaker.
+# Переопределяются переменными API_<ИМЯ>_TIMEOUT / _RETRIES / _CONCURRENCY
+API_QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "5"))
+API_BREAKER_THRESHOLD = int(os.getenv("API_BREAKER_THRESHOLD", "5"))
+API_BREAKER_RESET = float(os.getenv("API_BREAKER_RESET", "30"))
+
+ACCOUNTS_MIGRATION_JOB = "migrate_accounts_to_users"
+# Отсрочка фонового обновления токена после неудачи, с (растет вдвое с каждой неудачей)
+TOKEN_REFRESH_BACKOFF_BASE = float(os.getenv("TOKEN_REFRESH_BACKOFF_BASE", "300"))
+TOKEN_REFRESH_BACKOFF_MAX = float(os.getenv("TOKEN_REFRESH_BACKOFF_MAX", "86400"))
+# Фоновое обновление токенов - только для пользователей, писавших боту за это время, с
+TOKEN_REFRESH_ACTIVE_WINDOW = float(os.getenv("TOKEN_REFRESH_ACTIVE_WINDOW", str(7 * 86400)))
+# Поля аккаунта, переносимые из старой коллекции
+LEGACY_ACCOUNT_FIELDS = ("username", "token", "token_expires_at", "password_enc", "password", "group")
+# Сколько аккаунтов перешифровывается за одну пачку (password_rotation.py)
+PASSWORD_REENCRYPT_BATCH = int(os.getenv("PASSWORD_REENCRYPT_BATCH", "500"))
 
+# Самый длинный диапазон расписания, который можно запросить за раз (/schedule, schedule_cache)
+SCHEDULE_MAX_WEEKS = int(os.getenv("SCHEDULE_MAX_WEEKS", "8"))
+
+# Кэш активного аккаунта (username, token, password) по user_id
+ACCOUNT_CACHE_SIZE = int(os.getenv("ACCOUNT_CACHE_SIZE", "10000"))
+ACCOUNT_CACHE_TTL = float(os.getenv("ACCOUNT_CACHE_TTL", "600"))
 
 
 mongo_client: MongoClient | None = None
-accounts_col = None
+users_col = None
+legacy_accounts_col = None
+settings_col = None
+jobs_col = None
+fingerprints_col = None
+reminders_col = None
+fsm_col = None
+last_good_col = None
+http_client: httpx.AsyncClient | None = None
+account_cache = TTLCache(maxsize=ACCOUNT_CACHE_SIZE, ttl=ACCOUNT_CACHE_TTL)
+
+
+def _endpoint(name: str, timeout: float, retries: int, concurrency: int) -> Endpoint:
+    prefix = f"API_{name.upper()}"
+    return Endpoint(
+        name,
+        timeout=float(os.getenv(f"{prefix}_TIMEOUT", str(timeout))),
+        retries=int(os.getenv(f"{prefix}_RETRIES", str(retries))),
+        max_concurrency=int(os.getenv(f"{prefix}_CONCURRENCY", str(concurrency))),
+        queue_timeout=API_QUEUE_TIMEOUT,
+        failure_threshold=API_BREAKER_THRESHOLD,
+        reset_timeout=API_BREAKER_RESET,
+    )
+
+
+# Логин - POST, поэтому без повторов
+api_endpoints = {
+    "login": _endpoint("login", 10, 0, 20),
+    "schedule": _endpoint("schedule", 8, 2, 30),
+    "leader_stream": _endpoint("leader_stream", 6, 2, 10),
+    "leader_group": _endpoint("leader_group", 6, 2, 10),
+    "future_exams": _endpoint("future_exams", 6, 2, 10),
+    "user_info": _endpoint("user_info", 6, 2, 10),
+}
+
+register_cache("account", account_cache)
+register_gauge(
+    "bot_upstream_breaker_open",
+    "Открыт ли circuit breaker эндпоинта API журнала",
+    lambda: {name: int(endpoint.breaker.state != endpoint.breaker.CLOSED) for name, endpoint in api_endpoints.items()},
+)
+
+setup_logging()
+
+
+class AuthError(Exception):
+    # Токен недействителен (401 от API журнала)
+    def __init__(self, message: str = "Ошибка авторизации"):
+        super().__init__(message)
 
-logging.basicConfig(level=logging.INFO)
 
 def generate_password_enc_key() -> str:
     return Fernet.generate_key().decode("utf-8")
 
-def _get_fernet() -> Fernet | None:
-    if not PASSWORD_ENC_KEY:
+@lru_cache(maxsize=1)
+def _get_fernet() -> MultiFernet | None:
+    # Создается один раз на процесс: разбор ключей не повторяется на каждом пароле
+    if not PASSWORD_ENC_KEYS:
         return None
     try:
-        return Fernet(PASSWORD_ENC_KEY.encode("utf-8"))
+        return MultiFernet([Fernet(key.encode("utf-8")) for key in PASSWORD_ENC_KEYS])
     except Exception:
         logging.error("Некорректный PASSWORD_ENC_KEY. Сгенерируйте новый ключ")
         return None
@@ -54,79 +171,306 @@ def encrypt_password(password: str) -> str:
     f = _get_fernet()
     if not f:
         raise RuntimeError("PASSWORD_ENC_KEY не задан. Нельзя шифровать пароль")
-    return f.encrypt(password.encode("utf-8")).decode("utf-8")
+    with CRYPTO_SECONDS.time("encrypt"):
+        return f.encrypt(password.encode("utf-8")).decode("utf-8")
 
 def decrypt_password(token_str: str) -> str:
     f = _get_fernet()
     if not f:
         raise RuntimeError("PASSWORD_ENC_KEY не задан. Нельзя расшифровать пароль")
     try:
-        return f.decrypt(token_str.encode("utf-8")).decode("utf-8")
+        with CRYPTO_SECONDS.time("decrypt"):
+            return f.decrypt(token_str.encode("utf-8")).decode("utf-8")
+    except InvalidToken:
+        raise RuntimeError("Не удалось расшифровать пароль. Неверный ключ или поврежденные данные")
+
+def rotate_password(token_str: str) -> str:
+    # Перешифровывает пароль основным ключом (расшифровка любым из ключей)
+    f = _get_fernet()
+    if not f:
+        raise RuntimeError("PASSWORD_ENC_KEY не задан. Нельзя перешифровать пароль")
+    try:
+        with CRYPTO_SECONDS.time("rotate"):
+            return f.rotate(token_str.encode("utf-8")).decode("utf-8")
     except InvalidToken:
         raise RuntimeError("Не удалось расшифровать пароль. Неверный ключ или поврежденные данные")
 
 def init_db():
     # Инициализация MongoDB, коллекция и индексы
-    global mongo_client, accounts_col
+    global mongo_client, users_col, legacy_accounts_col, settings_col, jobs_col, fingerprints_col, fsm_col, last_good_col, reminders_col
     try:
         # Таймер на подключение к MongoDB
         mongo_client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=3000)
         db = mongo_client[MONGODB_DB]
-        accounts_col = db[MONGODB_COLLECTION]
+        users_col = db[MONGODB_USERS_COLLECTION]
+        legacy_accounts_col = db[MONGODB_COLLECTION]
+        settings_col = db[MONGODB_SETTINGS_COLLECTION]
+        jobs_col = db[MONGODB_JOBS_COLLECTION]
+        fingerprints_col = db[MONGODB_FINGERPRINTS_COLLECTION]
+        reminders_col = db[MONGODB_REMINDERS_COLLECTION]
+        fsm_col = db[MONGODB_FSM_COLLECTION]
+        last_good_col = db[MONGODB_LAST_GOOD_COLLECTION]
         # ping для проверки соединения
         mongo_client.admin.command("ping")
-        # уникальность пары (user_id, username)
-        accounts_col.create_index([("user_id", 1), ("username", 1)], unique=True)
-        logging.info("MongoDB инициализирована (%s / %s)", MONGODB_DB, MONGODB_COLLECTION)
+        # Документ пользователя ищется по _id (user_id), обход по порядку user_id - тоже по _id.
+        # Поиск активных токенов, которые скоро истекут (фоновое обновление)
+        users_col.create_index([("token_expires_at", 1)], sparse=True)
+        # состояния FSM удаляются MongoDB через FSM_STATE_TTL после последнего изменения
+        fsm_col.create_index([("updated_at", 1)], expireAfterSeconds=FSM_STATE_TTL)
+        last_good_col.create_index([("fetched_at", 1)], expireAfterSeconds=LAST_GOOD_TTL)
+        # напоминания пользователя (обновление списка экзаменов)
+        reminders_col.create_index([("user_id", 1)])
+        logging.info("MongoDB инициализирована (%s / %s)", MONGODB_DB, MONGODB_USERS_COLLECTION)
+        migrate_legacy_accounts()
     except PyMongoError as e:
         logging.error("Ошибка при инициализации MongoDB: %s", e)
         raise
 
-def add_account(user_id, username, token):
-    # Добавляет/обновляет аккаунт и делает его активным. Пароль не сохраняется
-    if accounts_col is None:
+def get_token_expiry(token: str | None) -> datetime | None:
+    # Время истечения токена из claim "exp" JWT (подпись не проверяется)
+    if not token:
+        return None
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return datetime.fromtimestamp(int(exp), tz=timezone.utc) if exp else None
+    except (IndexError, ValueError, TypeError):
+        return None
+
+def is_token_expiring(token: str | None, margin_seconds: float = 0) -> bool:
+    # True, если токен истекает в ближайшие margin_seconds. Токены без exp считаем действительными
+    expires_at = get_token_expiry(token)
+    if expires_at is None:
+        return False
+    return expires_at <= datetime.now(timezone.utc) + timedelta(seconds=margin_seconds)
+
+# Аккаунты: один документ на пользователя Telegram
+# {_id: user_id, active: username, accounts: [{username, token, token_expires_at, password_enc, group}],
+#  token_expires_at: срок токена активного аккаунта с паролем (для фонового обновления)}
+# Каждое изменение - одно атомарное обновление документа (update с aggregation pipeline),
+# поэтому пользователь не может остаться без активного аккаунта или с двумя активными
+
+def _lit(value):
+    # Значения пользователя в pipeline: строка, начинающаяся с "$", не должна стать путем к полю
+    return {"$literal": value}
+
+def _find_account(username_expr) -> dict:
+    return {"$arrayElemAt": [
+        {"$filter": {"input": {"$ifNull": ["$accounts", []]}, "cond": {"$eq": ["$$this.username", username_expr]}}},
+        0,
+    ]}
+
+# Последняя стадия каждого обновления: пересчет token_expires_at документа по активному аккаунту
+# Любое изменение аккаунтов (новый вход, новый токен, смена активного) снимает отсрочку фонового обновления
+# и считается использованием бота (last_used_at, см. touch_user)
+_ACTIVE_EXPIRY_STAGE = {"$set": {
+    "token_expires_at": {"$let": {
+        "vars": {"account": _find_account("$active")},
+        "in": {"$cond": [{"$ifNull": ["$$account.password_enc", False]}, "$$account.token_expires_at", "$$REMOVE"]},
+    }},
+    "next_refresh_at": "$$REMOVE",
+    "token_refresh_failures": "$$REMOVE",
+    "last_used_at": "$$NOW",
+}}
+
+def _upsert_account_pipeline(username: str, fields: dict) -> list:
+    # Обновляет аккаунт username (или добавляет в конец списка) и делает его активным
+    fields = {name: _lit(value) for name, value in {"username": username, **fields}.items()}
+    return [
+        {"$set": {
+            "accounts": {"$cond": [
+                {"$in": [_lit(username), {"$ifNull": ["$accounts.username", []]}]},
+                {"$map": {"input": "$accounts", "in": {"$cond": [
+                    {"$eq": ["$$this.username", _lit(username)]}, {"$mergeObjects": ["$$this", fields]}, "$$this",
+                ]}}},
+                {"$concatArrays": [{"$ifNull": ["$accounts", []]}, [fields]]},
+            ]},
+            "active": _lit(username),
+        }},
+        _ACTIVE_EXPIRY_STAGE,
+    ]
+
+def _active_from_doc(doc: dict | None) -> dict | None:
+    if not doc or not doc.get("active"):
+        return None
+    for account in doc.get("accounts", ()):
+        if account.get("username") == doc["active"]:
+            return account
+    return None
+
+def _upsert_account(user_id: int, username: str, fields: dict):
+    # Два одновременных первых входа одного пользователя: один upsert создает документ,
+    # второй получает DuplicateKeyError и повторяется уже как обновление существующего
+    pipeline = _upsert_account_pipeline(username, fields)
+    try:
+        users_col.update_one({"_id": user_id}, pipeline, upsert=True)
+    except DuplicateKeyError:
+        logging.warning("Дубликат документа пользователя %d при добавлении аккаунта %s, повтор", user_id, username)
+        users_col.update_one({"_id": user_id}, pipeline, upsert=True)
+
+def add_account(user_id, username, token) -> bool:
+    # Добавляет/обновляет аккаунт и делает его активным. Пароль не сохраняется.
+    # Возвращает False, если аккаунт сохранить не удалось
+    if users_col is None:
         init_db()
     try:
-        accounts_col.update_many({"user_id": user_id}, {"$set": {"is_active": False}})
-        accounts_col.update_one(
-            {"user_id": user_id, "username": username},
-            {"$set": {"token": token, "is_active": True}, "$unset": {"password": "", "password_enc": ""}},
-            upsert=True,
-        )
+        _upsert_account(user_id, username, {
+            "token": token, "token_expires_at": get_token_expiry(token),
+            "password_enc": None, "password_key": None, "password": None,
+        })
+        account_cache.pop(user_id)
         logging.info("Аккаунт %s для пользователя %d сохранен (без пароля)", username, user_id)
+        return True
     except PyMongoError as e:
         logging.error("Ошибка при добавлении аккаунта для пользователя %d: %s", user_id, e)
+        return False
 
-def add_account_with_password(user_id: int, username: str, password: str, token: str):
-    # бновляем аккаунт, сохраняя токен и пароль (для автологина при 401 ведь колледж не выдаст нормальный апи)
-    if accounts_col is None:
+def add_account_with_password(user_id: int, username: str, password: str, token: str) -> bool:
+    # бновляем аккаунт, сохраняя токен и пароль (для автологина при 401 ведь колледж не выдаст нормальный апи).
+    # Возвращает False, если аккаунт сохранить не удалось
+    if users_col is None:
         init_db()
     try:
         password_enc = encrypt_password(password)
-        accounts_col.update_many({"user_id": user_id}, {"$set": {"is_active": False}})
-        accounts_col.update_one(
-            {"user_id": user_id, "username": username},
-            {"$set": {"token": token, "password_enc": password_enc, "is_active": True}, "$unset": {"password": ""}},
-            upsert=True,
-        )
+        _upsert_account(user_id, username, {
+            "token": token, "token_expires_at": get_token_expiry(token),
+            "password_enc": password_enc, "password_key": PASSWORD_KEY_ID, "password": None,
+        })
+        # write-through: следующий запрос не пойдет в БД и не будет расшифровывать пароль
+        account_cache.set(user_id, (username, token, password))
         logging.info("Аккаунт %s для пользователя %d сохранен (с шифрованным паролем).", username, user_id)
-    except DuplicateKeyError:
-        logging.warning("Дубликат аккаунта %s для пользователя %d", username, user_id)
+        return True
     except RuntimeError as e:
         logging.error("%s", e)
         raise
     except PyMongoError as e:
         logging.error("Ошибка при добавлении аккаунта (с паролем) для пользователя %d: %s", user_id, e)
+        return False
+
+def update_account_token(user_id: int, username: str, token: str):
+    # Обновляет только токен аккаунта (пароль не перешифровывается и не перезаписывается)
+    if users_col is None:
+        init_db()
+    try:
+        users_col.update_one(
+            {"_id": user_id, "accounts.username": username},
+            [
+                {"$set": {"accounts": {"$map": {"input": "$accounts", "in": {"$cond": [
+                    {"$eq": ["$$this.username", _lit(username)]},
+                    {"$mergeObjects": ["$$this", {"token": _lit(token), "token_expires_at": _lit(get_token_expiry(token))}]},
+                    "$$this",
+                ]}}}}},
+                _ACTIVE_EXPIRY_STAGE,
+            ],
+        )
+        cached = account_cache.get(user_id)
+        if cached and cached[0] == username:
+            account_cache.set(user_id, (username, token, cached[2]))
+        else:
+            account_cache.pop(user_id)
+        logging.info("Токен аккаунта %s для пользователя %d обновлен", username, user_id)
+    except PyMongoError as e:
+        logging.error("Ошибка при обновлении токена для пользователя %d: %s", user_id, e)
+
+def get_accounts_expiring_before(deadline: datetime, limit: int = 500) -> list:
+    # Активные аккаунты с сохраненным паролем, чей токен истекает до deadline, у пользователей,
+    # которые пользовались ботом за последние TOKEN_REFRESH_ACTIVE_WINDOW. Токены остальных
+    # обновляются при следующем запросе (call_with_auth). Возвращает [(user_id, username, password)]
+    if users_col is None:
+        init_db()
+    now = datetime.now(timezone.utc)
+    try:
+        # Аккаунты, обновление которых недавно не удалось, ждут next_refresh_at
+        cursor = users_col.find(
+            {
+                "token_expires_at": {"$lte": deadline},
+                "last_used_at": {"$gte": now - timedelta(seconds=TOKEN_REFRESH_ACTIVE_WINDOW)},
+                "next_refresh_at": {"$not": {"$gt": now}},
+            },
+            {"active": 1, "accounts": 1},
+        ).sort("token_expires_at", 1).limit(limit)
+        accounts = []
+        for doc in cursor:
+            account = _active_from_doc(doc)
+            if not account or not account.get("password_enc"):
+                continue
+            try:
+                accounts.append((doc["_id"], account["username"], decrypt_password(account["password_enc"])))
+            except RuntimeError as e:
+                logging.error("Аккаунт %s пользователя %d: %s", account.get("username"), doc["_id"], e)
+                record_token_refresh_failure(doc["_id"], account["username"])
+        return accounts
+    except PyMongoError as e:
+        logging.error("Ошибка при поиске истекающих токенов: %s", e)
+        return []
+
+def touch_user(user_id: int):
+    # Отметка, что пользователь пользуется ботом (для фонового обновления токенов)
+    if users_col is None:
+        init_db()
+    try:
+        users_col.update_one({"_id": user_id}, {"$set": {"last_used_at": datetime.now(timezone.utc)}})
+    except PyMongoError as e:
+        logging.error("Ошибка при отметке активности пользователя %d: %s", user_id, e)
+
+def record_token_refresh_failure(user_id: int, username: str, permanent: bool = False):
+    # Неудачное обновление токена активного аккаунта. Аккаунт откладывается с экспоненциальной
+    # задержкой (TOKEN_REFRESH_BACKOFF_BASE * 2^(n-1), не больше TOKEN_REFRESH_BACKOFF_MAX);
+    # permanent (неверный пароль) - исключается из фонового обновления до следующего входа
+    if users_col is None:
+        init_db()
+    if permanent:
+        update = {"$unset": {"token_expires_at": "", "next_refresh_at": "", "token_refresh_failures": ""}}
+    else:
+        failures = {"$add": [{"$ifNull": ["$token_refresh_failures", 0]}, 1]}
+        delay_ms = {"$multiply": [1000, {"$min": [
+            TOKEN_REFRESH_BACKOFF_MAX,
+            {"$multiply": [TOKEN_REFRESH_BACKOFF_BASE, {"$pow": [2, {"$subtract": [failures, 1]}]}]},
+        ]}]}
+        update = [{"$set": {
+            "token_refresh_failures": failures,
+            "next_refresh_at": {"$add": [_lit(datetime.now(timezone.utc)), delay_ms]},
+        }}]
+    try:
+        users_col.update_one({"_id": user_id, "active": username}, update)
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении отсрочки обновления токена пользователя %d: %s", user_id, e)
+
+def get_account_group(user_id: int, username: str) -> str | None:
+    # Группа аккаунта (сохраняется при первом запросе user-info)
+    if users_col is None:
+        init_db()
+    try:
+        doc = users_col.find_one({"_id": user_id, "accounts.username": username}, {"accounts.$": 1})
+        return doc["accounts"][0].get("group") if doc else None
+    except PyMongoError as e:
+        logging.error("Ошибка при получении группы аккаунта %s пользователя %d: %s", username, user_id, e)
+        return None
+
+def set_account_group(user_id: int, username: str, group: str):
+    if users_col is None:
+        init_db()
+    try:
+        users_col.update_one({"_id": user_id, "accounts.username": username}, {"$set": {"accounts.$.group": group}})
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении группы аккаунта %s пользователя %d: %s", username, user_id, e)
 
 def get_active_account(user_id):
     # Получаем активный аккаунт и его токен для указанного пользователя
-    if accounts_col is None:
+    cached = account_cache.get(user_id)
+    if cached:
+        return (cached[0], cached[1])
+    if users_col is None:
         init_db()
     try:
-        doc = accounts_col.find_one({"user_id": user_id, "is_active": True}, {"username": 1, "token": 1, "_id": 0})
-        if doc:
-            logging.info("Активный аккаунт для пользователя %d получен из БД", user_id)
-            return (doc.get("username"), doc.get("token"))
+        account = _active_from_doc(users_col.find_one({"_id": user_id}, {"active": 1, "accounts.username": 1, "accounts.token": 1}))
+        if account:
+            logging.info(
+                "Активный аккаунт для пользователя %d получен из БД", user_id,
+                extra=log_fields("get_active_account", user_id=user_id, sample=True),
+            )
+            return (account.get("username"), account.get("token"))
         return None
     except PyMongoError as e:
         logging.error("Ошибка при получении активного аккаунта для пользователя %d: %s", user_id, e)
@@ -134,31 +478,26 @@ def get_active_account(user_id):
 
 def get_active_account_full(user_id: int):
     # Получаем активный аккаунт (username, token, password)
-    if accounts_col is None:
+    cached = account_cache.get(user_id)
+    if cached:
+        return cached
+    if users_col is None:
         init_db()
+    epoch = account_cache.epoch()
     try:
-        doc = accounts_col.find_one(
-            {"user_id": user_id, "is_active": True},
-            {"username": 1, "token": 1, "password_enc": 1, "password": 1, "_id": 0},
-        )
-        if doc:
-            logging.info("Активный аккаунт для пользователя %d получен из БД", user_id)
-            username = doc.get("username")
-            token = doc.get("token")
-
-            # если старый plaintext password есть шифруем
-            if doc.get("password") and not doc.get("password_enc"):
-                if _get_fernet():
-                    enc = encrypt_password(doc["password"])
-                    accounts_col.update_one(
-                        {"user_id": user_id, "username": username},
-                        {"$set": {"password_enc": enc}, "$unset": {"password": ""}},
-                    )
-                    doc["password_enc"] = enc
-
-            password = None
-            if doc.get("password_enc"):
-                password = decrypt_password(doc["password_enc"])
+        account = _active_from_doc(users_col.find_one({"_id": user_id}, {"active": 1, "accounts": 1}))
+        if account:
+            logging.info(
+                "Активный аккаунт для пользователя %d получен из БД", user_id,
+                extra=log_fields("get_active_account", user_id=user_id, sample=True),
+            )
+            username = account.get("username")
+            token = account.get("token")
+            # Только расшифровка: старые открытые пароли шифрует фоновая задача (password_rotation.py)
+            password = account.get("password")
+            if account.get("password_enc"):
+                password = decrypt_password(account["password_enc"])
+            account_cache.set(user_id, (username, token, password), epoch=epoch)
             return (username, token, password)
         return None
     except PyMongoError as e:
@@ -167,65 +506,394 @@ def get_active_account_full(user_id: int):
 
 def get_all_accounts(user_id):
     # Получаем все аккаунты для указанного пользователя
-    if accounts_col is None:
+    if users_col is None:
         init_db()
     try:
-        cursor = accounts_col.find({"user_id": user_id}, {"username": 1, "is_active": 1, "_id": 0})
-        accounts = [(doc.get("username"), bool(doc.get("is_active"))) for doc in cursor]
-        logging.info("Список аккаунтов для пользователя %d получен", user_id)
+        doc = users_col.find_one({"_id": user_id}, {"active": 1, "accounts.username": 1}) or {}
+        accounts = [(account.get("username"), account.get("username") == doc.get("active")) for account in doc.get("accounts", ())]
+        logging.info(
+            "Список аккаунтов для пользователя %d получен", user_id,
+            extra=log_fields("get_all_accounts", user_id=user_id, sample=True),
+        )
         return accounts
     except PyMongoError as e:
         logging.error("[Ошибка при получении всех аккаунтов для пользователя %d: %s", user_id, e)
         return []
 
 def set_active_account(user_id, username):
-    # Устанавливаем указанный аккаунт как активный для пользователя
-    if accounts_col is None:
+    # Устанавливаем указанный аккаунт как активным для пользователя (только если такой аккаунт есть)
+    if users_col is None:
         init_db()
     try:
-        accounts_col.update_many({"user_id": user_id}, {"$set": {"is_active": False}})
-        accounts_col.update_one({"user_id": user_id, "username": username}, {"$set": {"is_active": True}})
+        users_col.update_one(
+            {"_id": user_id, "accounts.username": username},
+            [{"$set": {"active": _lit(username)}}, _ACTIVE_EXPIRY_STAGE],
+        )
+        account_cache.pop(user_id)
         logging.info("Активным аккаунтом для пользователя %d установлен %s", user_id, username)
     except PyMongoError as e:
         logging.error("Ошибка при смене активного аккаунта для пользователя %d: %s", user_id, e)
 
 def delete_account(user_id, username):
-    # Удаляет аккаунт из базы данных
-    if accounts_col is None:
+    # Удаляет аккаунт. Если он был активным, активным становится первый из оставшихся
+    if users_col is None:
         init_db()
     try:
-        accounts_col.delete_one({"user_id": user_id, "username": username})
+        users_col.update_one(
+            {"_id": user_id},
+            [
+                {"$set": {"accounts": {"$filter": {
+                    "input": {"$ifNull": ["$accounts", []]}, "cond": {"$ne": ["$$this.username", _lit(username)]},
+                }}}},
+                {"$set": {"active": {"$cond": [
+                    {"$eq": ["$active", _lit(username)]},
+                    {"$ifNull": [{"$arrayElemAt": ["$accounts.username", 0]}, None]},
+                    "$active",
+                ]}}},
+                _ACTIVE_EXPIRY_STAGE,
+            ],
+        )
+        account_cache.pop(user_id)
         logging.info("Аккаунт %s для пользователя %d удален", username, user_id)
     except PyMongoError as e:
         logging.error("Ошибка при удалении аккаунта %s для пользователя %d: %s", username, user_id, e)
 
 def has_accounts(user_id):
     # Проверяет, есть ли у пользователя какие-либо аккаунты
-    if accounts_col is None:
+    if account_cache.get(user_id):
+        return True
+    if users_col is None:
         init_db()
     try:
-        count = accounts_col.count_documents({"user_id": user_id})
-        return count > 0
+        return users_col.find_one({"_id": user_id, "accounts.0": {"$exists": True}}, {"_id": 1}) is not None
     except PyMongoError as e:
         logging.error("Ошибка при проверке наличия аккаунтов для пользователя %d: %s", user_id, e)
         return False
 
 def delete_all_accounts(user_id: int):
    # Удаляет все аккаунты для указанного пользователя
-    if accounts_col is None:
+    if users_col is None:
         init_db()
     try:
-        accounts_col.delete_many({"user_id": user_id})
+        users_col.delete_one({"_id": user_id})
+        account_cache.pop(user_id)
         logging.info("Все аккаунты для пользователя %d удалены", user_id)
     except PyMongoError as e:
         logging.error("Ошибка при удалении всех аккаунтов для пользователя %d: %s", user_id, e)
 
+def get_active_accounts_page(after_user_id: int | None = None, limit: int = 500) -> list:
+    # Страница активных аккаунтов по возрастанию user_id: [(user_id, username, group)]
+    if users_col is None:
+        init_db()
+    query = {"active": {"$type": "string"}}
+    if after_user_id is not None:
+        query["_id"] = {"$gt": after_user_id}
+    try:
+        cursor = users_col.find(query, {"active": 1, "accounts.username": 1, "accounts.group": 1}).sort("_id", 1).limit(limit)
+        page = []
+        for doc in cursor:
+            account = _active_from_doc(doc)
+            if account:
+                page.append((doc["_id"], account["username"], account.get("group")))
+        return page
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении списка активных аккаунтов: %s", e)
+        return []
+
+def migrate_legacy_accounts(batch_size: int = 1000) -> int:
+    # Переносит старую коллекцию MONGODB_COLLECTION (документ на аккаунт, флаг is_active)
+    # в документы пользователей. Пачки bulk_write, существующие документы пользователей
+    # не перезаписываются ($setOnInsert), поэтому перенос можно безопасно повторить.
+    # Старая коллекция не удаляется. Возвращает число перенесенных пользователей
+    if get_job_state(ACCOUNTS_MIGRATION_JOB) or legacy_accounts_col.estimated_document_count() == 0:
+        return 0
+
+    def user_doc(user_accounts: list) -> dict:
+        accounts = []
+        active = None
+        for legacy in user_accounts:
+            account = {key: legacy[key] for key in LEGACY_ACCOUNT_FIELDS if legacy.get(key) is not None}
+            if account.get("password") and not account.get("password_enc") and _get_fernet():
+                account["password_enc"] = encrypt_password(account.pop("password"))
+                account["password_key"] = PASSWORD_KEY_ID
+            accounts.append(account)
+            if legacy.get("is_active") and active is None:
+                active = account["username"]
+        # Пользователь без активного аккаунта (сбой между двумя обновлениями) получает первый
+        active = active or accounts[0]["username"]
+        doc = {"active": active, "accounts": accounts}
+        account = _active_from_doc(doc)
+        if account.get("password_enc") and account.get("token_expires_at"):
+            doc["token_expires_at"] = account["token_expires_at"]
+        return doc
+
+    migrated = 0
+    operations = []
+    current_user, user_accounts = None, []
+    cursor = legacy_accounts_col.find({}, {"_id": 0}).sort([("user_id", 1), ("username", 1)])
+    for legacy in cursor:
+        if legacy.get("user_id") != current_user and user_accounts:
+            operations.append(UpdateOne({"_id": current_user}, {"$setOnInsert": user_doc(user_accounts)}, upsert=True))
+            user_accounts = []
+        current_user = legacy.get("user_id")
+        user_accounts.append(legacy)
+        if len(operations) >= batch_size:
+            migrated += users_col.bulk_write(operations, ordered=False).upserted_count
+            operations = []
+    if user_accounts:
+        operations.append(UpdateOne({"_id": current_user}, {"$setOnInsert": user_doc(user_accounts)}, upsert=True))
+    if operations:
+        migrated += users_col.bulk_write(operations, ordered=False).upserted_count
+
+    save_job_state(ACCOUNTS_MIGRATION_JOB, done=True, migrated=migrated)
+    logging.info("Перенесено пользователей из коллекции %s: %d", MONGODB_COLLECTION, migrated)
+    return migrated
+
+# Настройки пользователей (подписки на рассылки)
+
+def set_user_setting(user_id: int, name: str, value):
+    if settings_col is None:
+        init_db()
+    try:
+        settings_col.update_one({"_id": user_id}, {"$set": {name: value}}, upsert=True)
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении настройки %s для пользователя %d: %s", name, user_id, e)
+
+def get_user_setting(user_id: int, name: str, default=None):
+    if settings_col is None:
+        init_db()
+    try:
+        doc = settings_col.find_one({"_id": user_id}, {name: 1})
+        return doc.get(name, default) if doc else default
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении настройки %s для пользователя %d: %s", name, user_id, e)
+        return default
+
+def get_users_with_setting(name: str, value=True) -> list:
+    if settings_col is None:
+        init_db()
+    try:
+        return [doc["_id"] for doc in settings_col.find({name: value}, {"_id": 1})]
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении подписчиков %s: %s", name, e)
+        return []
+
+# Перешифрование паролей (открытые пароли старой схемы и пароли под старыми ключами)
+
+def _needs_reencrypt_query() -> dict:
+    return {"$elemMatch": {"$or": [
+        {"password": {"$type": "string"}},
+        {"password_enc": {"$type": "string"}, "password_key": {"$ne": PASSWORD_KEY_ID}},
+    ]}}
+
+def get_passwords_to_reencrypt_page(after_user_id: int | None = None, limit: int = PASSWORD_REENCRYPT_BATCH) -> list:
+    # Страница по возрастанию user_id: [(user_id, username, password, password_enc)]
+    if users_col is None:
+        init_db()
+    query = {"accounts": _needs_reencrypt_query()}
+    if after_user_id is not None:
+        query["_id"] = {"$gt": after_user_id}
+    projection = {"accounts.username": 1, "accounts.password": 1, "accounts.password_enc": 1, "accounts.password_key": 1}
+    try:
+        page = []
+        for doc in users_col.find(query, projection).sort("_id", 1).limit(limit):
+            for account in doc.get("accounts", ()):
+                if account.get("password") or (account.get("password_enc") and account.get("password_key") != PASSWORD_KEY_ID):
+                    page.append((doc["_id"], account["username"], account.get("password"), account.get("password_enc")))
+        return page
+    except PyMongoError as e:
+        logging.error("Ошибка при поиске паролей для перешифрования: %s", e)
+        return []
+
+def save_reencrypted_passwords(updates: list) -> int:
+    # updates: [(user_id, username, old_password, old_password_enc, new_password_enc)].
+    # Одна пачка bulk_write; аккаунт обновляется, только если пароль не сменился с момента чтения
+    if users_col is None:
+        init_db()
+    operations = []
+    for user_id, username, old_password, old_password_enc, new_password_enc in updates:
+        match = {"username": username}
+        if old_password_enc:
+            match["password_enc"] = old_password_enc
+        else:
+            match["password"] = old_password
+        operations.append(UpdateOne(
+            {"_id": user_id, "accounts": {"$elemMatch": match}},
+            {
+                "$set": {"accounts.$.password_enc": new_password_enc, "accounts.$.password_key": PASSWORD_KEY_ID},
+                "$unset": {"accounts.$.password": ""},
+            },
+        ))
+    if not operations:
+        return 0
+    try:
+        return users_col.bulk_write(operations, ordered=False).modified_count
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении перешифрованных паролей: %s", e)
+        return 0
+
+# Состояние фоновых задач (для продолжения после перезапуска)
+
+def get_job_state(job_id: str) -> dict | None:
+    if jobs_col is None:
+        init_db()
+    try:
+        return jobs_col.find_one({"_id": job_id})
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении состояния задачи %s: %s", job_id, e)
+        return None
+
+def save_job_state(job_id: str, **fields):
+    if jobs_col is None:
+        init_db()
+    try:
+        fields["updated_at"] = datetime.now(timezone.utc)
+        jobs_col.update_one({"_id": job_id}, {"$set": fields}, upsert=True)
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении состояния задачи %s: %s", job_id, e)
+
+# Отпечатки расписания (для уведомлений об изменениях)
+
+def get_schedule_fingerprints(user_id: int) -> tuple | None:
+    # Возвращает (week_start, lessons), lessons - список [date, started_at, subject, teacher, room]
+    if fingerprints_col is None:
+        init_db()
+    try:
+        doc = fingerprints_col.find_one({"_id": user_id})
+        return (doc["week"], doc["lessons"]) if doc else None
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении отпечатков расписания пользователя %d: %s", user_id, e)
+        return None
+
+def save_schedule_fingerprints(user_id: int, week_start: str, lessons: list):
+    if fingerprints_col is None:
+        init_db()
+    try:
+        fingerprints_col.update_one({"_id": user_id}, {"$set": {"week": week_start, "lessons": lessons}}, upsert=True)
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении отпечатков расписания пользователя %d: %s", user_id, e)
+
+# Напоминания об экзаменах (см. exam_reminders.py)
+# {_id: "user_id:дата экзамена:за сколько дней:хэш предмета", user_id, due_at, exam_date, spec, days_before}
+
+def get_user_reminder_ids(user_id: int) -> list:
+    if reminders_col is None:
+        init_db()
+    try:
+        return [doc["_id"] for doc in reminders_col.find({"user_id": user_id}, {"_id": 1})]
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении напоминаний пользователя %d: %s", user_id, e)
+        return []
+
+def save_user_reminders(user_id: int, added: list, removed: list):
+    # Изменения напоминаний пользователя одной пачкой: added - новые документы, removed - _id
+    if reminders_col is None:
+        init_db()
+    operations = [InsertOne({**doc, "user_id": user_id}) for doc in added]
+    if removed:
+        operations.append(DeleteMany({"_id": {"$in": removed}, "user_id": user_id}))
+    if not operations:
+        return
+    try:
+        reminders_col.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        # Уже существующее напоминание (одновременное обновление) - не ошибка
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            logging.error("Ошибка при сохранении напоминаний пользователя %d: %s", user_id, e)
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении напоминаний пользователя %d: %s", user_id, e)
+
+def delete_user_reminders(user_id: int):
+    if reminders_col is None:
+        init_db()
+    try:
+        reminders_col.delete_many({"user_id": user_id})
+    except PyMongoError as e:
+        logging.error("Ошибка при удалении напоминаний пользователя %d: %s", user_id, e)
+
+def get_pending_reminders_page(after_id: str | None = None, limit: int = 5000) -> list:
+    # Страница всех напоминаний по _id: [(_id, due_at)] - для построения очереди планировщика
+    if reminders_col is None:
+        init_db()
+    query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+    try:
+        return [(doc["_id"], doc["due_at"]) for doc in reminders_col.find(query, {"due_at": 1}).sort("_id", 1).limit(limit)]
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении очереди напоминаний: %s", e)
+        return []
+
+def claim_reminders(reminder_ids: list) -> list:
+    # Забирает напоминания к отправке: документы удаляются до отправки (не больше одного раза).
+    # Отсутствующие _id (экзамен перенесен, подписка отключена) пропускаются
+    if reminders_col is None:
+        init_db()
+    try:
+        docs = list(reminders_col.find({"_id": {"$in": reminder_ids}}))
+        if docs:
+            reminders_col.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        return docs
+    except PyMongoError as e:
+        logging.error("Ошибка при выборке напоминаний к отправке: %s", e)
+        return []
+
+# Состояния FSM aiogram (см. database/fsm_storage.py)
+
+def get_fsm_record(key: str) -> dict | None:
+    if fsm_col is None:
+        init_db()
+    try:
+        return fsm_col.find_one({"_id": key}, {"state": 1, "data": 1, "_id": 0})
+    except PyMongoError as e:
+        # Пробрасывается: отсутствие записи и ошибка чтения для FSM - разные вещи
+        logging.error("Ошибка при получении состояния FSM %s: %s", key, e)
+        raise
+
+def save_fsm_record(key: str, state: str | None, data: dict):
+    if fsm_col is None:
+        init_db()
+    try:
+        if state is None and not data:
+            fsm_col.delete_one({"_id": key})
+            return
+        fsm_col.update_one(
+            {"_id": key},
+            {"$set": {"state": state, "data": data, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении состояния FSM %s: %s", key, e)
+        raise
+
+# Последние успешные ответы API по пользователю (см. last_good.py)
+
+def get_last_good(user_id: int, kind: str) -> tuple | None:
+    # Возвращает (data, fetched_at) или None
+    if last_good_col is None:
+        init_db()
+    try:
+        doc = last_good_col.find_one({"_id": f"{user_id}:{kind}"})
+        return (doc["data"], doc["fetched_at"]) if doc else None
+    except PyMongoError as e:
+        logging.error("Ошибка при чтении сохраненного ответа %s пользователя %d: %s", kind, user_id, e)
+        return None
+
+def save_last_good(user_id: int, kind: str, data):
+    if last_good_col is None:
+        init_db()
+    try:
+        last_good_col.update_one(
+            {"_id": f"{user_id}:{kind}"},
+            {"$set": {"user_id": user_id, "kind": kind, "data": data, "fetched_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+    except PyMongoError as e:
+        logging.error("Ошибка при сохранении ответа %s пользователя %d: %s", kind, user_id, e)
+
 
+def get_account_cache_stats() -> dict:
+    # Счетчики попаданий/промахов кэша аккаунтов
+    return account_cache.stats()
 
-def escape_for_markdown_v2(text: str) -> str:
-    # Экранирует специальные символы Markdown V2
-    escape_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{re.escape(escape_chars)}])', r'\\\1', text)
 
 def get_current_week_range():
     # Возвращает диапазон дат для текущей недели
@@ -234,241 +902,261 @@ def get_current_week_range():
     end_of_week = start_of_week + timedelta(days=6)
     return start_of_week.date(), end_of_week.date(), today.date()
 
+def get_weeks_range(weeks: int = 1, offset: int = 0):
+    # Диапазон из weeks недель, начиная с недели через offset недель от текущей
+    start_of_week, _, _ = get_current_week_range()
+    start = start_of_week + timedelta(weeks=offset)
+    return start, start + timedelta(days=7 * weeks - 1)
+
+def _parse_day(text: str, today):
+    for fmt in ("%d.%m.%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    try:
+        return datetime.strptime(f"{text}.{today.year}", "%d.%m.%Y").date()
+    except ValueError:
+        raise ValueError(f"Не понимаю дату {text}. Формат: 01.09, 01.09.2025 или 2025-09-01")
+
+def parse_date_range(text: str | None, today=None) -> tuple:
+    """
+    Диапазон расписания из аргументов команды:
+    пусто - текущая неделя, "next" или "следующая" - следующая неделя,
+    "3" - три недели начиная с текущей, "01.09 14.09" - произвольный диапазон (одна дата - один день).
+    """
+    today = today or datetime.today().date()
+    args = (text or "").split()
+    if not args:
+        return get_weeks_range()
+    if len(args) == 1 and args[0].lower() in ("next", "следующая"):
+        return get_weeks_range(offset=1)
+    if len(args) == 1 and args[0].isdigit():
+        weeks = int(args[0])
+        if weeks < 1:
+            raise ValueError("Количество недель должно быть больше нуля")
+        if weeks > SCHEDULE_MAX_WEEKS:
+            raise ValueError(f"Можно запросить не больше {SCHEDULE_MAX_WEEKS} недель за раз")
+        return get_weeks_range(weeks)
+    if len(args) > 2:
+        raise ValueError("Укажите одну или две даты")
+    start = _parse_day(args[0], today)
+    end = _parse_day(args[-1], today)
+    if end < start and len(args[-1].split(".")) == 2:
+        # 20.12 10.01 - конец диапазона в следующем году
+        end = end.replace(year=end.year + 1)
+    if end < start:
+        raise ValueError("Дата окончания раньше даты начала")
+    return start, end
+
+# HTTP клиент
+
+def init_http_client() -> httpx.AsyncClient:
+    # Создает общий клиент с пулом соединений. Вызывается один раз при старте бота
+    global http_client
+    if http_client is not None and not http_client.is_closed:
+        return http_client
+
+    http2 = HTTP2_ENABLED
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("HTTP2_ENABLED задан, но пакет h2 не установлен (pip install httpx[http2]). Используется HTTP/1.1")
+            http2 = False
+
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT,
+        write=HTTP_READ_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+    http_client = httpx.AsyncClient(
+        headers=HEADERS,
+        limits=limits,
+        timeout=timeout,
+        http2=http2,
+        follow_redirects=True,
+    )
+    logging.info(
+        "HTTP клиент инициализирован (max_connections=%d, keepalive=%d, http2=%s)",
+        HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE, http2,
+    )
+    return http_client
+
+def get_http_client() -> httpx.AsyncClient:
+    # Возвращает общий клиент, создавая его при первом обращении
+    if http_client is None or http_client.is_closed:
+        return init_http_client()
+    return http_client
+
+async def close_http_client():
+    # Закрывает пул соединений при остановке бота
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+        logging.info("HTTP клиент закрыт")
+
+def _auth_headers(token: str) -> dict:
+    # Базовые заголовки уже заданы в клиенте, добавляем только авторизацию
+    return {"Authorization": f"Bearer {token}"}
+
+async def _api_request(endpoint: str, send) -> httpx.Response:
+    # Запрос через политику эндпоинта (таймаут, повторы, bulkhead, circuit breaker).
+    # Время всех попыток вместе пишется в метрику bot_upstream_seconds
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await api_endpoints[endpoint].request(send)
+        outcome = str(response.status_code)
+        return response
+    except UpstreamUnavailable as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - started, endpoint, outcome)
+
+async def _api_get(endpoint: str, url: str, token: str, params: dict | None = None) -> httpx.Response:
+    client = get_http_client()
+    return await _api_request(endpoint, lambda: client.get(url, headers=_auth_headers(token), params=params))
+
+def get_api_endpoint_stats() -> dict:
+    return {name: endpoint.stats() for name, endpoint in api_endpoints.items()}
+
 # ипользование API
 
 async def get_auth_token(username, password):
     # Получаем токен авторизации, используя имя пользователя и пароль. Возвращаем токен
     try:
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            login_payload = {
-                "application_key": APPLICATION_KEY,
-                "id_city": None,
-                "password": password,
-                "username": username
-            }
-            login_resp = await client.post(
-                LOGIN_URL,
-                headers=HEADERS,
-                json=login_payload
-            )
-            login_resp.raise_for_status() # Вызываем исключение при ошибках HTTP
-            
-            login_json = login_resp.json()
-            token = login_json.get("access_token") or login_json.get("token")
-            if not token:
-                raise Exception("Не удалось получить токен авторизации")
-            return token
+        client = get_http_client()
+        login_payload = {
+            "application_key": APPLICATION_KEY,
+            "id_city": None,
+            "password": password,
+            "username": username
+        }
+        login_resp = await _api_request("login", lambda: client.post(LOGIN_URL, json=login_payload))
+        login_resp.raise_for_status() # Вызываем исключение при ошибках HTTP
+
+        login_json = login_resp.json()
+        token = login_json.get("access_token") or login_json.get("token")
+        if not token:
+            raise Exception("Не удалось получить токен авторизации")
+        return token
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            raise Exception("Ошибка авторизации: Неверный логин или пароль")
+            raise AuthError("Ошибка авторизации: Неверный логин или пароль")
         else:
             raise Exception(f"Ошибка авторизации: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise Exception(f"Ошибка получения токена: {e}")
 
 async def schedule_get(start_date, end_date, token):
     # Получает расписание по токену
     try:
-        auth_headers = HEADERS.copy()
-        auth_headers["Authorization"] = f"Bearer {token}"
+        params = {
+            "date_start": start_date.strftime("%Y-%m-%d"),
+            "date_end": end_date.strftime("%Y-%m-%d")
+        }
+        schedule_resp = await _api_get("schedule", SCHEDULE_API_URL, token, params)
+        schedule_resp.raise_for_status()
 
-        async with httpx.AsyncClient(follow_redirects=True) as client:
-            params = {
-                "date_start": start_date.strftime("%Y-%m-%d"),
-                "date_end": end_date.strftime("%Y-%m-%d")
-            }
-            schedule_resp = await client.get(SCHEDULE_API_URL, headers=auth_headers, params=params)
-            schedule_resp.raise_for_status()
-            
-            return schedule_resp.json()
+        return schedule_resp.json()
 
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            raise Exception("Ошибка авторизации") # Токен недействителен
+            raise AuthError() # Токен недействителен
         else:
             raise Exception(f"Ошибка получения расписания: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        print(f"[!] Неожиданная ошибка в schedule_get: {e}")
+        logging.error("Неожиданная ошибка в schedule_get: %s", e, extra=log_fields("schedule_get", outcome="error"))
         raise
 
 async def get_leader_stream(token):
     # Получаем топ-3 студентов потока по токену
     try:
-        auth_headers = HEADERS.copy()
-        auth_headers["Authorization"] = f"Bearer {token}"
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(LEADER_STREAM_URL, headers=auth_headers)
-            response.raise_for_status()
-            return response.json()
+        response = await _api_get("leader_stream", LEADER_STREAM_URL, token)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            raise Exception("Ошибка авторизации") # Токен недействителен
+            raise AuthError() # Токен недействителен
         else:
             raise Exception(f"Ошибка HTTP при получении лидеров потока: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise Exception(f"Непредвиденная ошибка при получении лидеров потока: {e}")
 
 async def get_leader_group(token):
    # Получаем список студентов группы по токену
     try:
-        auth_headers = HEADERS.copy()
-        auth_headers["Authorization"] = f"Bearer {token}"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(LEADER_GROUP_URL, headers=auth_headers)
-            response.raise_for_status()
-            return response.json()
+        response = await _api_get("leader_group", LEADER_GROUP_URL, token)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            raise Exception("Ошибка авторизации") # Токен недействителен
+            raise AuthError() # Токен недействителен
         else:
             raise Exception(f"Ошибка HTTP при получении студентов группы: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise Exception(f"Непредвиденная ошибка при получении студентов группы: {e}")
 
 async def get_future_exams(token):
     # Получаем список будущих экзаменов по токену
     try:
-        auth_headers = HEADERS.copy()
-        auth_headers["Authorization"] = f"Bearer {token}"
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(FUTURE_EXAMS_URL, headers=auth_headers)
-            response.raise_for_status()
-            return response.json()
+        response = await _api_get("future_exams", FUTURE_EXAMS_URL, token)
+        response.raise_for_status()
+        return response.json()
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 401:
-            raise Exception("Ошибка авторизации") # Токен недействителен
+            raise AuthError() # Токен недействителен
         else:
             raise Exception(f"Ошибка HTTP при получении списка экзаменов: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         raise Exception(f"Непредвиденная ошибка при получении списка экзаменов: {e}")
 
-# Форматирование данных
+async def get_user_info(token):
+    # Получаем профиль студента (группа, поток) по токену
+    try:
+        response = await _api_get("user_info", USER_INFO_URL, token)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 401:
+            raise AuthError() # Токен недействителен
+        else:
+            raise Exception(f"Ошибка HTTP при получении профиля: {e.response.status_code} - {e.response.text}")
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        raise Exception(f"Непредвиденная ошибка при получении профиля: {e}")
+
+# Форматирование данных (рендеринг MarkdownV2 - в render.py)
 
 def save_json_to_file(json_data: dict, file_path: str):
     # Сохраняем JSON данные в файл
     try:
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(json_data, f, ensure_ascii=False, indent=4)
-        print(f"Файл {file_path} успешно создан.")
+        logging.info("Файл %s успешно создан", file_path, extra=log_fields("save_json_to_file", sample=True))
     except Exception as e:
-        print(f"Ошибка при сохранении JSON в файл: {e}")
+        logging.error("Ошибка при сохранении JSON в файл %s: %s", file_path, e, extra=log_fields("save_json_to_file", outcome="error"))
         raise
 
-def convert_schedule_to_markdown(schedule: list) -> str:
-    # Конвертируем данные расписания в Markdown
-    try:
-        today = datetime.today().date()
-        start_of_week = today - timedelta(days=today.weekday())
-        end_of_week = start_of_week + timedelta(days=6)
-
-        weekdays_ru = {
-            "Monday": "Понедельник", "Tuesday": "Вторник", "Wednesday": "Среда",
-            "Thursday": "Четверг", "Friday": "Пятница", "Saturday": "Суббота",
-            "Sunday": "Воскресенье"
-        }
-
-        if not isinstance(schedule, list):
-            raise ValueError("Данные расписания должны быть списком.")
-
-        filtered_schedule = [
-            item for item in schedule
-            if start_of_week <= datetime.strptime(item["date"], "%Y-%m-%d").date() <= end_of_week
-        ]
-
-        grouped = defaultdict(list)
-        for item in filtered_schedule:
-            grouped[item["date"]].append(item)
-
-        start_date_escaped = escape_for_markdown_v2(str(start_of_week))
-        end_date_escaped = escape_for_markdown_v2(str(end_of_week))
-        md_lines = [f"*Расписание на неделю* {start_date_escaped} — {end_date_escaped}\n"]
-
-        for i in range(7):
-            current_day = start_of_week + timedelta(days=i)
-            date_str = current_day.strftime("%Y-%m-%d")
-            weekday_eng = current_day.strftime("%A")
-            weekday_ru = weekdays_ru.get(weekday_eng, weekday_eng)
-
-            weekday_md = escape_for_markdown_v2(weekday_ru)
-            date_md = escape_for_markdown_v2(date_str)
-
-            md_lines.append(f"\n━━━━━━━━━━━━━━\n*{weekday_md}* — _{date_md}_\n━━━━━━━━━━━━━━")
-
-            if date_str in grouped:
-                for lesson in sorted(grouped[date_str], key=lambda x: x["started_at"]):
-                    subject_name = escape_for_markdown_v2(lesson['subject_name'])
-                    teacher_name = escape_for_markdown_v2(lesson['teacher_name'])
-                    room_name = escape_for_markdown_v2(lesson['room_name'])
-                    
-                    md_lines.append(f"📚 *{subject_name}*")
-                    md_lines.append(f"⏰ {lesson['started_at']} — {lesson['finished_at']}")
-                    md_lines.append(f"👨‍🏫 {teacher_name}")
-                    md_lines.append(f"📍 {room_name}\n")
-            else:
-                md_lines.append("_Выходной_ 💤\n")
-        
-        markdown_text = "\n".join(md_lines)
-        return markdown_text
-
-    except Exception as e:
-        print(f"Ошибка при создании Markdown: {e}")
-        raise
-
-def get_student_name(student_data: dict) -> str:
-    # Возвращаем имя студента
-    name = student_data.get('student_name') or student_data.get('full_name') or student_data.get('name')
-    if name:
-        return escape_for_markdown_v2(name)
-    return "Неизвестный"
-
-def convert_leader_stream_to_markdown(json_data: list) -> str:
-    # Конвертируем данные лидеров потока в Markdown
-    if not json_data:
-        return "Список лидеров потока пуст\\"
-
-    top_3 = json_data[:3]
-    md_lines = ["🏆 Топ\\-3 в потоке🏆\n"]
-    for i, student in enumerate(top_3):
-        student_name = get_student_name(student)
-        topcoins = escape_for_markdown_v2(str(student.get('amount', 'N/A')))
-        md_lines.append(f"{i+1}\\. {student_name} \\- `{topcoins}` topcoins")
-
-    return "\n".join(md_lines)
-
-def create_leader_group_markdown(json_data: list) -> str:
-    # Конвертируем данные студентов группы в Markdown
-    if not json_data:
-        return "Список студентов группы пуст\\"
-
-    md_lines = ["👥 Студенты вашей группы 👥\n"]
-    sorted_students = sorted(json_data, key=lambda x: x.get('amount', 0), reverse=True)
-
-    for i, student in enumerate(sorted_students):
-        student_name = get_student_name(student)
-        topcoins = escape_for_markdown_v2(str(student.get('amount', 'N/A')))
-        md_lines.append(f"{i+1}\\. {student_name}: `{topcoins}` topcoins")
-
-    return "\n".join(md_lines)
-
-def convert_exams_to_markdown(json_data: list) -> str:
-    # Конвертируем данные экзаменов в Markdown V2
-    if not json_data:
-        return "🎉 Пока экзаменов нет, наслаждайтесь свободным временем\\!"
-
-    md_lines = ["📝 *Будущие экзамены* 📝\n"]
-
-    for exam in json_data:
-        discipline = escape_for_markdown_v2(exam.get('spec', 'N/A'))
-        date = escape_for_markdown_v2(exam.get('date', 'N/A'))
-
-        md_lines.append(f"*{discipline}*")
-        md_lines.append(f"⏰ {date}")
-        md_lines.append("")  # пустая строка между экзаменами
-
-    return "\n".join(md_lines)
-
 if __name__ == "__main__":
     init_db()
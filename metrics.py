@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Метрики процесса в формате Prometheus (text exposition) без внешних зависимостей.
+# Запись - это инкремент в словаре по кортежу меток, поэтому их можно держать
+# включенными в продакшене. Записи идут и из пула потоков БД (DB_SECONDS, CRYPTO_SECONDS),
+# поэтому изменения и чтение серий - под блокировкой метрики.
+# Отдаются локальным HTTP сервером на METRICS_PATH
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))  # 0 - не запускать
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")
+
+# Границы корзин гистограмм в секундах: от обращения к кэшу до таймаута API
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics: list = []
+_caches: dict = {}
+_gauges: dict = {}
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, (str(v).replace('"', "'") for v in values))]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # метки -> [счетчики по корзинам (+Inf последней), сумма, количество]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bucket] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def expose(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        # Согласованный снимок: корзины, сумма и количество серии из одного момента
+        with self._lock:
+            snapshot = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for labels, counts, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+# Метрики бота
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Время обработки апдейта хендлером", ("handler",))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в хендлерах", ("handler",))
+UPSTREAM_SECONDS = Histogram("bot_upstream_seconds", "Запросы к API журнала", ("endpoint", "outcome"))
+DB_SECONDS = Histogram("bot_db_seconds", "Операции MongoDB (с ожиданием пула потоков)", ("operation",))
+CRYPTO_SECONDS = Histogram("bot_crypto_seconds", "Шифрование паролей (Fernet)", ("operation",))
+RENDER_SECONDS = Histogram("bot_render_seconds", "Рендеринг MarkdownV2 (промахи кэша рендеринга)", ("kind",))
+FILE_WRITE_SECONDS = Histogram("bot_file_write_seconds", "Запись пачки снимков JSON/Markdown на диск")
+TELEGRAM_SEND_SECONDS = Histogram("bot_telegram_send_seconds", "Вызов sendMessage", ("outcome",))
+TOKEN_REFRESHES = Counter("bot_token_refreshes_total", "Перелогины по сохраненному паролю", ("outcome",))
+TAPS = Counter("bot_taps_total", "Нажатия тяжелых кнопок: выполнены, объединены, отброшены", ("outcome",))
+
+
+def register_cache(name: str, cache):
+    # cache.stats() -> {"hits", "misses", "size", ...}: попадания выводятся счетчиками
+    _caches[name] = cache
+
+
+def register_gauge(name: str, help_text: str, func):
+    # func() -> число или {метка: число}; вычисляется при каждом запросе /metrics
+    _gauges[name] = (help_text, func)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.expose())
+
+    lines += ["# HELP bot_cache_requests_total Обращения к кэшам", "# TYPE bot_cache_requests_total counter"]
+    for name, cache in _caches.items():
+        stats = cache.stats()
+        for result in ("hits", "stale_hits", "misses"):
+            if result in stats:
+                lines.append(f'bot_cache_requests_total{{cache="{name}",result="{result}"}} {stats[result]}')
+    lines += ["# HELP bot_cache_size Записей в кэше", "# TYPE bot_cache_size gauge"]
+    for name, cache in _caches.items():
+        lines.append(f'bot_cache_size{{cache="{name}"}} {cache.stats()["size"]}')
+
+    for name, (help_text, func) in _gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        try:
+            value = func()
+        except Exception as e:
+            logging.warning("Не удалось вычислить метрику %s: %s", name, e)
+            continue
+        if isinstance(value, dict):
+            lines.extend(f'{name}{{key="{key}"}} {item}' for key, item in value.items())
+        else:
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+async def run_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST):
+    if not port:
+        return
+    # aiohttp импортируется здесь: модуль метрик используется в горячих путях и бенчмарках
+    from aiohttp import web
+
+    async def metrics_handler(request: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get(METRICS_PATH, metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Метрики доступны на http://%s:%d%s", host, port, METRICS_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,165 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from cache import SingleFlight, TTLCache
+from metrics import HANDLER_ERRORS, HANDLER_SECONDS, TAPS
+from logs import log_fields
+from ratelimit import TokenBucket
+
+# Middleware диспетчера
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    # Ограничивает число одновременно обрабатываемых апдейтов (и в polling, и в webhook режиме)
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.active = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        async with self._semaphore:
+            self.active += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self.active -= 1
+
+
+class MetricsMiddleware(BaseMiddleware):
+    # Время работы каждого хендлера и число исключений (метрики bot_handler_*),
+    # плюс структурная запись лога: успешные - сэмплированно, ошибки - всегда.
+    # Регистрируется как inner middleware наблюдателя, когда хендлер уже выбран
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = getattr(getattr(handler_object, "callback", None), "__name__", "unknown")
+        user_id = getattr(getattr(event, "from_user", None), "id", None)
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+        except Exception as e:
+            elapsed = time.perf_counter() - started
+            HANDLER_SECONDS.observe(elapsed, name)
+            HANDLER_ERRORS.inc(name)
+            # Трейсбек пишет сам aiogram, здесь - поля для поиска по пользователю и хендлеру
+            logging.error(
+                "Хендлер %s завершился ошибкой: %r", name, e,
+                extra=log_fields(name, user_id=user_id, latency=elapsed, outcome="error"),
+            )
+            raise
+        elapsed = time.perf_counter() - started
+        HANDLER_SECONDS.observe(elapsed, name)
+        logging.info(
+            "Хендлер %s выполнен", name, extra=log_fields(name, user_id=user_id, latency=elapsed, outcome="ok", sample=True)
+        )
+        return result
+
+
+class ActivityMiddleware(BaseMiddleware):
+    # Отмечает, что пользователь пользуется ботом: touch(user_id) в фоне,
+    # не чаще раза за interval секунд на пользователя (запись в БД не на каждый апдейт).
+    # Регистрируется как outer middleware апдейтов
+
+    def __init__(self, touch, interval: float, max_users: int = 50_000):
+        self.touch = touch
+        self._touched = TTLCache(maxsize=max_users, ttl=interval)
+        self._background: set = set()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and self._touched.get(user.id) is None:
+            self._touched.set(user.id, True)
+            task = asyncio.ensure_future(self.touch(user.id))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
+        return await handler(event, data)
+
+
+class TapGuardMiddleware(BaseMiddleware):
+    # Повторные нажатия тяжелых кнопок (actions - тексты кнопок) одним пользователем:
+    # - пока запрос выполняется, повтор не запускает хендлер, а ждет тот же результат;
+    # - в течение debounce секунд после ответа повтор игнорируется;
+    # - не больше rate запросов в секунду на пользователя (запас burst),
+    #   при превышении on_throttled(event, wait) вызывается не чаще раза за период ожидания.
+    # Регистрируется как outer middleware сообщений: до фильтров, чтения БД и запросов к API
+
+    def __init__(self, actions, rate: float, burst: float, debounce: float, on_throttled=None, max_users: int = 10_000):
+        self.actions = frozenset(actions)
+        self.rate = rate
+        self.burst = burst
+        self.on_throttled = on_throttled
+        self.max_users = max_users
+        self._flight = SingleFlight()
+        self._recent = TTLCache(maxsize=max_users, ttl=debounce)
+        self._warned = TTLCache(maxsize=max_users, ttl=60)
+        self._buckets: dict[int, TokenBucket] = {}
+
+    def _bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_users:
+                # Полный bucket ничем не отличается от нового, его можно удалить
+                for idle in [u for u, b in self._buckets.items() if b.is_full()]:
+                    del self._buckets[idle]
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: dict[str, Any],
+    ) -> Any:
+        text = getattr(event, "text", None)
+        user = data.get("event_from_user")
+        if user is None or text not in self.actions:
+            return await handler(event, data)
+
+        key = (user.id, text)
+
+        async def run():
+            try:
+                return await handler(event, data)
+            finally:
+                self._recent.set(key, True)
+
+        if self._flight.in_flight(key):
+            # run не вызывается: ждем запрос, который уже выполняется
+            TAPS.inc("joined")
+            return await self._flight.do(key, run)
+        if self._recent.get(key):
+            TAPS.inc("debounced")
+            return None
+
+        wait = self._bucket(user.id).try_acquire()
+        if wait > 0:
+            TAPS.inc("throttled")
+            if self.on_throttled and self._warned.get(user.id) is None:
+                self._warned.set(user.id, True, ttl=wait)
+                await self.on_throttled(event, wait)
+            return None
+
+        TAPS.inc("handled")
+        return await self._flight.do(key, run)
+
@@ -0,0 +1,238 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from collections import deque
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+from ratelimit import TokenBucket
+from render import split_message
+from metrics import TELEGRAM_SEND_SECONDS
+
+# Очередь исходящих сообщений Telegram.
+# Ограничения: общий token bucket на бота и отдельный на каждый чат.
+# Ответы на нажатия (PRIORITY_INTERACTIVE) идут раньше массовых рассылок (PRIORITY_BULK).
+# Сообщения одного чата отправляются строго по порядку. При RetryAfter чат ставится
+# на паузу на указанное Telegram время, сообщение отправляется повторно.
+# Редактирование сообщений (edit_message_text) идет через ту же очередь и те же лимиты
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_GLOBAL_BURST = float(os.getenv("OUTBOX_GLOBAL_BURST", "30"))
+# Сколько процессов отправляют от имени бота (sharding): общий лимит делится между ними поровну
+OUTBOX_PROCESSES = max(int(os.getenv("OUTBOX_PROCESSES", "1")), 1)
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_MAX_IN_FLIGHT = int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "30"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+# Сколько неактивных чатов хранить вместе с их bucket
+OUTBOX_MAX_IDLE_CHATS = int(os.getenv("OUTBOX_MAX_IDLE_CHATS", "10000"))
+
+
+class _Outgoing:
+    __slots__ = ("chat_id", "text", "kwargs", "priority", "future", "enqueued_at", "retries", "message_id")
+
+    def __init__(
+        self, chat_id: int, text: str, kwargs: dict, priority: int, future: asyncio.Future, message_id: int | None = None
+    ):
+        # message_id - редактирование этого сообщения вместо отправки нового
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.retries = 0
+
+
+class Outbox:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._global = TokenBucket(
+            OUTBOX_GLOBAL_RATE / OUTBOX_PROCESSES, max(OUTBOX_GLOBAL_BURST / OUTBOX_PROCESSES, 1.0)
+        )
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._chat_queues: dict[int, deque] = {}
+        self._busy: set[int] = set()
+        self._paused_until: dict[int, float] = {}
+        # Готовые к отправке чаты: (priority, seq, chat_id)
+        self._ready: list = []
+        # Чаты, ожидающие bucket или паузы после RetryAfter: (ready_at, seq, chat_id)
+        self._delayed: list = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._in_flight = asyncio.Semaphore(OUTBOX_MAX_IN_FLIGHT)
+        self._tasks: set = set()
+        # Метрики
+        self.depth = 0
+        self.sent = 0
+        self.failed = 0
+        self.retry_after = 0
+        self._latencies: deque = deque(maxlen=2000)
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        # Ставит сообщение в очередь и ждет отправки. Возвращает types.Message (последней части).
+        # Текст длиннее лимита Telegram уходит несколькими сообщениями подряд,
+        # клавиатура (reply_markup) прикрепляется к последнему
+        parts = split_message(text) or [text]
+        items = []
+        for index, part in enumerate(parts):
+            part_kwargs = kwargs if index == len(parts) - 1 else {k: v for k, v in kwargs.items() if k != "reply_markup"}
+            items.append(_Outgoing(chat_id, part, part_kwargs, priority, asyncio.get_running_loop().create_future()))
+        return (await self._enqueue(chat_id, items))[-1]
+
+    async def edit_message_text(
+        self, chat_id: int, message_id: int, text: str, priority: int = PRIORITY_INTERACTIVE, **kwargs
+    ):
+        # Ставит редактирование сообщения в очередь чата и ждет его. Текст должен помещаться
+        # в одно сообщение. Ошибки Telegram (в том числе "message is not modified") пробрасываются
+        future = asyncio.get_running_loop().create_future()
+        item = _Outgoing(chat_id, text, kwargs, priority, future, message_id=message_id)
+        return (await self._enqueue(chat_id, [item]))[0]
+
+    async def _enqueue(self, chat_id: int, items: list) -> list:
+        queue = self._chat_queues.setdefault(chat_id, deque())
+        was_idle = not queue
+        queue.extend(items)
+        self.depth += len(items)
+        if was_idle and chat_id not in self._busy and chat_id not in self._paused_until:
+            self._mark_ready(chat_id)
+        return await asyncio.gather(*(item.future for item in items))
+
+    def _mark_ready(self, chat_id: int):
+        head = self._chat_queues[chat_id][0]
+        heapq.heappush(self._ready, (head.priority, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _delay(self, chat_id: int, ready_at: float):
+        heapq.heappush(self._delayed, (ready_at, next(self._seq), chat_id))
+        self._wakeup.set()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= OUTBOX_MAX_IDLE_CHATS:
+                self._evict_idle_chats()
+            bucket = self._chat_buckets[chat_id] = TokenBucket(OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST)
+        return bucket
+
+    def _evict_idle_chats(self):
+        # Полный bucket ничем не отличается от нового, его можно удалить
+        for chat_id in [c for c, b in self._chat_buckets.items() if c not in self._chat_queues and b.is_full()]:
+            del self._chat_buckets[chat_id]
+
+    def _release_delayed(self, now: float):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._delayed)
+            if self._paused_until.get(chat_id, 0) > now:
+                continue
+            self._paused_until.pop(chat_id, None)
+            if chat_id in self._chat_queues and chat_id not in self._busy:
+                self._mark_ready(chat_id)
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            self._release_delayed(now)
+            if not self._ready:
+                timeout = self._delayed[0][0] - now if self._delayed else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, chat_id = heapq.heappop(self._ready)
+            if chat_id in self._busy or chat_id not in self._chat_queues:
+                continue
+
+            wait = self._chat_bucket(chat_id).try_acquire()
+            if wait > 0:
+                # Чат упирается в свой лимит - не задерживаем остальные чаты
+                self._delay(chat_id, now + wait)
+                continue
+
+            wait = self._global.try_acquire()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._global.try_acquire()
+
+            await self._in_flight.acquire()
+            item = self._chat_queues[chat_id].popleft()
+            self._busy.add(chat_id)
+            task = asyncio.create_task(self._send(item))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, item: _Outgoing):
+        chat_id = item.chat_id
+        requeued = False
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            if item.message_id is None:
+                message = await self.bot.send_message(chat_id, item.text, **item.kwargs)
+            else:
+                message = await self.bot.edit_message_text(
+                    item.text, chat_id=chat_id, message_id=item.message_id, **item.kwargs
+                )
+            outcome = "ok"
+            self.sent += 1
+            self._latencies.append(time.monotonic() - item.enqueued_at)
+            if not item.future.done():
+                item.future.set_result(message)
+        except TelegramRetryAfter as e:
+            outcome = "retry_after"
+            self.retry_after += 1
+            self._global.drain()
+            if item.retries < OUTBOX_MAX_RETRIES:
+                item.retries += 1
+                requeued = True
+                self._chat_queues[chat_id].appendleft(item)
+                self._paused_until[chat_id] = time.monotonic() + e.retry_after
+                self._delay(chat_id, self._paused_until[chat_id])
+                logging.warning("Telegram RetryAfter %s с для чата %d", e.retry_after, chat_id)
+            else:
+                self._fail(item, e)
+        except Exception as e:
+            self._fail(item, e)
+        finally:
+            TELEGRAM_SEND_SECONDS.observe(time.perf_counter() - started, outcome)
+            self._in_flight.release()
+            self._busy.discard(chat_id)
+            if not requeued:
+                self.depth -= 1
+            queue = self._chat_queues.get(chat_id)
+            if not queue:
+                self._chat_queues.pop(chat_id, None)
+            elif not requeued:
+                self._mark_ready(chat_id)
+
+    def _fail(self, item: _Outgoing, error: Exception):
+        self.failed += 1
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(p: float) -> float:
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] if latencies else 0.0
+
+        return {
+            "queue_depth": self.depth,
+            "in_flight": len(self._busy),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retry_after,
+            "latency_p50": percentile(0.5),
+            "latency_p99": percentile(0.99),
+        }
@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+
+import main
+from main import PASSWORD_KEY_ID, encrypt_password, rotate_password
+from database.db import (
+    get_passwords_to_reencrypt_page,
+    save_reencrypted_passwords,
+    get_job_state,
+    save_job_state,
+)
+
+# Фоновое перешифрование паролей основным ключом PASSWORD_ENC_KEY:
+# открытые пароли старой схемы и пароли, зашифрованные ключом до ротации.
+# Пачка аккаунтов шифруется в потоке и сохраняется одним bulk_write, после каждой
+# пачки сохраняется последний user_id. Задача привязана к отпечатку основного ключа:
+# после следующей ротации она запускается заново
+
+PASSWORD_REENCRYPT_PAUSE = float(os.getenv("PASSWORD_REENCRYPT_PAUSE", "0.5"))
+
+
+def _reencrypt_batch(page: list) -> tuple[list, int]:
+    # Шифрование в потоке: Fernet не должен занимать event loop на целую пачку
+    updates, failed = [], 0
+    for user_id, username, password, password_enc in page:
+        try:
+            new_password_enc = rotate_password(password_enc) if password_enc else encrypt_password(password)
+        except RuntimeError as e:
+            failed += 1
+            logging.error("Аккаунт %s пользователя %d не перешифрован: %s", username, user_id, e)
+            continue
+        updates.append((user_id, username, password, password_enc, new_password_enc))
+    return updates, failed
+
+
+async def run_password_reencryption():
+    if not main._get_fernet():
+        return
+    job_id = f"reencrypt_passwords:{PASSWORD_KEY_ID}"
+    state = await get_job_state(job_id) or {}
+    if state.get("done"):
+        return
+
+    after_user_id = state.get("last_user_id")
+    counters = {key: state.get(key, 0) for key in ("reencrypted", "failed")}
+    logging.info("Перешифрование паролей %s: старт (продолжение после user_id=%s)", job_id, after_user_id)
+
+    while True:
+        page = await get_passwords_to_reencrypt_page(after_user_id)
+        if not page:
+            break
+        updates, failed = await asyncio.to_thread(_reencrypt_batch, page)
+        counters["reencrypted"] += await save_reencrypted_passwords(updates)
+        counters["failed"] += failed
+
+        after_user_id = page[-1][0]
+        await save_job_state(job_id, last_user_id=after_user_id, **counters)
+        await asyncio.sleep(PASSWORD_REENCRYPT_PAUSE)
+
+    await save_job_state(job_id, done=True, **counters)
+    logging.info("Перешифрование паролей %s завершено: %s", job_id, counters)
+
+
+async def password_reencryption_job():
+    while True:
+        try:
+            await run_password_reencryption()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Ошибка перешифрования паролей, повтор через 5 минут: %s", e)
+            await asyncio.sleep(300)
@@ -0,0 +1,35 @@
+import time
+
+# Ограничение частоты (token bucket)
+
+
+class TokenBucket:
+    # rate - токенов в секунду, capacity - максимальный "запас" для всплесков
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float = 1.0) -> float:
+        # Забирает токены и возвращает 0, либо возвращает, сколько секунд ждать
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def drain(self):
+        # Обнуляет запас (например, после ответа 429 от Telegram)
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0.0)
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
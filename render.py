@@ -0,0 +1,274 @@
+import hashlib
+import json
+import logging
+import os
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import NamedTuple
+
+from cache import TTLCache
+from metrics import RENDER_SECONDS, register_cache
+
+# Рендеринг ответов API в MarkdownV2.
+# Экранирование - одна таблица str.translate, уроки разбираются один раз в Lesson,
+# рамка недели (заголовки дней) строится один раз на неделю. Готовый текст
+# кэшируется по хэшу входных данных: одинаковый ответ API не рендерится повторно
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "5000"))
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", "3600"))
+
+_MARKDOWN_V2_ESCAPE = str.maketrans({char: "\\" + char for char in r"_*[]()~`>#+-=|{}.!"})
+
+WEEKDAYS_RU = ("Понедельник", "Вторник", "Среда", "Четверг", "Пятница", "Суббота", "Воскресенье")
+DAY_SEPARATOR = "━━━━━━━━━━━━━━"
+
+_render_cache = TTLCache(maxsize=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL)
+register_cache("render", _render_cache)
+
+
+def escape_for_markdown_v2(text: str) -> str:
+    # Экранирует специальные символы Markdown V2
+    return text.translate(_MARKDOWN_V2_ESCAPE)
+
+
+def payload_digest(payload) -> str:
+    # Хэш содержимого ответа API (порядок ключей не важен)
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _memoized(kind: str, payload, render, *args) -> str:
+    key = (kind, payload_digest(payload), *args)
+    text = _render_cache.get(key)
+    if text is None:
+        with RENDER_SECONDS.time(kind):
+            text = render(payload, *args)
+        _render_cache.set(key, text)
+    return text
+
+
+def get_render_cache_stats() -> dict:
+    return _render_cache.stats()
+
+
+# Расписание
+
+class Lesson(NamedTuple):
+    day: date
+    started_at: str
+    finished_at: str
+    subject: str
+    teacher: str
+    room: str
+
+
+def parse_lessons(schedule: list) -> list[Lesson]:
+    # Разбирает ответ API один раз: дата в date, текстовые поля уже экранированы
+    if not isinstance(schedule, list):
+        raise ValueError("Данные расписания должны быть списком.")
+    return [
+        Lesson(
+            date.fromisoformat(item["date"]),
+            item["started_at"],
+            item["finished_at"],
+            escape_for_markdown_v2(item["subject_name"]),
+            escape_for_markdown_v2(item["teacher_name"]),
+            escape_for_markdown_v2(item["room_name"]),
+        )
+        for item in schedule
+    ]
+
+
+@lru_cache(maxsize=64)
+def _week_frame(week_start: date) -> tuple[str, tuple]:
+    # Заголовок недели и заголовки семи дней: ((date, header), ...)
+    week_end = week_start + timedelta(days=6)
+    title = (
+        f"*Расписание на неделю* {escape_for_markdown_v2(str(week_start))} — "
+        f"{escape_for_markdown_v2(str(week_end))}\n"
+    )
+    days = []
+    for offset in range(7):
+        day = week_start + timedelta(days=offset)
+        days.append((
+            day,
+            f"\n{DAY_SEPARATOR}\n*{WEEKDAYS_RU[offset]}* — _{escape_for_markdown_v2(day.isoformat())}_\n{DAY_SEPARATOR}",
+        ))
+    return title, tuple(days)
+
+
+def _lessons_by_day(lessons: list[Lesson], first_day: date, last_day: date) -> dict[date, list[Lesson]]:
+    by_day: dict[date, list[Lesson]] = {}
+    for lesson in lessons:
+        if first_day <= lesson.day <= last_day:
+            by_day.setdefault(lesson.day, []).append(lesson)
+    return by_day
+
+
+def _render_day(md_lines: list, header: str, day_lessons: list[Lesson] | None):
+    md_lines.append(header)
+    if not day_lessons:
+        md_lines.append("_Выходной_ 💤\n")
+        return
+    day_lessons.sort(key=lambda lesson: lesson.started_at)
+    for lesson in day_lessons:
+        md_lines.append(
+            f"📚 *{lesson.subject}*\n"
+            f"⏰ {lesson.started_at} — {lesson.finished_at}\n"
+            f"👨‍🏫 {lesson.teacher}\n"
+            f"📍 {lesson.room}\n"
+        )
+
+
+def render_schedule(lessons: list[Lesson], week_start: date) -> str:
+    title, days = _week_frame(week_start)
+    by_day = _lessons_by_day(lessons, week_start, week_start + timedelta(days=6))
+    md_lines = [title]
+    for day, header in days:
+        _render_day(md_lines, header, by_day.get(day))
+    return "\n".join(md_lines)
+
+
+def week_start_of(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def schedule_pages(start: date, end: date) -> list[tuple[date, date]]:
+    # Страницы диапазона: по одной на неделю, крайние обрезаны по start и end
+    pages = []
+    page_start = start
+    while page_start <= end:
+        page_end = min(week_start_of(page_start) + timedelta(days=6), end)
+        pages.append((page_start, page_end))
+        page_start = page_end + timedelta(days=1)
+    return pages
+
+
+def render_schedule_days(lessons: list[Lesson], first_day: date, last_day: date) -> str:
+    # Дни first_day..last_day в пределах одной недели (страница диапазона).
+    # Полная неделя рендерится так же, как render_schedule
+    week_start = week_start_of(first_day)
+    if first_day == week_start and last_day == week_start + timedelta(days=6):
+        return render_schedule(lessons, week_start)
+    _, days = _week_frame(week_start)
+    by_day = _lessons_by_day(lessons, first_day, last_day)
+    md_lines = [
+        f"*Расписание* {escape_for_markdown_v2(str(first_day))} — {escape_for_markdown_v2(str(last_day))}\n"
+    ]
+    for day, header in days[first_day.weekday():last_day.weekday() + 1]:
+        _render_day(md_lines, header, by_day.get(day))
+    return "\n".join(md_lines)
+
+
+def _current_week_start() -> date:
+    return week_start_of(datetime.today().date())
+
+
+def convert_schedule_page_to_markdown(schedule: list, first_day: date, last_day: date) -> str:
+    # Одна страница диапазона (см. schedule_pages): разбираются и рендерятся только ее дни
+    first, last = first_day.isoformat(), last_day.isoformat()
+    page_items = [item for item in schedule if first <= item.get("date", "") <= last]
+    try:
+        return _memoized(
+            "schedule_page", page_items,
+            lambda data, a, b: render_schedule_days(parse_lessons(data), a, b), first_day, last_day,
+        )
+    except Exception as e:
+        logging.error("Ошибка при создании Markdown: %s", e)
+        raise
+
+
+def convert_schedule_to_markdown(schedule: list, week_start=None) -> str:
+    # Конвертируем данные расписания в Markdown (неделя с week_start, по умолчанию текущая)
+    if week_start is None:
+        week_start = _current_week_start()
+    try:
+        return _memoized("schedule", schedule, lambda data, start: render_schedule(parse_lessons(data), start), week_start)
+    except Exception as e:
+        logging.error("Ошибка при создании Markdown: %s", e)
+        raise
+
+
+# Студенты и экзамены
+
+def get_student_name(student_data: dict) -> str:
+    # Возвращаем имя студента
+    name = student_data.get('student_name') or student_data.get('full_name') or student_data.get('name')
+    if name:
+        return escape_for_markdown_v2(name)
+    return "Неизвестный"
+
+
+def render_leader_stream(json_data: list) -> str:
+    if not json_data:
+        return "Список лидеров потока пуст\\"
+
+    md_lines = ["🏆 Топ\\-3 в потоке🏆\n"]
+    for i, student in enumerate(json_data[:3]):
+        topcoins = escape_for_markdown_v2(str(student.get('amount', 'N/A')))
+        md_lines.append(f"{i+1}\\. {get_student_name(student)} \\- `{topcoins}` topcoins")
+    return "\n".join(md_lines)
+
+
+def render_leader_group(json_data: list) -> str:
+    if not json_data:
+        return "Список студентов группы пуст\\"
+
+    md_lines = ["👥 Студенты вашей группы 👥\n"]
+    sorted_students = sorted(json_data, key=lambda x: x.get('amount', 0), reverse=True)
+    for i, student in enumerate(sorted_students):
+        topcoins = escape_for_markdown_v2(str(student.get('amount', 'N/A')))
+        md_lines.append(f"{i+1}\\. {get_student_name(student)}: `{topcoins}` topcoins")
+    return "\n".join(md_lines)
+
+
+def render_exams(json_data: list) -> str:
+    if not json_data:
+        return "🎉 Пока экзаменов нет, наслаждайтесь свободным временем\\!"
+
+    md_lines = ["📝 *Будущие экзамены* 📝\n"]
+    for exam in json_data:
+        md_lines.append(f"*{escape_for_markdown_v2(exam.get('spec', 'N/A'))}*")
+        md_lines.append(f"⏰ {escape_for_markdown_v2(exam.get('date', 'N/A'))}")
+        md_lines.append("")  # пустая строка между экзаменами
+    return "\n".join(md_lines)
+
+
+def convert_leader_stream_to_markdown(json_data: list) -> str:
+    # Конвертируем данные лидеров потока в Markdown
+    return _memoized("leader_stream", json_data, render_leader_stream)
+
+
+def create_leader_group_markdown(json_data: list) -> str:
+    # Конвертируем данные студентов группы в Markdown
+    return _memoized("leader_group", json_data, render_leader_group)
+
+
+def convert_exams_to_markdown(json_data: list) -> str:
+    # Конвертируем данные экзаменов в Markdown V2
+    return _memoized("exams", json_data, render_exams)
+
+
+# Длинные сообщения
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list[str]:
+    # Делит текст на части не длиннее limit: по пустой строке (граница дня), если она
+    # во второй половине части, иначе по переводу строки, и только строку длиннее limit - по символам.
+    # Разметка MarkdownV2 в ответах бота не переходит через перевод строки, поэтому части остаются валидными
+    parts = []
+    while len(text) > limit:
+        window = text[:limit + 1]
+        cut = window.rfind("\n\n")
+        if cut < limit // 2:
+            cut = window.rfind("\n")
+        if cut > 0:
+            parts.append(text[:cut])
+            text = text[cut:].lstrip("\n")
+            continue
+        # Не отрываем "\" от экранируемого символа
+        cut = limit - 1 if text[limit - 1] == "\\" else limit
+        parts.append(text[:cut])
+        text = text[cut:]
+    parts.append(text)
+    return [part for part in parts if part.strip()]
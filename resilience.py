@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+
+# Устойчивость запросов к API журнала: таймаут на эндпоинт, повторы с джиттером
+# (только для идемпотентных GET), ограничение параллельных запросов (bulkhead)
+# и circuit breaker, который при недоступном API сразу отказывает, а не копит ожидания
+
+# Ответы, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, message: str = "Сервис журнала временно недоступен, попробуйте позже"):
+        super().__init__(message)
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class BulkheadFullError(UpstreamUnavailable):
+    pass
+
+
+class CircuitBreaker:
+    # closed - запросы идут как обычно; после failure_threshold ошибок подряд - open:
+    # все запросы отклоняются reset_timeout секунд; затем half_open - пропускается
+    # один пробный запрос, его успех закрывает цепь, ошибка снова открывает
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_started: float | None = None
+
+    def before_call(self):
+        if self.state == self.CLOSED:
+            return
+        now = time.monotonic()
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probe_started = None
+        # Пробный запрос, который так и не отчитался (например, отменен), не блокирует цепь навсегда
+        if self.state == self.HALF_OPEN and (
+            self._probe_started is None or now - self._probe_started >= self.reset_timeout
+        ):
+            self._probe_started = now
+            return
+        self.rejected += 1
+        raise CircuitOpenError()
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logging.info("API %s снова доступен, circuit breaker закрыт", self.name)
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_started = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logging.warning("API %s недоступен (%d ошибок подряд), circuit breaker открыт", self.name, self.failures)
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probe_started = None
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
+
+
+class Endpoint:
+    # Политика одного эндпоинта. timeout - предел на одну попытку целиком,
+    # retries - сколько раз повторять (0 для неидемпотентных запросов),
+    # max_concurrency / queue_timeout - bulkhead: не больше max_concurrency запросов
+    # одновременно, ожидание свободного места не дольше queue_timeout
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float,
+        retries: int = 0,
+        max_concurrency: int = 20,
+        queue_timeout: float = 5.0,
+        backoff_base: float = 0.2,
+        backoff_max: float = 2.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.retried = 0
+
+    def _backoff(self, attempt: int) -> float:
+        # Экспоненциальная задержка с полным джиттером: повторы разных запросов не совпадают
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _attempt(self, send) -> httpx.Response:
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise BulkheadFullError() from None
+        self.in_flight += 1
+        try:
+            async with asyncio.timeout(self.timeout):
+                return await send()
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    async def request(self, send) -> httpx.Response:
+        # send() -> httpx.Response. Ответы 4xx возвращаются как есть (их разбирает вызывающий),
+        # сетевые ошибки, таймауты и 5xx после всех попыток превращаются в UpstreamUnavailable
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            try:
+                response = await self._attempt(send)
+            except (httpx.TransportError, TimeoutError) as e:
+                self.breaker.record_failure()
+                if attempt >= self.retries:
+                    logging.warning("Запрос к API %s не удался: %r", self.name, e)
+                    raise UpstreamUnavailable() from e
+            else:
+                if response.status_code >= 500:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                if attempt >= self.retries:
+                    if response.status_code >= 500:
+                        logging.warning("API %s ответил %d", self.name, response.status_code)
+                        raise UpstreamUnavailable()
+                    return response
+            attempt += 1
+            self.retried += 1
+            await asyncio.sleep(self._backoff(attempt))
+
+    def stats(self) -> dict:
+        return {**self.breaker.stats(), "in_flight": self.in_flight, "retried": self.retried}
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import os
+from datetime import date, timedelta
+
+from cache import SingleFlight, SWRCache, TTLCache
+from auth import call_with_auth
+from main import (
+    schedule_get,
+    get_leader_group,
+    get_user_info,
+    convert_schedule_to_markdown,
+    create_leader_group_markdown,
+    SCHEDULE_MAX_WEEKS,
+)
+from render import week_start_of
+from database.db import get_account_group, set_account_group
+from resilience import UpstreamUnavailable
+from metrics import register_cache
+
+# Кэш данных, общих для всей группы: расписание и список студентов.
+# Студенты одной группы получают один и тот же ответ API, поэтому ключ кэша -
+# группа (а не пользователь), а одновременные промахи объединяются в один запрос.
+# Рядом с JSON студентов хранится готовый MarkdownV2 текст, неделя расписания
+# рендерится при первом показе.
+# Расписание хранится сегментами по неделям: запрос за диапазон берет готовые недели
+# из кэша и загружает только недостающие, соседние недостающие - одним запросом к API.
+# Пока API журнала недоступно (circuit breaker открыт, таймауты), отдается
+# последнее сохраненное значение независимо от его возраста
+
+SCHEDULE_CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "300"))
+SCHEDULE_CACHE_STALE = float(os.getenv("SCHEDULE_CACHE_STALE", "1800"))
+SCHEDULE_CACHE_SIZE = int(os.getenv("SCHEDULE_CACHE_SIZE", "2000"))
+GROUP_CACHE_TTL = float(os.getenv("GROUP_CACHE_TTL", "86400"))
+# Сколько помнить, что группу аккаунта узнать не удалось (user-info не запрашивается повторно)
+GROUP_FALLBACK_TTL = float(os.getenv("GROUP_FALLBACK_TTL", "300"))
+
+group_data_cache = SWRCache(maxsize=SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL, stale_ttl=SCHEDULE_CACHE_STALE)
+# (user_id, username) -> группа
+_account_groups = TTLCache(maxsize=50_000, ttl=GROUP_CACHE_TTL)
+# Готовый MarkdownV2 недели: id(сегмента) -> (сегмент, текст). Рендерится при первом показе
+# недели, а не при загрузке; новый сегмент после обновления кэша - другой объект
+_week_markdown = TTLCache(maxsize=SCHEDULE_CACHE_SIZE, ttl=SCHEDULE_CACHE_TTL + SCHEDULE_CACHE_STALE)
+# Загрузка нескольких соседних недель одним запросом: (группа, первая неделя, последняя неделя)
+_weeks_flight = SingleFlight()
+register_cache("group_data", group_data_cache)
+register_cache("account_group", _account_groups)
+register_cache("week_markdown", _week_markdown)
+
+
+async def resolve_group(user_id: int, credentials: tuple) -> str:
+    # Группа активного аккаунта: память -> БД -> API user-info.
+    # Если группу узнать не удалось, кэшируем по пользователю; этот результат
+    # запоминается на GROUP_FALLBACK_TTL, чтобы не запрашивать user-info на каждый вызов
+    username = credentials[0]
+    group = _account_groups.get((user_id, username))
+    if group:
+        return group
+
+    group = await get_account_group(user_id, username)
+    if not group:
+        try:
+            info = await call_with_auth(user_id, credentials, get_user_info)
+            group_id = info.get("current_group_id") or info.get("group_name")
+            group = str(group_id) if group_id else None
+        except Exception as e:
+            logging.warning("Не удалось определить группу аккаунта %s (пользователь %d): %s", username, user_id, e)
+        if group:
+            await set_account_group(user_id, username, group)
+
+    if not group:
+        group = f"user:{user_id}"
+        _account_groups.set((user_id, username), group, ttl=GROUP_FALLBACK_TTL)
+        return group
+    _account_groups.set((user_id, username), group)
+    return group
+
+
+async def _load_or_fallback(key, load, ttl: float | None = None, max_age: float | None = None):
+    try:
+        return await group_data_cache.get_or_load(key, load, ttl, max_age)
+    except UpstreamUnavailable:
+        cached = group_data_cache.peek(key)
+        if cached is None:
+            raise
+        logging.info("API журнала недоступно, отдаем кэш %s", key)
+        return cached
+
+
+def _lesson_day(item: dict) -> date:
+    return date.fromisoformat(item["date"])
+
+
+def _missing_runs(weeks: list) -> list[list]:
+    # Соседние недели объединяются: [[w1, w2], [w5]]
+    runs = []
+    for week in weeks:
+        if runs and runs[-1][-1] + timedelta(days=7) == week:
+            runs[-1].append(week)
+        else:
+            runs.append([week])
+    return runs
+
+
+async def _load_weeks(user_id: int, credentials: tuple, group: str, weeks: list, ttl: float | None) -> dict:
+    # Один запрос к API за недели weeks[0]..weeks[-1], ответ раскладывается по сегментам
+    async def load():
+        data = await call_with_auth(
+            user_id, credentials, lambda token: schedule_get(weeks[0], weeks[-1] + timedelta(days=6), token)
+        )
+        segments = {week: [] for week in weeks}
+        for item in data:
+            try:
+                week = week_start_of(_lesson_day(item))
+            except (KeyError, TypeError, ValueError):
+                continue
+            if week in segments:
+                segments[week].append(item)
+        for week, items in segments.items():
+            group_data_cache.set(("schedule", group, week), items, ttl)
+        return segments
+
+    try:
+        return await _weeks_flight.do((group, weeks[0], weeks[-1]), load)
+    except UpstreamUnavailable:
+        segments = {week: group_data_cache.peek(("schedule", group, week)) for week in weeks}
+        if any(items is None for items in segments.values()):
+            raise
+        logging.info("API журнала недоступно, отдаем кэш расписания группы %s", group)
+        return segments
+
+
+async def get_schedule_range(
+    user_id: int, credentials: tuple, start_date, end_date, ttl: float | None = None, max_age: float | None = None
+) -> list:
+    # JSON расписания группы за start_date..end_date (не длиннее SCHEDULE_MAX_WEEKS недель).
+    # Запрос ровно за одну неделю возвращает сам сегмент кэша, без копирования
+    first_week, last_week = week_start_of(start_date), week_start_of(end_date)
+    weeks = [first_week + timedelta(days=7 * n) for n in range((last_week - first_week).days // 7 + 1)]
+    if len(weeks) > SCHEDULE_MAX_WEEKS:
+        raise ValueError(f"Можно запросить не больше {SCHEDULE_MAX_WEEKS} недель за раз")
+    group = await resolve_group(user_id, credentials)
+
+    segments, missing = {}, []
+    for week in weeks:
+        async def reload(week=week):
+            return (await _load_weeks(user_id, credentials, group, [week], None))[week]
+
+        found, items = group_data_cache.get_cached(("schedule", group, week), reload, max_age)
+        if found:
+            segments[week] = items
+        else:
+            missing.append(week)
+    if missing:
+        loaded = await asyncio.gather(
+            *(_load_weeks(user_id, credentials, group, run, ttl) for run in _missing_runs(missing))
+        )
+        for run_segments in loaded:
+            segments.update(run_segments)
+
+    if len(weeks) == 1 and start_date == first_week and end_date == first_week + timedelta(days=6):
+        return segments[first_week]
+    first, last = start_date.isoformat(), end_date.isoformat()
+    return [item for week in weeks for item in segments[week] if first <= item.get("date", "") <= last]
+
+
+async def get_group_schedule(
+    user_id: int, credentials: tuple, start_date, end_date, ttl: float | None = None, max_age: float | None = None
+) -> tuple:
+    # Возвращает (json, markdown) расписания группы за неделю start_date..end_date
+    data = await get_schedule_range(user_id, credentials, start_date, end_date, ttl, max_age)
+    cached = _week_markdown.get(id(data))
+    if cached and cached[0] is data:
+        return cached
+    result = (data, convert_schedule_to_markdown(data, week_start=start_date))
+    _week_markdown.set(id(data), result)
+    return result
+
+
+async def get_group_leaders(user_id: int, credentials: tuple) -> tuple:
+    # Возвращает (json, markdown) списка студентов группы
+    group = await resolve_group(user_id, credentials)
+
+    async def load():
+        data = await call_with_auth(user_id, credentials, get_leader_group)
+        return data, create_leader_group_markdown(data)
+
+    return await _load_or_fallback(("leader_group", group), load)
+
+
+def get_group_cache_stats() -> dict:
+    return group_data_cache.stats()
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+
+from aiogram.enums import ParseMode
+
+from main import escape_for_markdown_v2, get_current_week_range
+from outbox import Outbox, PRIORITY_BULK
+from schedule_cache import get_group_schedule
+from database.db import (
+    get_active_account_full,
+    get_users_with_setting,
+    get_schedule_fingerprints,
+    save_schedule_fingerprints,
+)
+
+# Уведомления об изменениях расписания.
+# Для каждого подписчика хранится компактный отпечаток недели: по одной записи
+# (date, started_at, subject_name, teacher_name, room_name) на занятие.
+# При проверке сравниваются только отпечатки, пользователю уходят лишь
+# добавленные, отмененные и перенесенные занятия
+
+SCHEDULE_WATCH_INTERVAL = float(os.getenv("SCHEDULE_WATCH_INTERVAL", "1800"))
+SCHEDULE_WATCH_CONCURRENCY = int(os.getenv("SCHEDULE_WATCH_CONCURRENCY", "10"))
+
+SCHEDULE_CHANGES_SETTING = "schedule_changes"
+
+
+def lesson_fingerprints(schedule: list) -> list:
+    fingerprints = {
+        (
+            item.get("date"),
+            item.get("started_at"),
+            item.get("subject_name"),
+            item.get("teacher_name"),
+            item.get("room_name"),
+        )
+        for item in schedule
+    }
+    return sorted(fingerprints, key=lambda fp: tuple(value or "" for value in fp))
+
+
+def diff_fingerprints(old: list, new: list) -> tuple:
+    # Возвращает (added, cancelled, moved); moved - пары (было, стало)
+    old_set, new_set = set(map(tuple, old)), set(map(tuple, new))
+    removed = sorted(old_set - new_set, key=str)
+    added = sorted(new_set - old_set, key=str)
+
+    # Тот же предмет у того же преподавателя в тот же день, но другое время или аудитория - перенос
+    added_by_key = defaultdict(list)
+    for lesson in added:
+        added_by_key[(lesson[0], lesson[2], lesson[3])].append(lesson)
+    moved, cancelled = [], []
+    for lesson in removed:
+        candidates = added_by_key.get((lesson[0], lesson[2], lesson[3]))
+        if candidates:
+            moved.append((lesson, candidates.pop(0)))
+        else:
+            cancelled.append(lesson)
+    added = [lesson for lessons in added_by_key.values() for lesson in lessons]
+    return sorted(added, key=str), cancelled, moved
+
+
+def _lesson_md(lesson: tuple) -> str:
+    date, started_at, subject, teacher, room = (escape_for_markdown_v2(str(value or "")) for value in lesson)
+    return f"*{subject}* — {date} {started_at}, {room} \\({teacher}\\)"
+
+
+def changes_to_markdown(added: list, cancelled: list, moved: list) -> str:
+    md_lines = ["🔔 *Изменения в расписании*\n"]
+    if added:
+        md_lines.append("➕ *Добавлено:*")
+        md_lines.extend(_lesson_md(lesson) for lesson in added)
+        md_lines.append("")
+    if cancelled:
+        md_lines.append("❌ *Отменено:*")
+        md_lines.extend(_lesson_md(lesson) for lesson in cancelled)
+        md_lines.append("")
+    if moved:
+        md_lines.append("🔀 *Перенесено:*")
+        for before, after in moved:
+            md_lines.append(f"{_lesson_md(before)}\n   ➜ {_lesson_md(after)}")
+        md_lines.append("")
+    return "\n".join(md_lines)
+
+
+async def check_user(outbox: Outbox, user_id: int, start_date, end_date):
+    credentials = await get_active_account_full(user_id)
+    if not credentials:
+        return
+    # Подписчики одной группы делят одну загрузку за цикл проверки
+    schedule, _ = await get_group_schedule(
+        user_id, credentials, start_date, end_date, max_age=SCHEDULE_WATCH_INTERVAL / 2
+    )
+    new = lesson_fingerprints(schedule)
+    week = start_date.isoformat()
+
+    stored = await get_schedule_fingerprints(user_id)
+    if stored and stored[0] == week:
+        added, cancelled, moved = diff_fingerprints(stored[1], new)
+        if not (added or cancelled or moved):
+            return
+        await outbox.send_message(
+            user_id,
+            changes_to_markdown(added, cancelled, moved),
+            priority=PRIORITY_BULK,
+            parse_mode=ParseMode.MARKDOWN_V2,
+        )
+    await save_schedule_fingerprints(user_id, week, [list(fp) for fp in new])
+
+
+async def schedule_watcher(outbox: Outbox):
+    semaphore = asyncio.Semaphore(SCHEDULE_WATCH_CONCURRENCY)
+
+    async def guarded(user_id: int, start_date, end_date):
+        async with semaphore:
+            try:
+                await check_user(outbox, user_id, start_date, end_date)
+            except Exception as e:
+                logging.warning("Проверка изменений расписания для пользователя %d не удалась: %s", user_id, e)
+
+    while True:
+        try:
+            start_date, end_date, _ = get_current_week_range()
+            subscribers = await get_users_with_setting(SCHEDULE_CHANGES_SETTING)
+            await asyncio.gather(*(guarded(user_id, start_date, end_date) for user_id in subscribers))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error("Ошибка проверки изменений расписания: %s", e)
+        await asyncio.sleep(SCHEDULE_WATCH_INTERVAL)
@@ -0,0 +1,284 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import os
+import queue as queue_module
+import time
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from webhook import HEALTH_PATH, WEBHOOK_BASE_URL, WEBHOOK_HOST, WEBHOOK_MAX_CONNECTIONS, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+# Многопроцессный режим: процесс-супервизор получает апдейты (polling или webhook)
+# и раздает их N рабочим процессам по хэшу user_id. Все апдейты одного пользователя
+# попадают в один процесс и обрабатываются там строго по очереди, поэтому
+# порядок сообщений, состояние FSM и кэши пользователя остаются согласованными.
+# Каждый рабочий процесс - полноценный бот со своим event loop, Dispatcher и Bot.
+# У каждого процесса свой outbox, поэтому общий лимит отправки Telegram на бота
+# (OUTBOX_GLOBAL_RATE и OUTBOX_GLOBAL_BURST) делится на число процессов: оно передается
+# в worker_env как OUTBOX_PROCESSES (см. TelegramBot.run_sharded).
+# Упавший рабочий процесс перезапускается с новой очередью: апдейты, оставшиеся
+# в очереди упавшего процесса, теряются (их число пишется в лог и в stats)
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "1000"))
+# Сколько ждать готовности рабочих процессов при запуске и их завершения при остановке, с
+SHARD_START_TIMEOUT = float(os.getenv("SHARD_START_TIMEOUT", "120"))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "60"))
+# Сколько апдейт ждет места в заполненной очереди процесса, прежде чем будет отброшен, с
+SHARD_PUT_TIMEOUT = float(os.getenv("SHARD_PUT_TIMEOUT", "5"))
+# Как часто супервизор проверяет, что рабочие процессы живы, с
+SHARD_MONITOR_INTERVAL = float(os.getenv("SHARD_MONITOR_INTERVAL", "5"))
+
+
+class WorkerApp:
+    # То, что возвращает фабрика рабочего процесса
+    def __init__(self, dp: Dispatcher, bot: Bot, on_shutdown=None):
+        self.dp = dp
+        self.bot = bot
+        self.on_shutdown = on_shutdown
+
+
+def update_user_id(update: dict) -> int:
+    # user_id автора апдейта (message.from, callback_query.from, ...), иначе id чата
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and "id" in user:
+            return int(user["id"])
+        chat = value.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return int(chat["id"])
+    return 0
+
+
+def shard_for(user_id: int, workers: int) -> int:
+    return abs(user_id) % workers
+
+
+async def _feed_after(previous: asyncio.Task | None, app: WorkerApp, update: dict):
+    if previous is not None:
+        await asyncio.wait([previous])
+    try:
+        await app.dp.feed_raw_update(app.bot, update)
+    except Exception as e:
+        logging.error("Ошибка обработки апдейта %s: %s", update.get("update_id"), e)
+
+
+async def _worker_loop(index: int, workers: int, queue, events, app_factory):
+    app: WorkerApp = await app_factory(index, workers)
+    loop = asyncio.get_running_loop()
+    # Последняя задача каждого пользователя: новый апдейт ждет предыдущий
+    chains: dict[int, asyncio.Task] = {}
+    processed = 0
+    events.put(("ready", index))
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            user_id, update = item
+            task = asyncio.create_task(_feed_after(chains.get(user_id), app, update))
+            chains[user_id] = task
+            task.add_done_callback(lambda t, uid=user_id: chains.pop(uid, None) if chains.get(uid) is t else None)
+            processed += 1
+        if chains:
+            await asyncio.wait(list(chains.values()))
+    finally:
+        if app.on_shutdown:
+            await app.on_shutdown()
+        events.put(("done", index, processed))
+
+
+def worker_main(index: int, workers: int, queue, events, app_factory):
+    # Точка входа рабочего процесса
+    asyncio.run(_worker_loop(index, workers, queue, events, app_factory))
+
+
+class ShardSupervisor:
+    def __init__(self, workers: int, app_factory, worker_env: dict | None = None, queue_size: int = SHARD_QUEUE_SIZE):
+        # app_factory(index, workers) -> WorkerApp: async функция уровня модуля (передается в процесс по имени)
+        self.workers = workers
+        self.app_factory = app_factory
+        self.worker_env = worker_env or {}
+        self.queue_size = queue_size
+        self._ctx = mp.get_context("spawn")
+        self._queues = [self._ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._events = self._ctx.Queue()
+        self._processes: list = [None] * workers
+        self._monitor_task: asyncio.Task | None = None
+        self.dispatched = [0] * workers
+        self.dropped = [0] * workers
+        self.restarts = [0] * workers
+        self.processed: dict[int, int] = {}
+
+    def _spawn(self, index: int):
+        # Переменные окружения наследуются процессом при запуске и действуют уже при импорте модулей
+        saved_env = {name: os.environ.get(name) for name in self.worker_env}
+        os.environ.update(self.worker_env)
+        try:
+            process = self._ctx.Process(
+                target=worker_main,
+                args=(index, self.workers, self._queues[index], self._events, self.app_factory),
+                name=f"bot-shard-{index}",
+                daemon=True,
+            )
+            process.start()
+        finally:
+            for name, value in saved_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+        self._processes[index] = process
+
+    def _wait_events(self, kind: str, indices: set, timeout: float) -> list:
+        # Ждет событие kind от каждого процесса из indices. RuntimeError, если процесс
+        # завершился, не отправив событие, или событий не было за timeout секунд
+        received = {}
+        deadline = time.monotonic() + timeout
+        while len(received) < len(indices):
+            try:
+                event = self._events.get(timeout=1)
+                if event[0] == kind and event[1] in indices:
+                    received[event[1]] = event
+                continue
+            except queue_module.Empty:
+                pass
+            for index in indices - received.keys():
+                process = self._processes[index]
+                if not process.is_alive():
+                    raise RuntimeError(f"Рабочий процесс {process.name} завершился с кодом {process.exitcode}")
+            if time.monotonic() > deadline:
+                waiting = sorted(indices - received.keys())
+                raise RuntimeError(f"Рабочие процессы {waiting} не ответили ({kind}) за {timeout:.0f} с")
+        return list(received.values())
+
+    async def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        try:
+            await asyncio.to_thread(self._wait_events, "ready", set(range(self.workers)), SHARD_START_TIMEOUT)
+        except RuntimeError:
+            self._terminate()
+            raise
+        self._monitor_task = asyncio.create_task(self._monitor())
+        logging.info("Запущено рабочих процессов: %d", self.workers)
+
+    async def _monitor(self):
+        # Перезапускает упавшие рабочие процессы. Очередь упавшего процесса заменяется новой:
+        # процесс мог погибнуть, удерживая ее блокировку, и новый процесс завис бы на get()
+        while True:
+            await asyncio.sleep(SHARD_MONITOR_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                try:
+                    lost = self._queues[index].qsize()
+                except NotImplementedError:
+                    lost = 0
+                self.dropped[index] += lost
+                self.restarts[index] += 1
+                logging.error(
+                    "Рабочий процесс %s завершился с кодом %s, перезапуск (потеряно апдейтов в очереди: %d)",
+                    process.name, process.exitcode, lost,
+                )
+                self._queues[index] = self._ctx.Queue(maxsize=self.queue_size)
+                self._spawn(index)
+
+    async def dispatch(self, update: dict):
+        user_id = update_user_id(update)
+        index = shard_for(user_id, self.workers)
+        self.dispatched[index] += 1
+        queue = self._queues[index]
+        try:
+            queue.put_nowait((user_id, update))
+        except queue_module.Full:
+            # Очередь процесса заполнена - ждем, не блокируя event loop, но не дольше SHARD_PUT_TIMEOUT
+            try:
+                await asyncio.to_thread(queue.put, (user_id, update), True, SHARD_PUT_TIMEOUT)
+            except queue_module.Full:
+                self.dropped[index] += 1
+                logging.error("Очередь рабочего процесса %d заполнена, апдейт %s отброшен", index, update.get("update_id"))
+
+    def _terminate(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+
+    async def stop(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        alive = {index for index, process in enumerate(self._processes) if process.is_alive()}
+        for index in alive:
+            try:
+                await asyncio.to_thread(self._queues[index].put, None, True, SHARD_PUT_TIMEOUT)
+            except queue_module.Full:
+                logging.error("Рабочий процесс %d не принял сигнал остановки", index)
+        try:
+            for _, index, processed in await asyncio.to_thread(self._wait_events, "done", alive, SHARD_STOP_TIMEOUT):
+                self.processed[index] = processed
+        except RuntimeError as e:
+            logging.error("Рабочие процессы не завершились штатно: %s", e)
+        for process in self._processes:
+            await asyncio.to_thread(process.join, 10)
+        self._terminate()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for process in self._processes if process is not None and process.is_alive()),
+            "dispatched": list(self.dispatched),
+            "dropped": list(self.dropped),
+            "restarts": list(self.restarts),
+        }
+
+
+async def receive_polling(bot: Bot, dp: Dispatcher, supervisor: ShardSupervisor):
+    # Long polling в супервизоре: апдейты не обрабатываются, а раздаются процессам
+    allowed_updates = dp.resolve_used_update_types()
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error("Ошибка получения апдейтов: %s", e)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            await supervisor.dispatch(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+
+async def receive_webhook(bot: Bot, dp: Dispatcher, supervisor: ShardSupervisor):
+    if not WEBHOOK_BASE_URL or not WEBHOOK_SECRET:
+        raise ValueError("Для режима webhook нужны WEBHOOK_BASE_URL и WEBHOOK_SECRET")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        await supervisor.dispatch(await request.json())
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", **supervisor.stats()})
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get(HEALTH_PATH, health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+import os
+
+from metrics import FILE_WRITE_SECONDS
+
+# Фоновая запись снимков JSON/Markdown на диск.
+# Хендлеры только кладут снимок в очередь (без ожидания диска), фоновая задача
+# пачками пишет их из потока. Каждый файл пишется атомарно: во временный файл,
+# затем os.replace. Повторный снимок того же файла заменяет еще не записанный,
+# а при переполнении очереди новые снимки отбрасываются - ответ пользователю важнее
+
+SNAPSHOT_MAX_PENDING = int(os.getenv("SNAPSHOT_MAX_PENDING", "2000"))
+SNAPSHOT_BATCH_SIZE = int(os.getenv("SNAPSHOT_BATCH_SIZE", "100"))
+SNAPSHOT_FLUSH_INTERVAL = float(os.getenv("SNAPSHOT_FLUSH_INTERVAL", "1.0"))
+
+
+class SnapshotWriter:
+    def __init__(
+        self,
+        on_written=None,
+        max_pending: int = SNAPSHOT_MAX_PENDING,
+        batch_size: int = SNAPSHOT_BATCH_SIZE,
+        flush_interval: float = SNAPSHOT_FLUSH_INTERVAL,
+    ):
+        # on_written(path) вызывается в event loop после успешной записи файла
+        self.on_written = on_written
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.failed = 0
+        # path -> (kind, payload); сериализация JSON тоже выполняется в потоке записи
+        self._pending: dict[str, tuple[str, object]] = {}
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+    def enqueue_json(self, file_path: str, data):
+        self._enqueue(file_path, "json", data)
+
+    def enqueue_text(self, file_path: str, text: str):
+        self._enqueue(file_path, "text", text)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _enqueue(self, file_path: str, kind: str, payload):
+        if file_path in self._pending:
+            self.coalesced += 1
+        elif len(self._pending) >= self.max_pending:
+            self.dropped += 1
+            logging.warning("Очередь снимков переполнена, файл %s не будет записан", file_path)
+            return
+        self._pending[file_path] = (kind, payload)
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    @staticmethod
+    def _write_batch(batch: dict) -> tuple[list[str], int]:
+        written, failed = [], 0
+        for file_path, (kind, payload) in batch.items():
+            tmp_path = f"{file_path}.tmp"
+            try:
+                if kind == "json":
+                    content = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+                else:
+                    content = payload
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(content)
+                os.replace(tmp_path, file_path)
+                written.append(file_path)
+            except (OSError, TypeError, ValueError) as e:
+                failed += 1
+                logging.error("Ошибка при сохранении файла %s: %s", file_path, e)
+        return written, failed
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                with FILE_WRITE_SECONDS.time():
+                    written, failed = await asyncio.to_thread(self._write_batch, batch)
+                self.written += len(written)
+                self.failed += failed
+                if self.on_written:
+                    for file_path in written:
+                        self.on_written(file_path)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "written": self.written,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import os
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# Режим webhook: встроенный aiohttp сервер вместо long polling.
+# Telegram присылает апдейты POST-запросами, секретный токен проверяется
+# по заголовку X-Telegram-Bot-Api-Secret-Token. Апдейты обрабатываются в фоне,
+# сервер сразу отвечает 200, число одновременных хендлеров ограничено middleware
+
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")  # публичный https адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/healthz")
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, secret_token: str | None, health=None) -> web.Application:
+    # health - функция без аргументов, возвращающая dict для /healthz
+    app = web.Application()
+
+    async def health_handler(request: web.Request) -> web.Response:
+        payload = {"status": "ok"}
+        if health:
+            payload.update(health())
+        return web.json_response(payload)
+
+    app.router.add_get(HEALTH_PATH, health_handler)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret_token,
+        handle_in_background=True,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, health=None):
+    if not WEBHOOK_BASE_URL:
+        raise ValueError("WEBHOOK_BASE_URL не задан для режима webhook")
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не задан для режима webhook")
+
+    app = build_webhook_app(dp, bot, WEBHOOK_SECRET, health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    await bot.set_webhook(
+        f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+    )
+    logging.info("Webhook сервер запущен на %s:%d%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
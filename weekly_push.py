@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from aiogram.enums import ParseMode
+
+from outbox import Outbox, PRIORITY_BULK
+from schedule_cache import get_group_schedule
+from database.db import (
+    get_active_account_full,
+    get_active_accounts_page,
+    get_users_with_setting,
+    get_job_state,
+    save_job_state,
+)
+
+# Еженедельная задача: до утреннего пика заранее загружает расписание на неделю
+# для всех активных аккаунтов (один запрос на группу) и рассылает его подписчикам.
+# Прогресс сохраняется после каждой страницы аккаунтов, после перезапуска
+# задача продолжает с последнего обработанного user_id
+
+WEEKLY_JOB_WEEKDAY = int(os.getenv("WEEKLY_JOB_WEEKDAY", "0"))  # 0 - понедельник
+WEEKLY_JOB_TIME = os.getenv("WEEKLY_JOB_TIME", "06:30")
+WEEKLY_JOB_CONCURRENCY = int(os.getenv("WEEKLY_JOB_CONCURRENCY", "10"))
+WEEKLY_JOB_PAGE_SIZE = int(os.getenv("WEEKLY_JOB_PAGE_SIZE", "500"))
+# Сколько держать загруженное заранее расписание свежим в кэше
+WEEKLY_PREFETCH_TTL = float(os.getenv("WEEKLY_PREFETCH_TTL", "10800"))
+
+WEEKLY_PUSH_SETTING = "weekly_push"
+
+
+def last_run_moment(now: datetime) -> datetime:
+    # Последний плановый запуск не позже now
+    hour, minute = map(int, WEEKLY_JOB_TIME.split(":"))
+    run_at = (now - timedelta(days=(now.weekday() - WEEKLY_JOB_WEEKDAY) % 7)).replace(
+        hour=hour, minute=minute, second=0, microsecond=0
+    )
+    if run_at > now:
+        run_at -= timedelta(days=7)
+    return run_at
+
+
+def target_week(run_at: datetime) -> tuple:
+    # Неделя, которую готовит запуск: ближайший понедельник (или день запуска, если это понедельник)
+    monday = run_at.date() + timedelta(days=(7 - run_at.weekday()) % 7)
+    return monday, monday + timedelta(days=6)
+
+
+async def _process_group(outbox: Outbox, semaphore: asyncio.Semaphore, members: list, start, end, subscribers: set):
+    # Одна загрузка на группу: пробуем аккаунты по очереди, пока один не сработает
+    markdown_text = None
+    async with semaphore:
+        for user_id in members:
+            credentials = await get_active_account_full(user_id)
+            if not credentials:
+                continue
+            try:
+                _, markdown_text = await get_group_schedule(user_id, credentials, start, end, ttl=WEEKLY_PREFETCH_TTL)
+                break
+            except Exception as e:
+                logging.warning("Предзагрузка расписания для пользователя %d не удалась: %s", user_id, e)
+    if markdown_text is None:
+        return 0, False
+
+    pushed = 0
+    for user_id in members:
+        if user_id not in subscribers:
+            continue
+        try:
+            await outbox.send_message(user_id, markdown_text, priority=PRIORITY_BULK, parse_mode=ParseMode.MARKDOWN_V2)
+            pushed += 1
+        except Exception as e:
+            logging.warning("Не удалось отправить расписание пользователю %d: %s", user_id, e)
+    return pushed, True
+
+
+async def run_weekly_job(outbox: Outbox, run_at: datetime):
+    start, end = target_week(run_at)
+    job_id = f"weekly_schedule:{start.isoformat()}"
+    state = await get_job_state(job_id) or {}
+    if state.get("done"):
+        return
+
+    after_user_id = state.get("last_user_id")
+    counters = {key: state.get(key, 0) for key in ("groups", "failed_groups", "pushed")}
+    subscribers = set(await get_users_with_setting(WEEKLY_PUSH_SETTING))
+    semaphore = asyncio.Semaphore(WEEKLY_JOB_CONCURRENCY)
+    logging.info(
+        "Еженедельная задача %s: старт (продолжение после user_id=%s, подписчиков %d)",
+        job_id, after_user_id, len(subscribers),
+    )
+
+    while True:
+        page = await get_active_accounts_page(after_user_id, WEEKLY_JOB_PAGE_SIZE)
+        if not page:
+            break
+
+        groups = defaultdict(list)
+        for user_id, _, group in page:
+            groups[group or f"user:{user_id}"].append(user_id)
+
+        results = await asyncio.gather(
+            *(_process_group(outbox, semaphore, members, start, end, subscribers) for members in groups.values())
+        )
+        for pushed, ok in results:
+            counters["groups" if ok else "failed_groups"] += 1
+            counters["pushed"] += pushed
+
+        after_user_id = page[-1][0]
+        await save_job_state(job_id, last_user_id=after_user_id, **counters)
+
+    await save_job_state(job_id, done=True, **counters)
+    logging.info("Еженедельная задача %s завершена: %s", job_id, counters)
+
+
+async def weekly_scheduler(outbox: Outbox):
+    while True:
+        now = datetime.now()
+        run_at = last_run_moment(now)
+        start, _ = target_week(run_at)
+        # Пропущенный или прерванный запуск имеет смысл, пока не закончился первый день недели
+        if now < datetime.combine(start + timedelta(days=1), datetime.min.time()):
+            try:
+                await run_weekly_job(outbox, run_at)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error("Ошибка еженедельной задачи, повтор через 5 минут: %s", e)
+                await asyncio.sleep(300)
+                continue
+        next_run = run_at + timedelta(days=7)
+        await asyncio.sleep(max((next_run - datetime.now()).total_seconds(), 1))